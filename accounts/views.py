@@ -271,8 +271,7 @@ def public_profile(request: HttpRequest, username: str) -> HttpResponse:
 
     ads = (
         Ad.objects.filter(user=user, status=Ad.Status.APPROVED, image_processing_done=True)
-        .select_related("city")
-        .prefetch_related("media")
+        .cards()
         .order_by("-created_at")
     )
 
@@ -0,0 +1,112 @@
+"""
+Statistiques quotidiennes des annonces (tableau de bord de l'annonceur).
+
+  - Les événements bruts (vue comptée, mise en favori) sont poussés dans un flux
+    différé (ads.counters.PendingEvents) puis ajoutés à AdEvent par lots
+    (bulk_create), au flush de flush_ad_counters.
+  - La tâche horaire rollup_ad_stats recalcule les ROLLUP_DAYS derniers jours de
+    AdDailyStats (vues et favoris depuis AdEvent, clics depuis AdContactDaily) :
+    le calcul remplace les valeurs, il peut être rejoué sans double comptage.
+    Les événements plus vieux que RAW_EVENT_RETENTION sont ensuite supprimés.
+  - Le tableau de bord ne lit que AdDailyStats (daily_series).
+"""
+from datetime import datetime, timedelta
+
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .counters import PendingEvents
+from .models import Ad, AdContactDaily, AdDailyStats, AdEvent
+
+ROLLUP_DAYS = 2  # aujourd'hui et hier (événements flushés après minuit)
+RAW_EVENT_RETENTION = timedelta(days=7)
+CHART_DAYS = 14
+
+
+def _apply(events) -> None:
+    rows = []
+    for event in events:
+        ad_id, kind, ts = event.split("|")
+        rows.append((int(ad_id), kind, datetime.fromisoformat(ts)))
+    # Annonces supprimées entre l'événement et le flush : ignorées
+    existing = set(Ad.objects.filter(pk__in={r[0] for r in rows}).values_list("pk", flat=True))
+    AdEvent.objects.bulk_create(
+        [AdEvent(ad_id=ad_id, kind=kind, created_at=ts) for ad_id, kind, ts in rows if ad_id in existing],
+        batch_size=1000,
+    )
+
+
+_events = PendingEvents("ad_events", _apply)
+
+
+def record_event(ad_id: int, kind: str) -> None:
+    _events.push(f"{ad_id}|{kind}|{timezone.now().isoformat()}")
+
+
+def flush_events() -> int:
+    """Ajoute les événements en attente à AdEvent. Retourne leur nombre."""
+    return _events.flush()
+
+
+def rollup_daily_stats(days: int = ROLLUP_DAYS) -> int:
+    """Recalcule AdDailyStats pour les `days` derniers jours. Retourne le nombre de lignes écrites."""
+    today = timezone.localdate()
+    since_day = today - timedelta(days=days - 1)
+    since = timezone.make_aware(datetime.combine(since_day, datetime.min.time()))
+
+    stats = {}
+
+    def row(ad_id, day):
+        return stats.setdefault((ad_id, day), {"views": 0, "contacts": 0, "favorites": 0})
+
+    events = (
+        AdEvent.objects.filter(created_at__gte=since)
+        .annotate(day=TruncDate("created_at", tzinfo=timezone.get_current_timezone()))
+        .values_list("ad_id", "day", "kind")
+        .annotate(n=Count("id"))
+        .order_by()
+    )
+    for ad_id, day, kind, n in events:
+        row(ad_id, day)["views" if kind == AdEvent.Kind.VIEW else "favorites"] += n
+
+    contacts = (
+        AdContactDaily.objects.filter(day__gte=since_day)
+        .values_list("ad_id", "day")
+        .annotate(n=Sum("count"))
+        .order_by()
+    )
+    for ad_id, day, n in contacts:
+        row(ad_id, day)["contacts"] += n
+
+    AdDailyStats.objects.bulk_create(
+        [AdDailyStats(ad_id=ad_id, day=day, **values) for (ad_id, day), values in stats.items()],
+        update_conflicts=True,
+        unique_fields=["ad", "day"],
+        update_fields=["views", "contacts", "favorites"],
+        batch_size=500,
+    )
+    AdEvent.objects.filter(created_at__lt=timezone.now() - RAW_EVENT_RETENTION).delete()
+    return len(stats)
+
+
+def daily_series(ad_ids, days: int = CHART_DAYS) -> dict:
+    """
+    {ad_id: [{"day", "views", "contacts", "favorites"}, ...]} sur les `days` derniers
+    jours (jours sans activité à zéro), lu en une requête sur AdDailyStats.
+    """
+    ad_ids = list(ad_ids)
+    today = timezone.localdate()
+    day_list = [today - timedelta(days=offset) for offset in range(days - 1, -1, -1)]
+    rows = AdDailyStats.objects.filter(ad_id__in=ad_ids, day__gte=day_list[0]).values_list(
+        "ad_id", "day", "views", "contacts", "favorites"
+    )
+    by_key = {(ad_id, day): (v, c, f) for ad_id, day, v, c, f in rows}
+    series = {}
+    for ad_id in ad_ids:
+        points = []
+        for day in day_list:
+            views, contacts, favorites = by_key.get((ad_id, day), (0, 0, 0))
+            points.append({"day": day, "views": views, "contacts": contacts, "favorites": favorites})
+        series[ad_id] = points
+    return series
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class AdsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "ads"
+
+    def ready(self):  # pragma: no cover
+        from django.db.models.signals import post_migrate
+
+        # Maintenance du fil public précalculé (AdFeedEntry)
+        from . import signals  # noqa: F401
+        from .search import ensure_search_index
+
+        # SQLite : recréer les triggers de l'index FTS5 après une reconstruction de ads_ad
+        post_migrate.connect(ensure_search_index, sender=self)
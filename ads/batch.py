@@ -0,0 +1,346 @@
+"""
+Traitement par lots des photos d'annonces (backfills : filigrane, miniatures).
+
+Les commandes apply_watermark_to_existing_images, generate_thumbnails et
+regenerate_thumbnails passent par run_batch :
+
+  - les ids des AdMedia sont lus par ordre de pk en flux (iterator(chunk_size)),
+    par paquets de `chunk_size` ;
+  - chaque paquet part vers un processus d'un ProcessPoolExecutor (`workers`
+    processus, un par cœur par défaut) qui lit ses lignes, traite les images,
+    écrit les fichiers dans le storage et renvoie les valeurs des colonnes ;
+  - le processus principal écrit ces valeurs en un bulk_update par paquet, puis
+    resynchronise la photo de carte et le fil des annonces touchées (bulk_update
+    ne déclenche pas les signaux post_save) ;
+  - après chaque paquet terminé (dans l'ordre des pk), le point de reprise
+    (fichier JSON) reçoit le dernier pk traité : une commande interrompue
+    reprend là où elle s'était arrêtée.
+
+Avec workers=1 tout se fait dans le processus courant (tests, petits volumes).
+
+Le cron horaire (cron_apply_watermarks) draine les photos sans filigrane avec
+drain_pending_watermarks : des tours successifs réservent un paquet dans une
+transaction courte (SELECT ... FOR UPDATE SKIP LOCKED sur l'index partiel
+admedia_pending_wm_idx, puis un bail en cache par photo, valable la durée
+maximale de la fonction), le traitent hors transaction dans un pool de threads
+(Pillow relâche le GIL pendant réductions et encodages) et l'écrivent par petits
+lots de APPLY_BATCH photos, chacun dans sa transaction et seulement pour les
+photos encore sans filigrane. Une exécution coupée par le timeout de la
+plateforme ne perd que le lot en cours. La taille de chaque tour est ajustée au
+temps restant d'après la durée mesurée par image.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+
+from core.cache_utils import acquire_lock, release_lock
+
+from .feed import sync_feed
+from .imaging import decode_scaled, encode, thumbnail_of
+from .models import AdMedia, sync_primary_thumbnail
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 100
+
+MAX_CLAIM = 200  # photos réservées au plus par tour du cron
+BUDGET_MARGIN = 0.8  # part du temps restant planifiée pour un tour
+APPLY_BATCH = 10  # photos écrites par transaction pendant un tour
+
+
+def default_workers() -> int:
+    """Cœurs utilisables par ce processus (affinité / quota du conteneur si connue)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+
+# ─── Opérations (exécutées dans les processus fils) ──────────────────────────
+
+def _watermark(media: AdMedia):
+    """Filigrane + image optimisée + miniature + variantes (AdMedia._add_watermark_and_thumbnail)."""
+    media._watermark_applied = False
+    if not media._add_watermark_and_thumbnail():
+        return None
+    return {
+        "image": media.image.name,
+        "thumbnail": media.thumbnail.name,
+        "has_watermark": media.has_watermark,
+        "variants": media.variants,
+    }
+
+
+def _thumbnail(media: AdMedia):
+    """Miniature seule, depuis l'image déjà filigranée."""
+    with media.image.open("rb") as f:
+        img, _ = decode_scaled(f)
+    content = ContentFile(encode(thumbnail_of(img), BytesIO(), format="WEBP", quality=50, method=6))
+    content.content_type = "image/webp"
+    media.thumbnail.save(os.path.splitext(media.image.name)[0] + "_thumb.webp", content, save=False)
+    return {"thumbnail": media.thumbnail.name}
+
+
+# nom → (fonction, colonnes écrites)
+OPERATIONS = {
+    "watermark": (_watermark, AdMedia.PROCESSED_FIELDS),
+    "thumbnail": (_thumbnail, ["thumbnail"]),
+}
+
+
+def _run_one(operation: str, media: AdMedia):
+    """Valeurs des colonnes après traitement de `media`, None en cas d'échec."""
+    func, _ = OPERATIONS[operation]
+    try:
+        return func(media) if media.image else None
+    except Exception as e:
+        logger.warning("Traitement %s impossible pour AdMedia %s : %s", operation, media.pk, e)
+        return None
+
+
+def _run_in_thread(operation: str, media: AdMedia):
+    """
+    _run_one dans un thread du pool du cron : toute connexion ouverte par ce
+    thread (accès ORM pendant le traitement) est fermée à la fin de l'image.
+    """
+    try:
+        return _run_one(operation, media)
+    finally:
+        connections.close_all()
+
+
+def _split(medias, results) -> tuple:
+    done, failed = [], []
+    for media, values in zip(medias, results):
+        if values is None:
+            failed.append(media.pk)
+        else:
+            done.append((media.pk, media.ad_id, values))
+    return done, failed
+
+
+def process_chunk(operation: str, ids: list) -> tuple:
+    """
+    Traite les AdMedia `ids` : ([(pk, ad_id, valeurs), ...], [pk en échec]).
+    Aucune écriture en base : le processus principal regroupe les mises à jour.
+    """
+    medias = list(AdMedia.objects.filter(pk__in=ids).order_by("pk"))
+    return _split(medias, [_run_one(operation, media) for media in medias])
+
+
+# ─── Point de reprise ─────────────────────────────────────────────────────────
+
+def read_checkpoint(path, operation: str) -> int:
+    """Dernier pk traité enregistré pour `operation` (0 sans point de reprise)."""
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        state = json.load(f)
+    return int(state.get("last_pk", 0)) if state.get("operation") == operation else 0
+
+
+def write_checkpoint(path, operation: str, last_pk: int) -> None:
+    if not path:
+        return
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"operation": operation, "last_pk": last_pk}, f)
+    os.replace(tmp, path)  # écriture atomique : jamais de fichier à moitié écrit
+
+
+# ─── Moteur ──────────────────────────────────────────────────────────────────
+
+def _chunks(queryset, chunk_size: int, after_pk: int, limit=None):
+    ids = (
+        queryset.filter(pk__gt=after_pk).order_by("pk")
+        .values_list("pk", flat=True).iterator(chunk_size=chunk_size)
+    )
+    chunk, seen = [], 0
+    for pk in ids:
+        if limit is not None and seen >= limit:
+            break
+        chunk.append(pk)
+        seen += 1
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _apply(operation: str, done: list) -> None:
+    """Écrit les résultats d'un paquet (un bulk_update) et resynchronise les annonces touchées."""
+    if not done:
+        return
+    _, fields = OPERATIONS[operation]
+    rows = [AdMedia(pk=pk, **values) for pk, _, values in done]
+    ad_ids = sorted({ad_id for _, ad_id, _ in done})
+    with transaction.atomic():
+        AdMedia.objects.bulk_update(rows, fields, batch_size=len(rows))
+        for ad_id in ad_ids:
+            sync_primary_thumbnail(ad_id)
+        sync_feed(ad_ids)
+
+
+def run_batch(queryset, operation: str, *, workers=None, chunk_size=DEFAULT_CHUNK_SIZE,
+              checkpoint=None, limit=None, on_chunk=None) -> dict:
+    """
+    Applique `operation` (clé de OPERATIONS) aux AdMedia de `queryset`.
+    `checkpoint` : chemin du fichier de reprise ; `on_chunk(done, failed, last_pk)`
+    est appelé après chaque paquet écrit. Retourne {"processed", "failed", "last_pk"}.
+    """
+    if operation not in OPERATIONS:
+        raise ValueError(f"Opération inconnue : {operation}")
+    workers = max(1, workers or default_workers())
+    last_pk = read_checkpoint(checkpoint, operation)
+    totals = {"processed": 0, "failed": 0, "last_pk": last_pk}
+
+    def finish(chunk, done, failed):
+        _apply(operation, done)
+        totals["processed"] += len(done)
+        totals["failed"] += len(failed)
+        totals["last_pk"] = chunk[-1]
+        write_checkpoint(checkpoint, operation, chunk[-1])
+        if on_chunk:
+            on_chunk(done, failed, chunk[-1])
+
+    chunks = _chunks(queryset, chunk_size, last_pk, limit)
+    if workers == 1:
+        for chunk in chunks:
+            finish(chunk, *process_chunk(operation, chunk))
+        return totals
+
+    # Les processus fils (fork) ne doivent pas hériter d'une connexion ouverte :
+    # on ferme celles du parent et on démarre les fils avant toute nouvelle requête.
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork")) as pool:
+        pool.submit(os.getpid).result()
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk, pool.submit(process_chunk, operation, chunk)))
+            # Au plus deux paquets en attente par processus ; résultats écrits dans
+            # l'ordre des pk pour que le point de reprise reste exact.
+            while len(pending) >= workers * 2 or (pending and pending[0][1].done()):
+                chunk_done, future = pending.popleft()
+                finish(chunk_done, *future.result())
+        while pending:
+            chunk_done, future = pending.popleft()
+            finish(chunk_done, *future.result())
+    return totals
+
+
+# ─── Cron : photos sans filigrane ─────────────────────────────────────────────
+
+def _lease_key(pk) -> str:
+    return f"watermark:{pk}"
+
+
+def _claim_pending(size: int, exclude) -> tuple:
+    """
+    Réserve jusqu'à `size` photos sans filigrane : ([photos], [pk déjà prises]).
+    Les verrous de ligne ne durent que le temps de poser les baux en cache
+    (FUNCTION_MAX_DURATION) ; une autre exécution saute les photos sous bail.
+    """
+    lease = int(getattr(settings, "FUNCTION_MAX_DURATION", 60))
+    claimed, busy = [], []
+    with transaction.atomic():
+        candidates = (
+            AdMedia.objects.select_for_update(skip_locked=True)
+            .filter(has_watermark=False)
+            .exclude(pk__in=exclude)
+            .order_by("pk")[:size]
+        )
+        for media in candidates:
+            (claimed if acquire_lock(_lease_key(media.pk), lease) else busy).append(media)
+    return claimed, [media.pk for media in busy]
+
+
+def _apply_pending(done: list) -> int:
+    """Écrit un lot du cron, seulement pour les photos encore sans filigrane ; nombre écrit."""
+    if not done:
+        return 0
+    with transaction.atomic():
+        pending = set(
+            AdMedia.objects.select_for_update()
+            .filter(pk__in=[pk for pk, _, _ in done], has_watermark=False)
+            .values_list("pk", flat=True)
+        )
+        done = [row for row in done if row[0] in pending]
+        _apply("watermark", done)
+    return len(done)
+
+
+def drain_pending_watermarks(budget=None, workers=None) -> dict:
+    """
+    Applique le filigrane aux photos qui n'en ont pas, par tours, tant que le
+    budget de temps (secondes) le permet. Le premier tour prend une photo par
+    thread pour mesurer la durée d'une image ; les suivants sont dimensionnés
+    pour tenir dans BUDGET_MARGIN du temps restant.
+    Retourne les métriques de débit de l'exécution.
+    """
+    budget = budget if budget is not None else getattr(settings, "WATERMARK_CRON_BUDGET", 50)
+    workers = max(1, workers or getattr(settings, "WATERMARK_CRON_WORKERS", 4))
+    start = time.monotonic()
+    stats = {"processed": 0, "errors": 0, "rounds": 0}
+    skipped = set()  # en échec (non retentées) ou sous bail d'une autre exécution
+    seconds_per_image = None  # par thread, mesuré sur le tour précédent
+    more = True
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            remaining = budget - (time.monotonic() - start)
+            if seconds_per_image is None:
+                size = workers
+            else:
+                size = int(remaining * BUDGET_MARGIN / seconds_per_image * workers)
+            size = min(size, MAX_CLAIM)
+            if remaining <= 0 or size < 1:
+                break
+            round_start = time.monotonic()
+            medias, busy = _claim_pending(size, skipped)
+            skipped.update(busy)
+            if not medias:
+                if busy:
+                    continue
+                more = False
+                break
+            try:
+                batch = []
+                results = pool.map(lambda m: _run_in_thread("watermark", m), medias)
+                for media, values in zip(medias, results):
+                    if values is None:
+                        stats["errors"] += 1
+                        skipped.add(media.pk)
+                        continue
+                    batch.append((media.pk, media.ad_id, values))
+                    if len(batch) >= APPLY_BATCH:
+                        stats["processed"] += _apply_pending(batch)
+                        batch = []
+                stats["processed"] += _apply_pending(batch)
+            finally:
+                for media in medias:
+                    release_lock(_lease_key(media.pk))
+            stats["rounds"] += 1
+            seconds_per_image = (time.monotonic() - round_start) * workers / len(medias)
+
+    if more:
+        # Budget épuisé : reste-t-il des photos ? (index partiel, pas de COUNT)
+        more = AdMedia.objects.filter(has_watermark=False).exclude(pk__in=skipped).exists()
+    elapsed = time.monotonic() - start
+    attempted = stats["processed"] + stats["errors"]
+    stats.update(
+        elapsed_s=round(elapsed, 2),
+        images_per_s=round(attempted / elapsed, 2) if elapsed else 0,
+        ms_per_image=round(elapsed * 1000 / attempted) if attempted else None,
+        workers=workers,
+        more=more,
+    )
+    return stats
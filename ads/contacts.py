@@ -0,0 +1,75 @@
+"""
+Clics sur les boutons de contact (SMS, WhatsApp, appel) d'une annonce.
+
+Chaque clic incrémente un compteur différé (ads.counters.PendingCounter) sous la
+clé "ad_id:canal:jour" ; flush_contact_clicks() les reporte dans AdContactDaily
+(une ligne par annonce, canal et jour). Le tableau de bord lit contact_totals().
+"""
+from datetime import date, timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .counters import PendingCounter
+from .dedupe import first_seen_by
+from .models import Ad, AdContactDaily
+
+CHANNELS = frozenset(AdContactDaily.Channel.values)
+CONTACT_DEDUPE_TTL = 10 * 60  # fenêtre anti-doublon des clics (visiteur, annonce, canal)
+STATS_DAYS = 30
+
+
+def _add(ad_id: int, day: date, channel: str, n: int) -> None:
+    lookup = {"ad_id": ad_id, "day": day, "channel": channel}
+    if AdContactDaily.objects.filter(**lookup).update(count=F("count") + n):
+        return
+    try:
+        with transaction.atomic():
+            AdContactDaily.objects.create(count=n, **lookup)
+    except IntegrityError:  # ligne créée entre-temps par un autre flush
+        AdContactDaily.objects.filter(**lookup).update(count=F("count") + n)
+
+
+def _apply(counts: dict) -> None:
+    parsed = []
+    for key, n in counts.items():
+        ad_id, channel, day = key.split(":")
+        parsed.append((int(ad_id), date.fromisoformat(day), channel, n))
+    # Annonces supprimées entre le clic et le flush : ignorées
+    existing = set(Ad.objects.filter(pk__in={p[0] for p in parsed}).values_list("pk", flat=True))
+    for ad_id, day, channel, n in sorted(parsed):
+        if ad_id in existing:
+            _add(ad_id, day, channel, n)
+
+
+_clicks = PendingCounter("ad_contacts", _apply)
+
+
+def is_first_click(visitors, ad_id: int, channel: str) -> bool:
+    return first_seen_by("contacts", visitors, f"{ad_id}:{channel}", CONTACT_DEDUPE_TTL)
+
+
+def record_contact_click(ad_id: int, channel: str) -> None:
+    day = timezone.localdate().isoformat()
+    _clicks.incr(f"{ad_id}:{channel}:{day}")
+
+
+def flush_contact_clicks() -> int:
+    """Reporte les clics en attente dans AdContactDaily. Retourne le nombre de clics écrits."""
+    return _clicks.flush()
+
+
+def contact_totals(ad_ids, days: int = STATS_DAYS) -> dict:
+    """{ad_id: {canal: clics}} sur les `days` derniers jours (une requête GROUP BY)."""
+    since = timezone.localdate() - timedelta(days=days - 1)
+    rows = (
+        AdContactDaily.objects.filter(ad_id__in=list(ad_ids), day__gte=since)
+        .values_list("ad_id", "channel")
+        .annotate(total=Sum("count"))
+        .order_by()
+    )
+    totals = {}
+    for ad_id, channel, total in rows:
+        totals.setdefault(ad_id, {})[channel] = total
+    return totals
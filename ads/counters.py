@@ -0,0 +1,187 @@
+"""
+Écritures différées (write-behind) : compteurs (vues, clics de contact) et flux
+d'événements bruts (statistiques quotidiennes).
+
+Un enregistrement ne touche pas la base : il va dans une structure Redis
+partagée (hash HINCRBY pour un compteur, liste RPUSH pour un flux) quand le cache
+par défaut est Redis, sinon dans une structure locale au processus. flush()
+reporte le tout en base en une fois via la fonction `apply` (UPDATE / upsert /
+bulk_create en masse) ; il est appelé par la tâche périodique flush_ad_counters
+et, sans Redis, par la requête elle-même toutes les LOCAL_FLUSH_SECONDS (une
+instance serverless n'est pas vue par le cron d'une autre).
+
+Avec Redis, la clé est renommée atomiquement avant d'être lue : les
+enregistrements arrivés pendant l'écriture vont dans une nouvelle clé. Une clé
+« flushing » restante (flush interrompu) est reprise au flush suivant.
+"""
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from django.core.cache import cache, caches
+
+from core.cache_utils import acquire_lock, release_lock
+
+LOCAL_FLUSH_SECONDS = 30
+LOCAL_FLUSH_MAX_KEYS = 200
+
+
+def redis_client():
+    """Client redis brut si le cache par défaut est RedisCache, sinon None."""
+    from django.core.cache.backends.redis import RedisCache
+
+    # `cache` est un ConnectionProxy : le backend réel est caches["default"]
+    backend = caches["default"]
+    if not isinstance(backend, RedisCache):
+        return None
+    return backend._cache.get_client(write=True)
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class _WriteBehind(ABC):
+    """Squelette commun : tampon local ou clé Redis, vidés par flush()."""
+
+    def __init__(self, name: str, apply):
+        self.pending_key = f"{name}:pending"
+        self.flushing_key = f"{name}:flushing"
+        self.apply = apply
+        self._lock = threading.Lock()
+        self._buffer = self._empty()
+        self._flushed_at = time.monotonic()
+
+    @abstractmethod
+    def _empty(self):
+        """Tampon local vide."""
+
+    @abstractmethod
+    def _add_local(self, item) -> None:
+        """Ajoute `item` au tampon local (verrou tenu par l'appelant)."""
+
+    @abstractmethod
+    def _restore(self, batch) -> None:
+        """Rend au tampon local un lot dont l'écriture a échoué (verrou tenu)."""
+
+    @abstractmethod
+    def _push_redis(self, client, key: str, item) -> None:
+        """Ajoute `item` à la structure Redis `key`."""
+
+    @abstractmethod
+    def _read_redis(self, client, key: str):
+        """Lot contenu dans la structure Redis `key`."""
+
+    def _size(self, batch) -> int:
+        return len(batch)
+
+    def _record(self, item) -> None:
+        client = redis_client()
+        if client is not None:
+            self._push_redis(client, cache.make_and_validate_key(self.pending_key), item)
+            return
+        with self._lock:
+            self._add_local(item)
+            due = (
+                len(self._buffer) >= LOCAL_FLUSH_MAX_KEYS
+                or time.monotonic() - self._flushed_at >= LOCAL_FLUSH_SECONDS
+            )
+        if due:
+            self._flush_local()
+
+    def _flush_local(self) -> int:
+        with self._lock:
+            batch, self._buffer = self._buffer, self._empty()
+            self._flushed_at = time.monotonic()
+        if not batch:
+            return 0
+        try:
+            self.apply(batch)
+        except Exception:
+            # Rendre le lot au tampon : il partira au prochain flush
+            with self._lock:
+                self._restore(batch)
+            raise
+        return self._size(batch)
+
+    def _flush_redis(self, client) -> int:
+        pending = cache.make_and_validate_key(self.pending_key)
+        flushing = cache.make_and_validate_key(self.flushing_key)
+        if not client.exists(flushing):
+            if not client.exists(pending):
+                return 0
+            client.rename(pending, flushing)
+        batch = self._read_redis(client, flushing)
+        if batch:
+            self.apply(batch)
+        client.delete(flushing)
+        return self._size(batch)
+
+    def flush(self) -> int:
+        """Reporte les enregistrements en attente. Retourne leur nombre."""
+        total = self._flush_local()
+        client = redis_client()
+        if client is None:
+            return total
+        if not acquire_lock(self.flushing_key):
+            return total  # un autre worker est en train de vider la clé
+        try:
+            total += self._flush_redis(client)
+        finally:
+            release_lock(self.flushing_key)
+        return total
+
+
+class PendingCounter(_WriteBehind):
+    """
+    Compteurs en attente, indexés par une chaîne (ex. "42" ou "42:sms:2026-10-18").
+    `apply(counts)` reçoit {champ: incrément} et l'écrit en base.
+    """
+
+    def _empty(self):
+        return {}
+
+    def incr(self, field: str, amount: int = 1) -> None:
+        self._record((field, amount))
+
+    def _add_local(self, item) -> None:
+        field, amount = item
+        self._buffer[field] = self._buffer.get(field, 0) + amount
+
+    def _restore(self, batch) -> None:
+        for item in batch.items():
+            self._add_local(item)
+
+    def _push_redis(self, client, key: str, item) -> None:
+        client.hincrby(key, *item)
+
+    def _read_redis(self, client, key: str):
+        return {_text(k): int(v) for k, v in client.hgetall(key).items()}
+
+    def _size(self, batch) -> int:
+        return sum(batch.values())
+
+
+class PendingEvents(_WriteBehind):
+    """
+    Flux d'événements en attente (chaînes sérialisées par l'appelant), dans l'ordre.
+    `apply(events)` reçoit la liste et l'écrit en base.
+    """
+
+    def _empty(self):
+        return []
+
+    def push(self, event: str) -> None:
+        self._record(event)
+
+    def _add_local(self, item) -> None:
+        self._buffer.append(item)
+
+    def _restore(self, batch) -> None:
+        self._buffer[:0] = batch
+
+    def _push_redis(self, client, key: str, item) -> None:
+        client.rpush(key, item)
+
+    def _read_redis(self, client, key: str):
+        return [_text(v) for v in client.lrange(key, 0, -1)]
@@ -0,0 +1,135 @@
+"""
+Anti-doublon par visiteur (vues, clics de contact) à mémoire constante.
+
+Un visiteur est identifié par son compte, sinon par un cookie signé longue durée
+(VISITOR_COOKIE, jeton aléatoire posé par le décorateur visitor_cookie). Sans
+cookie, la requête reçoit un nouveau jeton et est aussi rapprochée de l'empreinte
+REMOTE_ADDR + user-agent (REMOTE_ADDR déjà corrigé par CloudflareMiddleware,
+jamais X-Forwarded-For, fourni par le client) : renouveler le cookie à chaque
+requête ne multiplie pas les vues, et des visiteurs derrière une même IP (NAT
+opérateur) restent distincts dès qu'ils ont leur cookie.
+
+Chaque visiteur a, par usage,
+un filtre de Bloom de BLOOM_BITS bits (1 Ko) avec TTL : quel que soit le nombre
+d'annonces consultées, ni la session ni le cache ne grossissent.
+
+  - Redis : chaîne binaire, SETBIT des BLOOM_HASHES positions dans un pipeline
+    (atomique pour le visiteur) ; le TTL est posé à la création (SET NX EX) et
+    n'est pas prolongé par les vues suivantes.
+  - Autre cache : le filtre (bytes) est lu puis réécrit avec le TTL restant.
+
+Faux positifs possibles (un membre jamais vu pris pour un doublon) : ~0,2 % après
+500 annonces vues par le même visiteur dans la fenêtre, jamais de faux négatif.
+"""
+import functools
+import hashlib
+import secrets
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .counters import redis_client
+
+BLOOM_BITS = 8192
+BLOOM_HASHES = 4
+
+
+VISITOR_COOKIE = "kiaba_vid"
+VISITOR_COOKIE_SALT = "ads.dedupe.visitor"
+VISITOR_COOKIE_MAX_AGE = 365 * 24 * 3600
+
+
+def _visitor_token(request):
+    """Jeton du cookie visiteur s'il est présent et correctement signé, sinon None."""
+    return request.get_signed_cookie(VISITOR_COOKIE, default=None, salt=VISITOR_COOKIE_SALT)
+
+
+def visitor_keys(request) -> list:
+    """
+    Identifiants du visiteur pour l'anti-doublon : compte, sinon cookie visiteur.
+    Sans cookie valide : nouveau jeton (posé par visitor_cookie) + empreinte
+    REMOTE_ADDR + user-agent.
+    """
+    if request.user.is_authenticated:
+        return [f"u{request.user.pk}"]
+    token = _visitor_token(request)
+    if token:
+        return [f"v{token}"]
+    token = request._new_visitor_token = secrets.token_hex(16)
+    ip = request.META.get("REMOTE_ADDR", "")
+    agent = request.META.get("HTTP_USER_AGENT", "")
+    return [f"v{token}", "a" + hashlib.sha1(f"{ip}|{agent}".encode("utf-8")).hexdigest()[:20]]
+
+
+def visitor_cookie(view):
+    """Pose le cookie visiteur sur la réponse quand visitor_keys a créé un jeton."""
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        token = getattr(request, "_new_visitor_token", None)
+        if token:
+            response.set_signed_cookie(
+                VISITOR_COOKIE,
+                token,
+                salt=VISITOR_COOKIE_SALT,
+                max_age=VISITOR_COOKIE_MAX_AGE,
+                secure=getattr(settings, "SESSION_COOKIE_SECURE", False),
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+    return wrapper
+
+
+def _positions(member: str):
+    """BLOOM_HASHES positions de bits (double hachage sur un blake2b de 128 bits)."""
+    digest = hashlib.blake2b(member.encode("utf-8"), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], "big")
+    h2 = int.from_bytes(digest[8:], "big") | 1
+    return [(h1 + i * h2) % BLOOM_BITS for i in range(BLOOM_HASHES)]
+
+
+def _first_seen_redis(client, key: str, positions, ttl: int) -> bool:
+    pipe = client.pipeline(transaction=True)
+    pipe.set(key, b"", ex=ttl, nx=True)
+    for pos in positions:
+        pipe.setbit(key, pos, 1)
+    previous = pipe.execute()[1:]
+    return not all(previous)
+
+
+def _first_seen_cache(key: str, positions, ttl: int) -> bool:
+    now = time.time()
+    entry = cache.get(key)
+    if entry is None or entry[0] <= now:
+        expires_at, bits = now + ttl, bytearray(BLOOM_BITS // 8)
+    else:
+        expires_at, bits = entry[0], bytearray(entry[1])
+    seen = True
+    for pos in positions:
+        byte, mask = pos >> 3, 1 << (pos & 7)
+        if not bits[byte] & mask:
+            seen = False
+            bits[byte] |= mask
+    if not seen:
+        cache.set(key, (expires_at, bytes(bits)), max(1, int(expires_at - now)))
+    return not seen
+
+
+def first_seen(scope: str, visitor: str, member: str, ttl: int) -> bool:
+    """True si `member` n'a pas encore été vu pour (scope, visiteur) dans la fenêtre `ttl`."""
+    key = f"seen_bloom:{scope}:{visitor}"
+    positions = _positions(member)
+    client = redis_client()
+    if client is not None:
+        return _first_seen_redis(client, cache.make_and_validate_key(key), positions, ttl)
+    return _first_seen_cache(key, positions, ttl)
+
+
+def first_seen_by(scope: str, visitors, member: str, ttl: int) -> bool:
+    """True si aucun des identifiants `visitors` n'a encore vu `member` ; tous sont marqués."""
+    results = [first_seen(scope, visitor, member, ttl) for visitor in visitors]
+    return all(results)
@@ -0,0 +1,65 @@
+"""
+Page détail d'une annonce en fragments (inclusion côté serveur, façon ESI).
+
+Tout ce qui ne dépend que de l'annonce (meta, JSON-LD, fil d'Ariane, corps avec
+médias, contacts et annonces similaires, scripts) est rendu une fois depuis
+ads/_detail_page.html, un fragment HTML par bloc, et mis en cache par ad_detail
+(stale-while-revalidate, versionné comme les listes de sa catégorie : tout
+changement de la ligne du fil de l'annonce ou d'une annonce similaire, dont un
+changement de statut, l'invalide). Anonymes et connectés partagent ces fragments :
+une vue connectée ne lit plus l'annonce en base et ne rend plus le corps.
+
+Les « trous » propres à l'utilisateur sont rendus à chaque requête par la coquille
+ads/detail.html : nav (base.html), jeton CSRF, bouton et script des favoris. Le
+bouton favori prend place au marqueur FAVORITE_HOLE du corps.
+"""
+import hashlib
+
+from django.template import Context
+from django.template.loader import get_template
+from django.template.loader_tags import BlockNode
+from django.utils.safestring import mark_safe
+
+from core.cdn import ad_tags
+
+from .models import Ad
+
+PAGE_TEMPLATE = "ads/_detail_page.html"
+FAVORITE_HOLE = "<!--hole:favorite-->"
+DETAIL_PAGE_TTL = 120  # 2 min, en plus de l'invalidation par version
+
+
+def detail_page_key(slug: str) -> str:
+    return f"ad_detail_page:{slug}"
+
+
+def detail_scope_key(slug: str) -> str:
+    """Catégorie de l'annonce, mémorisée pour lire la version de la page avant de la charger."""
+    return f"ad_detail_scope:{slug}"
+
+
+def render_blocks(template_name: str, context: dict) -> dict:
+    """Rend séparément chaque {% block %} de premier niveau du template : {nom: html}."""
+    template = get_template(template_name).template
+    ctx = Context(context, autoescape=template.engine.autoescape)
+    with ctx.render_context.push_state(template), ctx.bind_template(template):
+        return {
+            node.name: node.render(ctx)
+            for node in template.nodelist
+            if isinstance(node, BlockNode)
+        }
+
+
+def build_detail_page(ad: Ad, similar_ads) -> dict:
+    """Fragments communs de la page détail de `ad` (valeur sérialisable, mise en cache)."""
+    blocks = render_blocks(PAGE_TEMPLATE, {"ad": ad, "similar_ads": similar_ads})
+    head, _, tail = blocks.pop("content").partition(FAVORITE_HOLE)
+    page = {name: mark_safe(html) for name, html in blocks.items()}
+    page.update(ad_id=ad.pk, content_head=mark_safe(head), content_tail=mark_safe(tail))
+    page["cdn_tags"] = ad_tags(ad.pk, ad.city_id, ad.category)
+    # Validateurs HTTP (ad_detail) : l'annonce et les cartes similaires affichées
+    page["modified_at"] = max(filter(None, [ad.updated_at, ad.bumped_at]), default=None)
+    page["state"] = hashlib.sha1(
+        repr([(ad.pk, ad.updated_at, ad.bumped_at)] + [(s.pk, s.updated_at) for s in similar_ads]).encode("utf-8")
+    ).hexdigest()[:16]
+    return page
@@ -0,0 +1,175 @@
+"""
+Facettes de la liste publique (villes, compteurs par ville / catégorie, totaux) et
+du footer (villes populaires, total d'annonces en ligne).
+
+Tout est calculé ensemble à partir des compteurs AdFacetCount (ville × catégorie
+× statut × images traitées, quelques dizaines de lignes quel que soit le nombre
+d'annonces) + la liste des villes, stockés sous une seule clé. Le TTL est
+étalé aléatoirement pour que les workers ne recalculent pas tous au même instant,
+et une seule régénération tourne à la fois (verrou) : les autres requêtes servent
+la valeur précédente. À froid (clé absente ou évincée), celles qui n'ont pas le
+verrou calculent pour elles-mêmes sans stocker, sans attendre le premier calcul.
+
+Chaque changement d'un compteur (move_facet) incrémente la version des facettes
+après le commit : la valeur en cache devient périmée tout de suite et un seul
+worker la recalcule, sans attendre la fin du TTL. invalidate_listing_facets
+fait de même : la valeur périmée reste servable pendant son recalcul.
+"""
+import copy
+import hashlib
+import random
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from core.cache_utils import bump_version, get_version, release_lock, swr_get, swr_set
+
+from .models import Ad, AdFacetCount, City
+
+FACETS_CACHE_KEY = "listing_facets"
+FACETS_VERSION_KEY = "listing_facets:version"
+FACETS_TTL = 300  # 5 min
+FACETS_TTL_JITTER = 0.2  # ± 20 %
+SIDEBAR_CITY_LIMIT = 12
+FOOTER_CITY_LIMIT = 6
+
+VISIBLE_STATUSES = (Ad.Status.APPROVED, Ad.Status.EXPIRED)
+
+
+def _jittered_ttl() -> int:
+    return int(FACETS_TTL * random.uniform(1 - FACETS_TTL_JITTER, 1 + FACETS_TTL_JITTER))
+
+
+def _top_cities(cities_by_id, counts, limit):
+    # Plus d'annonces d'abord, puis ordre alphabétique (stable entre deux calculs)
+    ranked = sorted(
+        ((n, pk) for pk, n in counts.items() if n > 0 and pk in cities_by_id),
+        key=lambda item: (-item[0], cities_by_id[item[1]].name),
+    )[:limit]
+    result = []
+    for n, pk in ranked:
+        top = copy.copy(cities_by_id[pk])
+        top.ad_count = n
+        result.append(top)
+    return result
+
+
+def compute_facets() -> dict:
+    """Calcule toutes les facettes (2 requêtes : villes + compteurs AdFacetCount)."""
+    cities = list(City.objects.all())
+    rows = list(
+        AdFacetCount.objects.filter(status__in=VISIBLE_STATUSES, count__gt=0)
+        .order_by("city_id", "category", "status", "images_done")
+        .values_list("city_id", "category", "status", "images_done", "count")
+    )
+
+    total_visible = 0
+    online = 0
+    by_city = {}
+    by_category = {}
+    online_by_city = {}
+    for city_id, category, status, images_done, n in rows:
+        total_visible += n
+        by_city[city_id] = by_city.get(city_id, 0) + n
+        by_category[category] = by_category.get(category, 0) + n
+        if status == Ad.Status.APPROVED and images_done:
+            online += n
+            online_by_city[city_id] = online_by_city.get(city_id, 0) + n
+
+    cities_by_id = {c.pk: c for c in cities}
+    # Empreinte des compteurs et des villes : entre dans l'ETag des pages (core/http_cache.py)
+    state = hashlib.sha1(
+        repr((rows, [(c.pk, c.name, c.slug) for c in cities])).encode("utf-8")
+    ).hexdigest()[:16]
+    return {
+        "state": state,
+        "cities": cities,
+        # Liste publique : annonces approuvées + expirées
+        "total_approved_ads": total_visible,
+        "city_counts": _top_cities(cities_by_id, by_city, SIDEBAR_CITY_LIMIT),
+        "category_counts": by_category,
+        # Footer : annonces réellement en ligne (approuvées, images traitées)
+        "online_ads": online,
+        "popular_cities_footer": _top_cities(cities_by_id, online_by_city, FOOTER_CITY_LIMIT),
+    }
+
+
+def get_listing_facets() -> dict:
+    """Facettes en cache (stale-while-revalidate + single-flight)."""
+    version = get_version(FACETS_VERSION_KEY)
+    facets, regenerate = swr_get(FACETS_CACHE_KEY, version)
+    if facets is not None and not regenerate:
+        return facets
+    if not regenerate:
+        # Calcul à froid déjà en cours ailleurs : calcul local, non stocké
+        return compute_facets()
+    try:
+        facets = compute_facets()
+    except Exception:
+        release_lock(FACETS_CACHE_KEY)
+        raise
+    # Version lue avant le calcul : un compteur modifié pendant celui-ci le rend périmé
+    swr_set(FACETS_CACHE_KEY, facets, _jittered_ttl(), version)
+    return facets
+
+
+def invalidate_listing_facets() -> None:
+    """Facettes périmées : un seul appel les recalcule, les autres servent l'ancienne valeur."""
+    touch_listing_facets()
+
+
+def touch_listing_facets() -> None:
+    """Les compteurs ont changé : facettes en cache périmées (servies pendant leur recalcul)."""
+    bump_version(FACETS_VERSION_KEY)
+
+
+# ─── Compteurs AdFacetCount ───────────────────────────────────────────────────
+
+# Champs d'Ad qui déterminent la ligne de compteur d'une annonce
+FACET_FIELDS = frozenset({"status", "city", "city_id", "category", "image_processing_done"})
+
+
+def facet_key(ad: Ad):
+    return (ad.city_id, ad.category, ad.status, bool(ad.image_processing_done))
+
+
+def _add(key, delta: int) -> None:
+    city_id, category, status, images_done = key
+    lookup = {"city_id": city_id, "category": category, "status": status, "images_done": images_done}
+    updated = AdFacetCount.objects.filter(**lookup).update(count=F("count") + delta)
+    if not updated and delta > 0:
+        row, _ = AdFacetCount.objects.get_or_create(**lookup)
+        AdFacetCount.objects.filter(pk=row.pk).update(count=F("count") + delta)
+
+
+def move_facet(old_key, new_key) -> None:
+    """Déplace une annonce d'une ligne de compteur à une autre (None = pas de ligne)."""
+    if old_key == new_key:
+        return
+    with transaction.atomic():
+        if old_key is not None:
+            _add(old_key, -1)
+        if new_key is not None:
+            _add(new_key, +1)
+        transaction.on_commit(touch_listing_facets)
+
+
+def reconcile_facet_counts() -> int:
+    """
+    Recalcule tous les compteurs depuis la table Ad (filet de sécurité : .update()
+    en masse, suppressions SQL...). Retourne le nombre de lignes de compteur.
+    """
+    rows = (
+        Ad.objects.values_list("city_id", "category", "status", "image_processing_done")
+        .annotate(n=Count("id"))
+        .order_by()
+    )
+    counts = [
+        AdFacetCount(city_id=city_id, category=category, status=status, images_done=done, count=n)
+        for city_id, category, status, done, n in rows
+    ]
+    with transaction.atomic():
+        AdFacetCount.objects.all().delete()
+        AdFacetCount.objects.bulk_create(counts)
+    invalidate_listing_facets()
+    return len(counts)
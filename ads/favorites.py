@@ -0,0 +1,113 @@
+"""
+Favoris de chaque utilisateur : ensemble des ids d'annonces, en cache.
+
+La page détail et les pages de liste connaissent l'état « favori » de leurs
+annonces en un aller-retour au cache, sans requête Favorite par annonce.
+
+  - Redis : un SET par utilisateur (SADD / SREM à chaque toggle_favorite,
+    SMISMEMBER pour une page d'annonces). Le membre sentinelle LOADED (aucune
+    annonce n'a l'id 0) distingue un ensemble chargé depuis la base d'un ensemble
+    absent ou expiré : sans lui, l'ensemble est rechargé.
+  - Autre cache : l'ensemble Python est lu puis réécrit (un seul utilisateur
+    modifie ses favoris, la concurrence est négligeable).
+
+L'ensemble est chargé depuis la base au premier besoin et vit FAVORITES_TTL ;
+toggle_favorite le tient à jour entre-temps (update_favorite).
+"""
+from django.core.cache import cache
+
+from .counters import redis_client
+from .models import Favorite
+
+FAVORITES_TTL = 24 * 3600
+LOADED = 0
+
+
+def _key(user_id: int) -> str:
+    return f"favorite_ids:{user_id}"
+
+
+def _ids_from_db(user_id: int) -> set:
+    return set(Favorite.objects.filter(user_id=user_id).values_list("ad_id", flat=True))
+
+
+def _load_redis(client, key: str, user_id: int) -> set:
+    ids = _ids_from_db(user_id)
+    pipe = client.pipeline(transaction=True)
+    pipe.delete(key)
+    pipe.sadd(key, LOADED, *ids)
+    pipe.expire(key, FAVORITES_TTL)
+    pipe.execute()
+    return ids
+
+
+def favorite_ids(user_id: int) -> set:
+    """Ids des annonces en favoris de l'utilisateur."""
+    client = redis_client()
+    if client is not None:
+        key = cache.make_and_validate_key(_key(user_id))
+        members = {int(m) for m in client.smembers(key)}
+        if LOADED not in members:
+            return _load_redis(client, key, user_id)
+        members.discard(LOADED)
+        return members
+    ids = cache.get(_key(user_id))
+    if ids is None:
+        ids = _ids_from_db(user_id)
+        cache.set(_key(user_id), ids, FAVORITES_TTL)
+    return set(ids)
+
+
+def favorited_among(user_id: int, ad_ids) -> set:
+    """Parmi `ad_ids`, celles que l'utilisateur a en favoris (un aller-retour au cache)."""
+    ad_ids = [int(pk) for pk in ad_ids]
+    if not ad_ids:
+        return set()
+    client = redis_client()
+    if client is None:
+        return favorite_ids(user_id).intersection(ad_ids)
+    key = cache.make_and_validate_key(_key(user_id))
+    pipe = client.pipeline(transaction=False)
+    pipe.sismember(key, LOADED)
+    pipe.smismember(key, ad_ids)
+    loaded, flags = pipe.execute()
+    if not loaded:
+        return _load_redis(client, key, user_id).intersection(ad_ids)
+    return {pk for pk, flag in zip(ad_ids, flags) if flag}
+
+
+def update_favorite(user_id: int, ad_id: int, favorited: bool) -> None:
+    """Reporte un ajout / retrait de favori dans l'ensemble en cache s'il est chargé."""
+    client = redis_client()
+    if client is not None:
+        key = cache.make_and_validate_key(_key(user_id))
+        # Ensemble expiré entre les deux commandes : le membre ajouté seul n'a pas
+        # de sentinelle, l'ensemble sera rechargé depuis la base à la lecture.
+        if client.sismember(key, LOADED):
+            if favorited:
+                client.sadd(key, ad_id)
+            else:
+                client.srem(key, ad_id)
+        return
+    ids = cache.get(_key(user_id))
+    if ids is None:
+        return
+    if favorited:
+        ids.add(ad_id)
+    else:
+        ids.discard(ad_id)
+    cache.set(_key(user_id), ids, FAVORITES_TTL)
+
+
+def annotate_favorites(user, items) -> None:
+    """
+    Pose `is_favorited` sur chaque élément (Ad, AdCard... ayant un `id`) pour
+    l'utilisateur `user`, en un seul aller-retour au cache.
+    """
+    items = list(items)
+    if user.is_authenticated:
+        favorited = favorited_among(user.pk, [item.id for item in items])
+    else:
+        favorited = set()
+    for item in items:
+        item.is_favorited = item.id in favorited
@@ -0,0 +1,350 @@
+"""
+Fil public précalculé (table AdFeedEntry).
+
+Chaque annonce visible (approuvée ou expirée, images traitées) possède une ligne
+avec une clé de tri `rank` et le contenu déjà prêt de sa carte. La liste publique
+lit uniquement cette table : une plage d'index, sans CASE, sans jointure City /
+user / profile et sans prefetch des media.
+
+La table est tenue à jour :
+  - par les signaux (ads/signals.py) à chaque Ad.save() / AdMedia.save() ;
+  - explicitement après les .update() en masse (cron_bump_ads, promote_boosted_ads,
+    expire_premium_ads) qui ne déclenchent pas de signal ;
+  - par la tâche de réconciliation rebuild_ad_feed (filet de sécurité), qui la
+    remplit aussi au déploiement (la migration 0019 la crée vide).
+
+Seules les lignes réellement insérées, modifiées ou supprimées invalident les pages
+en cache : versions de leur ville, de leur catégorie et des listes sans filtre
+(core.context_processors.list_scope), avant comme après le changement. Une page
+d'une ville ou d'une catégorie calme garde ainsi son TTL (list_cache_ttl). De même,
+seules les étiquettes CDN de ces lignes sont purgées (core/cdn.py) : la
+réconciliation ne purge rien quand rien n'a dérivé.
+
+Le HTML de chaque carte est en plus mis en cache (render_cards) sous une clé
+pk + updated_at + bumped_at + badge vérifié de l'auteur et nom de la ville : tout
+save() de l'annonce, et toute vérification d'auteur ou renommage de ville (qui
+resynchronisent leurs lignes, ads/signals.py), produit une nouvelle clé ; l'ancien
+fragment n'est plus jamais lu et expire seul.
+"""
+import hashlib
+import logging
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.templatetags.static import static
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.safestring import mark_safe
+
+from core.cdn import LIST_ALL_TAG, ad_tags, purge_tags
+from core.context_processors import bump_list_versions, list_scope
+
+from .models import Ad, AdFeedEntry
+
+logger = logging.getLogger(__name__)
+
+# Champs d'Ad dont dépend une ligne du fil (save(update_fields=...) hors de cette liste : rien à faire)
+FEED_FIELDS = frozenset({
+    "status", "image_processing_done", "title", "slug", "description_sanitized",
+    "category", "subcategories", "city", "is_verified", "is_urgent", "is_premium",
+    "is_boosted", "boost_interval_hours", "bumped_at", "created_at", "user",
+    "primary_thumbnail_url", "primary_thumbnail_width", "primary_thumbnail_height",
+    "primary_image_variants",
+})
+
+# Clé de pagination keyset sur le fil (rank est une clé totale : elle contient l'id)
+FEED_KEYS = (("rank", True),)
+
+VISIBLE_STATUSES = (Ad.Status.APPROVED, Ad.Status.EXPIRED)
+
+DESCRIPTION_EXCERPT = 300
+
+# Les annonces expirées restent en bas de liste 50 jours (cf. purge_expired_ads)
+PURGE_DELAY = timedelta(days=50)
+PREMIUM_BUMP_INTERVAL = timedelta(hours=1)  # cf. cron_bump_ads
+
+# Durée de vie d'une page de liste en cache : jusqu'au prochain changement d'état
+LIST_CACHE_MIN_TTL = 30
+LIST_CACHE_MAX_TTL = 6 * 3600
+
+CARD_TEMPLATE = "ads/_ad_card.html"
+CARD_FRAGMENT_TTL = 3600  # borne la durée de vie d'un fragment orphelin
+
+
+def _micros(dt) -> int:
+    return int(dt.timestamp() * 1_000_000)
+
+
+def feed_rank(ad: Ad) -> str:
+    """
+    Chaîne dont l'ordre lexicographique décroissant reproduit l'ordre de la liste :
+    approuvées avant expirées, urgentes d'abord, puis -bumped_at, -created_at, -id.
+    """
+    bumped = ad.bumped_at or ad.created_at
+    return "%d%d%017d%017d%012d" % (
+        1 if ad.status == Ad.Status.APPROVED else 0,
+        1 if ad.is_urgent else 0,
+        _micros(bumped),
+        _micros(ad.created_at),
+        ad.pk,
+    )
+
+
+def next_state_change(ad: Ad, now=None):
+    """
+    Prochain instant où la ligne du fil de `ad` changera d'elle-même (par un cron) :
+    fin du premium / de l'urgent, expiration, purge, fin du boost ou remontée due.
+    None si rien n'est prévu. Une échéance déjà passée (cron en retard) est renvoyée
+    telle quelle : la page correspondante sera mise en cache au minimum.
+    """
+    now = now or timezone.now()
+    candidates = []
+    if ad.is_premium:
+        candidates.append(ad.premium_until)
+    if ad.is_urgent:
+        candidates.append(ad.urgent_until)
+    if ad.status == Ad.Status.APPROVED:
+        candidates.append(ad.expires_at)
+        bumped = ad.bumped_at or ad.created_at or now
+        if ad.is_boosted and ad.boost_expires_at and ad.boost_expires_at > now:
+            candidates.append(ad.boost_expires_at)
+            candidates.append(bumped + timedelta(hours=max(1, ad.boost_interval_hours or 2)))
+        if ad.is_premium and ad.premium_until and ad.premium_until > now:
+            candidates.append(bumped + PREMIUM_BUMP_INTERVAL)
+    elif ad.status == Ad.Status.EXPIRED and ad.expires_at:
+        candidates.append(ad.expires_at + PURGE_DELAY)
+    candidates = [c for c in candidates if c]
+    return min(candidates) if candidates else None
+
+
+def list_cache_ttl(entries, now=None) -> int:
+    """
+    TTL (secondes) d'une page de liste construite à partir de `entries` (lignes
+    affichées + ligne suivant la coupure) : la page vit jusqu'au premier
+    changement d'état prévu parmi elles, bornée à [MIN, MAX].
+    """
+    now = now or timezone.now()
+    changes = [e.next_change_at for e in entries if e is not None and e.next_change_at]
+    if not changes:
+        return LIST_CACHE_MAX_TTL
+    seconds = int((min(changes) - now).total_seconds())
+    return max(LIST_CACHE_MIN_TTL, min(LIST_CACHE_MAX_TTL, seconds))
+
+
+def build_card(ad: Ad) -> dict:
+    """Contenu sérialisable d'une carte d'annonce (doit rester compatible JSON)."""
+    return {
+        "id": ad.pk,
+        "slug": ad.slug,
+        "title": ad.title,
+        "category": ad.category,
+        "category_display": ad.get_category_display(),
+        "city_name": ad.city.name,
+        "city_slug": ad.city.slug,
+        "description": (ad.description_sanitized or "")[:DESCRIPTION_EXCERPT],
+        "tag": (ad.subcategories or [None])[0],
+        "created_at": ad.created_at.isoformat() if ad.created_at else "",
+        "updated_at": ad.updated_at.isoformat() if ad.updated_at else "",
+        "bumped_at": ad.bumped_at.isoformat() if ad.bumped_at else "",
+        "status": ad.status,
+        "is_premium": ad.is_premium,
+        "is_boosted": ad.is_boosted,
+        "is_urgent": ad.is_urgent,
+        "is_verified": ad.is_verified,
+        "boost_interval_hours": ad.boost_interval_hours,
+        "user_is_verified": getattr(ad.user, "is_verified", False),
+        "thumbnail_url": ad.primary_thumbnail_url,
+        "thumbnail_width": ad.primary_thumbnail_width,
+        "thumbnail_height": ad.primary_thumbnail_height,
+        "image_variants": ad.primary_image_variants or [],
+    }
+
+
+class AdCard:
+    """
+    Carte d'annonce prête à afficher (template ads/_ad_card.html), construite à partir
+    du payload JSON du fil ou d'une instance Ad (build_card).
+    """
+
+    def __init__(self, payload: dict):
+        self.__dict__.update(payload)
+        created_at = payload.get("created_at")
+        self.created_at = parse_datetime(created_at) if isinstance(created_at, str) else created_at
+
+    @classmethod
+    def from_ad(cls, ad: Ad) -> "AdCard":
+        return cls(build_card(ad))
+
+    def get_category_display(self) -> str:
+        return self.category_display
+
+
+def _position_slot(position: int) -> str:
+    """Variante de chargement d'image : h (fetchpriority), e (eager), l (lazy)."""
+    if position == 1:
+        return "h"
+    return "e" if position <= 3 else "l"
+
+
+def card_fragment_key(card: AdCard, position: int):
+    """
+    Clé du fragment HTML ; None pour un payload trop ancien (sans updated_at).
+    Couvre aussi ce que la carte lit hors de l'annonce (badge vérifié de l'auteur,
+    nom de la ville) : vérifier un profil ou renommer une ville ne touche pas updated_at.
+    """
+    updated_at = getattr(card, "updated_at", "")
+    if not updated_at:
+        return None
+    bumped_at = getattr(card, "bumped_at", "") or ""
+    related = f"{bool(getattr(card, 'user_is_verified', False)):d}|{getattr(card, 'city_name', '')}"
+    digest = hashlib.sha1(related.encode("utf-8")).hexdigest()[:8]
+    return f"ad_card:{card.id}:{updated_at}:{bumped_at}:{digest}:{_position_slot(position)}"
+
+
+def render_cards(cards) -> None:
+    """
+    Attache à chaque carte son HTML (card.html), lu en un seul get_many depuis le
+    cache ; seules les cartes absentes sont rendues puis stockées (set_many).
+    """
+    keys = {i: card_fragment_key(card, i + 1) for i, card in enumerate(cards)}
+    cached = cache.get_many([k for k in keys.values() if k])
+    placeholder_img = static("img/logo.png")
+
+    to_store = {}
+    for i, card in enumerate(cards):
+        key = keys[i]
+        html = cached.get(key) if key else None
+        if html is None:
+            html = render_to_string(
+                CARD_TEMPLATE,
+                {"card": card, "position": i + 1, "placeholder_img": placeholder_img},
+            )
+            if key:
+                to_store[key] = html
+        card.html = mark_safe(html)
+    if to_store:
+        cache.set_many(to_store, CARD_FRAGMENT_TTL)
+
+
+def _entry_for(ad: Ad) -> AdFeedEntry:
+    return AdFeedEntry(
+        ad_id=ad.pk,
+        rank=feed_rank(ad),
+        city_id=ad.city_id,
+        category=ad.category,
+        user_id=ad.user_id,
+        is_approved=ad.status == Ad.Status.APPROVED,
+        is_urgent=ad.is_urgent,
+        is_premium=ad.is_premium,
+        is_boosted=ad.is_boosted,
+        card=build_card(ad),
+        next_change_at=next_state_change(ad),
+    )
+
+
+# Colonnes comparées pour décider si une ligne du fil a changé (updated_at exclu)
+ENTRY_FIELDS = (
+    "rank", "city_id", "category", "user_id", "is_approved", "is_urgent",
+    "is_premium", "is_boosted", "card", "next_change_at",
+)
+
+
+def _entry_changed(old, new: AdFeedEntry) -> bool:
+    return old is None or any(getattr(old, f) != getattr(new, f) for f in ENTRY_FIELDS)
+
+
+def _scopes(entry: AdFeedEntry) -> set:
+    """Portées de cache des pages qui affichent la ligne `entry`."""
+    return {
+        list_scope(),
+        list_scope(city=(entry.card or {}).get("city_slug", "")),
+        list_scope(category=entry.category),
+    }
+
+
+def _invalidate(entries) -> None:
+    """
+    Invalide les pages en cache des lignes `entries` (anciennes et nouvelles
+    versions) et purge au CDN les étiquettes de ces seules lignes.
+    """
+    if not entries:
+        return
+    scopes, tags = set(), {LIST_ALL_TAG}
+    for entry in entries:
+        scopes |= _scopes(entry)
+        tags.update(ad_tags(entry.ad_id, entry.city_id, entry.category))
+    bump_list_versions(scopes)
+    purge_tags(tags)
+
+
+def _is_visible(ad: Ad) -> bool:
+    return ad.status in VISIBLE_STATUSES and ad.image_processing_done
+
+
+def _upsert(entries) -> None:
+    if not entries:
+        return
+    AdFeedEntry.objects.bulk_create(
+        entries,
+        update_conflicts=True,
+        unique_fields=["ad"],
+        update_fields=[
+            "rank", "city", "category", "user", "is_approved", "is_urgent",
+            "is_premium", "is_boosted", "card", "next_change_at", "updated_at",
+        ],
+    )
+
+
+def sync_feed(ad_ids) -> int:
+    """
+    Recalcule les lignes du fil pour les annonces données : insère / met à jour les
+    annonces visibles dont la ligne a changé et supprime celles des autres. Les
+    lignes inchangées ne sont ni réécrites ni invalidées. Retourne le nombre
+    d'annonces visibles parmi `ad_ids`.
+    """
+    ad_ids = {int(pk) for pk in ad_ids if pk}
+    if not ad_ids:
+        return 0
+    ads = list(
+        Ad.objects.filter(pk__in=ad_ids).select_related("city", "user")
+    )
+    existing = {entry.ad_id: entry for entry in AdFeedEntry.objects.filter(ad_id__in=ad_ids)}
+    entries = [_entry_for(ad) for ad in ads if _is_visible(ad)]
+    changed = [entry for entry in entries if _entry_changed(existing.get(entry.ad_id), entry)]
+    visible_ids = {entry.ad_id for entry in entries}
+    removed = [entry for pk, entry in existing.items() if pk not in visible_ids]
+    if removed:
+        AdFeedEntry.objects.filter(ad_id__in=[entry.ad_id for entry in removed]).delete()
+    _upsert(changed)
+    # Les pages de liste en cache vivent jusqu'au prochain changement prévu :
+    # tout changement effectif du fil doit donc les invalider (ici et au CDN).
+    previous = [existing[entry.ad_id] for entry in changed if entry.ad_id in existing]
+    _invalidate(removed + previous + changed)
+    return len(entries)
+
+
+def sync_feed_batched(ad_ids, batch_size: int = 500) -> int:
+    """sync_feed par paquets de `batch_size` annonces (ville, auteur, fil entier)."""
+    ids = list(ad_ids)
+    total = 0
+    for start in range(0, len(ids), batch_size):
+        total += sync_feed(ids[start:start + batch_size])
+    return total
+
+
+def rebuild_feed(batch_size: int = 500) -> int:
+    """
+    Réconcilie tout le fil avec les annonces (filet de sécurité). Seules les lignes
+    qui ont dérivé sont réécrites et invalidées : sans dérive, aucune écriture.
+    Retourne le nombre de lignes visibles.
+    """
+    visible_qs = Ad.objects.filter(status__in=VISIBLE_STATUSES, image_processing_done=True)
+    stale = list(AdFeedEntry.objects.exclude(ad_id__in=visible_qs.values("pk")))
+    if stale:
+        AdFeedEntry.objects.filter(pk__in=[entry.pk for entry in stale]).delete()
+        _invalidate(stale)
+
+    total = sync_feed_batched(visible_qs.order_by("pk").values_list("pk", flat=True), batch_size)
+    logger.info("rebuild_feed: %d annonces dans le fil, %d lignes retirées", total, len(stale))
+    return total
@@ -0,0 +1,215 @@
+"""
+Variantes responsive des photos d'annonces (srcset / sizes).
+
+À partir de l'image filigranée (1000 px max), AdMedia._add_watermark_and_thumbnail
+produit une variante par largeur de AD_IMAGE_VARIANT_WIDTHS et par format de
+AD_IMAGE_VARIANT_FORMATS, stockées sous ads/variants/. Leurs métadonnées
+(format, largeur, hauteur, nom, url) sont enregistrées dans AdMedia.variants et,
+pour la photo de carte, recopiées dans Ad.primary_image_variants
+(sync_primary_thumbnail) : le template choisit la plus petite variante utile via
+srcset / sizes (templatetag image_sources), sans lire les fichiers.
+
+Formats par défaut : WebP, puis JPEG pour les navigateurs sans WebP. AVIF est
+optionnel (« avif » en tête de AD_IMAGE_VARIANT_FORMATS) et n'est produit que si
+Pillow sait l'encoder (plugin pillow-avif ou Pillow compilé avec libavif).
+
+Chaîne de traitement (un seul décodage) :
+  - decode_scaled : JPEG décodé directement à l'échelle 1/2, 1/4 ou 1/8 par
+    libjpeg (draft), converti une fois en RGB, puis réduit à MAX_SIZE (reduce()
+    entier puis LANCZOS sur le reste, via reducing_gap) ;
+  - apply_watermark : logo collé au centre de cette image RGB ; le logo réduit
+    et à 50 % d'opacité est mis en cache par processus, par taille ;
+  - image principale, miniature et variantes partent toutes de cette image RGB,
+    encodées dans un même tampon mémoire (encode).
+"""
+import functools
+import logging
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+MAX_SIZE = 1000  # image principale : 1000 px max de côté
+THUMBNAIL_SIZE = (320, 320)
+LOGO_SCALE = 0.25  # logo : 25 % du plus petit côté de l'image
+REDUCING_GAP = 3.0  # reduce() entier tant que la réduction dépasse 3x, LANCZOS ensuite
+_HALF_ALPHA = [value // 2 for value in range(256)]  # table d'opacité 50 % du logo
+WHITE = (255, 255, 255)
+
+DEFAULT_WIDTHS = (160, 320, 640, 1000)
+DEFAULT_FORMATS = ("webp", "jpeg")
+
+VARIANTS_DIR = "ads/variants"
+
+# Paramètres d'encodage par format (même compromis poids / qualité que l'image principale)
+SAVE_OPTIONS = {
+    "webp": {"format": "WEBP", "quality": 60, "method": 6},
+    "avif": {"format": "AVIF", "quality": 50, "speed": 6},
+    "jpeg": {"format": "JPEG", "quality": 70, "optimize": True, "progressive": True},
+}
+MIME_TYPES = {"webp": "image/webp", "avif": "image/avif", "jpeg": "image/jpeg"}
+
+
+def fit_within(size, box) -> tuple:
+    """Dimensions de `size` réduites pour tenir dans `box` (proportions gardées, jamais agrandies)."""
+    width, height = size
+    ratio = min(box[0] / width, box[1] / height, 1)
+    return max(1, int(width * ratio)), max(1, int(height * ratio))
+
+
+def to_rgb(img: Image.Image) -> Image.Image:
+    """Image en RGB ; la transparence est aplatie sur fond blanc."""
+    if img.mode == "RGB":
+        return img
+    if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+        img = img.convert("RGBA")
+        flat = Image.new("RGB", img.size, WHITE)
+        flat.paste(img, mask=img.getchannel("A"))
+        return flat
+    return img.convert("RGB")
+
+
+def decode_scaled(fp, max_size: int = MAX_SIZE) -> tuple:
+    """
+    Décode l'image de `fp` en RGB, réduite pour tenir dans max_size × max_size.
+    Retourne (image, format d'origine). L'image est entièrement chargée : `fp`
+    peut être fermé ensuite.
+    """
+    img = Image.open(fp)
+    original_format = img.format
+    if original_format == "JPEG":
+        # libjpeg décode à la plus petite échelle (1/2, 1/4, 1/8) restant >= max_size
+        img.draft("RGB", (max_size, max_size))
+    img.load()
+    img = to_rgb(img)
+    size = fit_within(img.size, (max_size, max_size))
+    if size != img.size:
+        img = img.resize(size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+    return img, original_format
+
+
+def watermark_logo_path():
+    """Chemin du logo de filigrane (static/img/logo.png), ou None s'il est introuvable."""
+    for static_dir in getattr(settings, "STATICFILES_DIRS", None) or ():
+        path = os.path.join(str(static_dir), "img", "logo.png")
+        if os.path.exists(path):
+            return path
+    path = os.path.join(settings.BASE_DIR, "static", "img", "logo.png")
+    return path if os.path.exists(path) else None
+
+
+@functools.lru_cache(maxsize=4)
+def _logo_source(path: str) -> Image.Image:
+    logo = Image.open(path)
+    logo.load()
+    return logo.convert("RGBA") if logo.mode != "RGBA" else logo
+
+
+@functools.lru_cache(maxsize=32)
+def watermark_logo(path: str, box: int) -> Image.Image:
+    """
+    Logo tenant dans un carré de `box` px, à 50 % d'opacité. Mis en cache par
+    processus : les photos d'une même taille réutilisent le même logo.
+    L'image renvoyée est partagée : ne pas la modifier.
+    """
+    logo = _logo_source(path)
+    if logo.width > logo.height:
+        size = (box, max(1, int(box / (logo.width / logo.height))))
+    else:
+        size = (max(1, int(box * (logo.width / logo.height))), box)
+    logo = logo.resize(size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+    logo.putalpha(logo.getchannel("A").point(_HALF_ALPHA))
+    return logo
+
+
+def apply_watermark(img: Image.Image, logo_path: str) -> None:
+    """Colle le logo (25 % du plus petit côté, opacité 50 %) au centre de `img`, sur place."""
+    box = int(min(img.size) * LOGO_SCALE)
+    if box < 1:
+        return
+    logo = watermark_logo(logo_path, box)
+    position = ((img.width - logo.width) // 2, (img.height - logo.height) // 2)
+    img.paste(logo, position, logo)
+
+
+def thumbnail_of(img: Image.Image) -> Image.Image:
+    """Miniature (THUMBNAIL_SIZE max) de `img`, sans copie intermédiaire de l'image pleine taille."""
+    return img.resize(
+        fit_within(img.size, THUMBNAIL_SIZE), Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP
+    )
+
+
+def encode(img: Image.Image, buffer: BytesIO, **options) -> bytes:
+    """Encode `img` dans `buffer` (vidé puis réutilisé) et retourne les octets."""
+    buffer.seek(0)
+    buffer.truncate()
+    img.save(buffer, **options)
+    return buffer.getvalue()
+
+
+def available_formats() -> list:
+    """Formats de AD_IMAGE_VARIANT_FORMATS que ce Pillow sait encoder, dans l'ordre de préférence."""
+    Image.init()
+    formats = getattr(settings, "AD_IMAGE_VARIANT_FORMATS", DEFAULT_FORMATS)
+    return [fmt for fmt in formats if fmt in SAVE_OPTIONS and SAVE_OPTIONS[fmt]["format"] in Image.SAVE]
+
+
+def variant_widths(src_width: int) -> list:
+    """
+    Largeurs à produire pour une image de `src_width` px : celles de
+    AD_IMAGE_VARIANT_WIDTHS plus petites que l'image, plus l'image elle-même
+    (jamais d'agrandissement), triées par ordre croissant.
+    """
+    widths = sorted(set(getattr(settings, "AD_IMAGE_VARIANT_WIDTHS", DEFAULT_WIDTHS)))
+    if not widths:
+        return []
+    top = min(src_width, widths[-1])
+    return [w for w in widths if w < top] + [top]
+
+
+def build_variants(img: Image.Image, base_name: str, storage, buffer: BytesIO = None) -> list:
+    """
+    Encode et enregistre les variantes de `img` (RGB, déjà filigranée) dans `storage`.
+    Les réductions s'enchaînent de la plus grande à la plus petite : chaque
+    variante est calculée depuis la précédente, pas depuis l'image pleine taille.
+    Retourne les métadonnées, triées par format puis largeur croissante.
+    """
+    formats = available_formats()
+    if not formats:
+        return []
+    stem = os.path.basename(base_name) or "image"
+    buffer = buffer if buffer is not None else BytesIO()
+    variants = []
+    current = img
+    for width in reversed(variant_widths(img.width)):
+        if current.width != width:
+            height = max(1, round(current.height * width / current.width))
+            current = current.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+        for fmt in formats:
+            content = ContentFile(encode(current, buffer, **SAVE_OPTIONS[fmt]))
+            # Supabase n'accepte pas application/octet-stream
+            content.content_type = MIME_TYPES[fmt]
+            name = storage.save(f"{VARIANTS_DIR}/{stem}_{width}w.{fmt}", content)
+            variants.append({
+                "format": fmt,
+                "width": current.width,
+                "height": current.height,
+                "name": name,
+                "url": storage.url(name),
+            })
+    order = {fmt: i for i, fmt in enumerate(formats)}
+    variants.sort(key=lambda v: (order[v["format"]], v["width"]))
+    return variants
+
+
+def delete_variants(variants, storage) -> None:
+    """Supprime les fichiers des variantes (erreurs de stockage journalisées, jamais propagées)."""
+    for variant in variants or ():
+        try:
+            storage.delete(variant["name"])
+        except Exception as e:
+            logger.warning("Suppression variante %s impossible : %s", variant.get("name"), e)
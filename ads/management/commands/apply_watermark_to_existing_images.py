@@ -1,11 +1,18 @@
 """
 Commande pour appliquer le filigrane aux images existantes
+
+Traitement en parallèle (ads/batch.py) : un processus par cœur par défaut, reprise
+possible après interruption avec --checkpoint.
+
+Usage:
+    python manage.py apply_watermark_to_existing_images
+    python manage.py apply_watermark_to_existing_images --workers 4 --checkpoint /tmp/watermark.json
 """
-import os
 from django.core.management.base import BaseCommand
+
+from ads.batch import DEFAULT_CHUNK_SIZE, default_workers, run_batch
+from ads.imaging import watermark_logo_path
 from ads.models import AdMedia
-from django.db import transaction
-from django.conf import settings
 
 
 class Command(BaseCommand):
@@ -23,84 +30,70 @@ class Command(BaseCommand):
             default=None,
             help='Limite le nombre d\'images à traiter',
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=default_workers(),
+            help='Nombre de processus de traitement (défaut : nombre de cœurs)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help='Images par paquet (lecture des ids et mise à jour en base)',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default=None,
+            help='Fichier de reprise : relancer avec le même fichier reprend après la dernière image traitée',
+        )
 
     def handle(self, *args, **options):
         dry_run = options['dry_run']
         limit = options['limit']
-        
+
         # Vérifier que le logo existe
-        logo_path = None
-        if hasattr(settings, 'STATICFILES_DIRS') and settings.STATICFILES_DIRS:
-            for static_dir in settings.STATICFILES_DIRS:
-                potential_path = os.path.join(str(static_dir), 'img', 'logo.png')
-                if os.path.exists(potential_path):
-                    logo_path = potential_path
-                    break
-        
+        logo_path = watermark_logo_path()
         if not logo_path:
-            logo_path = os.path.join(settings.BASE_DIR, 'static', 'img', 'logo.png')
-        
-        if not os.path.exists(logo_path):
-            self.stdout.write(
-                self.style.ERROR(f"✗ Logo introuvable à: {logo_path}")
-            )
+            self.stdout.write(self.style.ERROR("✗ Logo introuvable (static/img/logo.png)"))
             self.stdout.write("Vérifiez que le fichier static/img/logo.png existe.")
             return
-        
+
         self.stdout.write(f"Logo trouvé: {logo_path}")
-        
+
         # Traiter uniquement les images sans filigrane (idempotent : safe à chaque déploiement)
-        all_media = AdMedia.objects.filter(has_watermark=False)
-        if limit:
-            all_media = all_media[:limit]
+        all_media = AdMedia.objects.filter(has_watermark=False).exclude(image="")
 
         total = all_media.count()
+        if limit:
+            total = min(total, limit)
         if total == 0:
             self.stdout.write(self.style.SUCCESS("✓ Toutes les images ont déjà un filigrane."))
             return
-        self.stdout.write(f"Traitement de {total} image(s) sans filigrane...")
-        
-        processed = 0
-        errors = 0
-        
-        for media in all_media:
-            try:
-                if not media.image or not media.image.name:
-                    continue
-
-                # Réinitialiser le flag pour forcer l'application du filigrane
-                media._watermark_applied = False
-
-                if dry_run:
-                    self.stdout.write(f"  [DRY-RUN] Traiterait: {media.image.name} (Ad #{media.ad_id})")
-                else:
-                    self.stdout.write(f"  Traitement: {media.image.name}")
-
-                    # Appliquer le filigrane + régénérer le thumbnail
-                    # _add_watermark_and_thumbnail ouvre l'image depuis le storage (S3/Supabase ou local)
-                    result = media._add_watermark_and_thumbnail()
-                    if result:
-                        media.save(update_fields=["image", "thumbnail", "has_watermark"])
-                        processed += 1
-                        self.stdout.write(
-                            self.style.SUCCESS(f"  ✓ Filigrane appliqué: {media.image.name} (Ad #{media.ad_id})")
-                        )
-                    else:
-                        self.stdout.write(
-                            self.style.WARNING(f"  ⚠ Impossible d'appliquer le filigrane: {media.image.name}")
-                        )
-                        errors += 1
-                        
-            except Exception as e:
-                errors += 1
-                self.stdout.write(
-                    self.style.ERROR(f"  ✗ Erreur pour {media.image.name if media.image else 'image inconnue'}: {str(e)}")
-                )
-        
+
         if dry_run:
+            for media in all_media.order_by("pk").only("pk", "ad_id", "image")[:total].iterator(chunk_size=500):
+                self.stdout.write(f"  [DRY-RUN] Traiterait: {media.image.name} (Ad #{media.ad_id})")
             self.stdout.write(self.style.WARNING(f"\n[DRY-RUN] {total} image(s) seraient traitées"))
-        else:
-            self.stdout.write(self.style.SUCCESS(f"\n✓ {processed} image(s) traitées avec succès"))
-            if errors > 0:
-                self.stdout.write(self.style.WARNING(f"⚠ {errors} erreur(s) rencontrée(s)"))
+            return
+
+        self.stdout.write(f"Traitement de {total} image(s) sans filigrane ({options['workers']} processus)...")
+
+        def report(done, failed, last_pk):
+            self.stdout.write(f"  ✓ {len(done)} image(s) traitée(s), {len(failed)} échec(s) — jusqu'à AdMedia #{last_pk}")
+            for pk in failed:
+                self.stdout.write(self.style.WARNING(f"  ⚠ Impossible d'appliquer le filigrane: AdMedia #{pk}"))
+
+        result = run_batch(
+            all_media,
+            "watermark",
+            workers=options['workers'],
+            chunk_size=options['chunk_size'],
+            checkpoint=options['checkpoint'],
+            limit=limit,
+            on_chunk=report,
+        )
 
+        self.stdout.write(self.style.SUCCESS(f"\n✓ {result['processed']} image(s) traitées avec succès"))
+        if result['failed'] > 0:
+            self.stdout.write(self.style.WARNING(f"⚠ {result['failed']} erreur(s) rencontrée(s)"))
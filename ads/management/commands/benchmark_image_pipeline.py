@@ -0,0 +1,148 @@
+"""
+Mesure le coût du traitement des photos (filigrane + image principale + miniature) :
+temps CPU par image et pic de mémoire (RSS), ancienne chaîne contre chaîne actuelle.
+
+Chaque chaîne tourne dans un processus fils dédié (fork) : le pic RSS de l'une
+n'influence pas l'autre. Le pic est donné au-dessus du RSS du fils au démarrage
+(photos sources déjà en mémoire). Les variantes responsive, identiques dans les
+deux cas, ne sont pas mesurées.
+
+Usage:
+    python manage.py benchmark_image_pipeline
+    python manage.py benchmark_image_pipeline --images 50 --size 4000x3000
+    python manage.py benchmark_image_pipeline --source /chemin/vers/photos
+"""
+import multiprocessing
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from ads.imaging import apply_watermark, decode_scaled, encode, thumbnail_of, watermark_logo_path
+
+
+def legacy_pipeline(data: bytes, logo_path: str) -> None:
+    """Chaîne d'origine : décodage pleine taille, RGBA, logo relu et réduit à chaque appel, copie pour la miniature."""
+    img = Image.open(BytesIO(data))
+    if img.width > 1000 or img.height > 1000:
+        ratio = min(1000 / img.width, 1000 / img.height)
+        img = img.resize((int(img.width * ratio), int(img.height * ratio)), Image.Resampling.LANCZOS)
+    if img.mode != "RGBA":
+        img = img.convert("RGBA")
+    logo = Image.open(logo_path)
+    if logo.mode != "RGBA":
+        logo = logo.convert("RGBA")
+    logo_size = int(min(img.size) * 0.25)
+    logo_ratio = logo.width / logo.height
+    if logo.width > logo.height:
+        size = (logo_size, int(logo_size / logo_ratio))
+    else:
+        size = (int(logo_size * logo_ratio), logo_size)
+    logo = logo.resize(size, Image.Resampling.LANCZOS)
+    r, g, b, a = logo.split()
+    a = a.point(lambda x: int(x * 0.5))
+    logo = Image.merge("RGBA", (r, g, b, a))
+    img.paste(logo, ((img.width - size[0]) // 2, (img.height - size[1]) // 2), logo)
+    rgb = Image.new("RGB", img.size, (255, 255, 255))
+    rgb.paste(img, mask=img.split()[3])
+    output = BytesIO()
+    rgb.save(output, format="WEBP", quality=60, method=6, optimize=True)
+    thumb = img.convert("RGB") if img.mode != "RGB" else img.copy()
+    thumb.thumbnail((320, 320), Image.Resampling.LANCZOS)
+    thumb_output = BytesIO()
+    thumb.save(thumb_output, format="WEBP", quality=50, method=6, optimize=True)
+
+
+def current_pipeline(data: bytes, logo_path: str) -> None:
+    """Chaîne actuelle (AdMedia._add_watermark_and_thumbnail, hors stockage)."""
+    img, _ = decode_scaled(BytesIO(data))
+    apply_watermark(img, logo_path)
+    buffer = BytesIO()
+    encode(img, buffer, format="WEBP", quality=60, method=6)
+    encode(thumbnail_of(img), buffer, format="WEBP", quality=50, method=6)
+
+
+PIPELINES = {"avant": legacy_pipeline, "après": current_pipeline}
+
+
+def _rss_kib() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+
+
+def _run(name: str, payloads: list, logo_path: str) -> tuple:
+    """Dans le processus fils : temps CPU total et pic RSS au-dessus du RSS de départ (Kio)."""
+    baseline = _rss_kib()
+    pipeline = PIPELINES[name]
+    start = time.process_time()
+    for data in payloads:
+        pipeline(data, logo_path)
+    cpu = time.process_time() - start
+    return cpu, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+
+
+def _synthetic_jpeg(width: int, height: int, seed: int) -> bytes:
+    """Photo de test : dégradé + bruit (s'encode comme une vraie photo, pas comme un aplat)."""
+    noise = Image.effect_noise((width, height), 40 + seed % 20)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    img = Image.merge("RGB", (noise, gradient, Image.eval(noise, lambda v: 255 - v)))
+    output = BytesIO()
+    img.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+class Command(BaseCommand):
+    help = "Compare temps CPU et pic RSS par photo entre l'ancienne et la nouvelle chaîne de traitement d'image"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--images", type=int, default=20, help="Nombre de photos de test (défaut 20)")
+        parser.add_argument("--size", default="4000x3000", help="Taille des photos de test (défaut 4000x3000)")
+        parser.add_argument("--source", help="Dossier de photos réelles à utiliser à la place des photos de test")
+
+    def handle(self, *args, **options):
+        logo_path = watermark_logo_path()
+        if not logo_path:
+            raise CommandError("Logo de filigrane introuvable (static/img/logo.png).")
+        payloads = self._payloads(options)
+        if not payloads:
+            raise CommandError("Aucune photo à traiter.")
+        self.stdout.write(f"{len(payloads)} photo(s), un processus fils par chaîne...")
+
+        context = multiprocessing.get_context("fork")
+        results = {}
+        for name in PIPELINES:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                results[name] = pool.submit(_run, name, payloads, logo_path).result()
+
+        for name, (cpu, peak_kib) in results.items():
+            self.stdout.write(
+                f"{name:>6} : {cpu / len(payloads) * 1000:7.1f} ms CPU / photo, "
+                f"pic RSS +{peak_kib / 1024:6.1f} Mio"
+            )
+        before, after = results["avant"], results["après"]
+        if after[0]:
+            self.stdout.write(self.style.SUCCESS(
+                f"CPU ÷ {before[0] / after[0]:.2f}, pic RSS {after[1] - before[1]:+.0f} Kio"
+            ))
+
+    def _payloads(self, options) -> list:
+        source = options.get("source")
+        if source:
+            names = sorted(
+                name for name in os.listdir(source)
+                if name.lower().endswith((".jpg", ".jpeg", ".png", ".webp"))
+            )[:options["images"]]
+            payloads = []
+            for name in names:
+                with open(os.path.join(source, name), "rb") as f:
+                    payloads.append(f.read())
+            return payloads
+        try:
+            width, height = (int(v) for v in options["size"].lower().split("x"))
+        except ValueError:
+            raise CommandError("--size attendu sous la forme LARGEURxHAUTEUR, ex. 4000x3000")
+        return [_synthetic_jpeg(width, height, seed) for seed in range(options["images"])]
@@ -2,6 +2,7 @@ import logging
 
 from django.core.management.base import BaseCommand
 
+from ads.batch import DEFAULT_CHUNK_SIZE, default_workers, run_batch
 from ads.models import AdMedia
 
 
@@ -17,6 +18,18 @@ class Command(BaseCommand):
             action="store_true",
             help="Regénérer les miniatures même si elles existent déjà.",
         )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=default_workers(),
+            help="Nombre de processus de traitement (défaut : nombre de cœurs).",
+        )
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument(
+            "--checkpoint",
+            default=None,
+            help="Fichier de reprise : relancer avec le même fichier reprend après le dernier média traité.",
+        )
 
     def handle(self, *args, **options):
         force = options["force"]
@@ -36,26 +49,22 @@ class Command(BaseCommand):
             )
         )
 
-        processed = 0
-        errors = 0
-
-        for media in qs.iterator():
-            try:
-                # Utilise la logique existante (filigrane + thumbnail)
-                ok = media._add_watermark_and_thumbnail()
-                if ok:
-                    media.save(update_fields=["thumbnail"])
-                    processed += 1
-                else:
-                    errors += 1
-                    logger.warning("Impossible de générer la miniature pour AdMedia id=%s", media.id)
-            except Exception as e:
-                errors += 1
-                logger.exception("Erreur lors de la génération de miniature pour AdMedia id=%s: %s", media.id, e)
+        def report(done, failed, last_pk):
+            for pk in failed:
+                logger.warning("Impossible de générer la miniature pour AdMedia id=%s", pk)
+
+        # Utilise la logique existante (filigrane + thumbnail), en parallèle
+        result = run_batch(
+            qs,
+            "watermark",
+            workers=options["workers"],
+            chunk_size=options["chunk_size"],
+            checkpoint=options["checkpoint"],
+            on_chunk=report,
+        )
 
         self.stdout.write(
             self.style.SUCCESS(
-                f"Miniatures générées: {processed} / {total} (erreurs: {errors})."
+                f"Miniatures générées: {result['processed']} / {total} (erreurs: {result['failed']})."
             )
         )
-
@@ -0,0 +1,20 @@
+"""
+Reconstruit le fil public précalculé (AdFeedEntry) à partir de la table Ad.
+
+Usage:
+    python manage.py rebuild_ad_feed
+"""
+from django.core.management.base import BaseCommand
+
+from ads.feed import rebuild_feed
+
+
+class Command(BaseCommand):
+    help = "Reconstruit le fil public précalculé des annonces (AdFeedEntry)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        total = rebuild_feed(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"{total} annonce(s) dans le fil."))
@@ -2,18 +2,18 @@
 Régénère les miniatures (thumbnails) de toutes les images existantes
 avec les paramètres de compression actuels (quality=50, 320x320).
 
+Traitement en parallèle (ads/batch.py), reprise possible avec --checkpoint.
+
 Usage:
     python manage.py regenerate_thumbnails
     python manage.py regenerate_thumbnails --limit 50
     python manage.py regenerate_thumbnails --dry-run
+    python manage.py regenerate_thumbnails --workers 8 --checkpoint /tmp/thumbs.json
 """
-from io import BytesIO
-
-from django.core.files.base import ContentFile
 from django.core.management.base import BaseCommand
 
+from ads.batch import DEFAULT_CHUNK_SIZE, default_workers, run_batch
 from ads.models import AdMedia
-from PIL import Image
 
 
 class Command(BaseCommand):
@@ -22,67 +22,42 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument("--dry-run", action="store_true")
         parser.add_argument("--limit", type=int, default=None)
+        parser.add_argument("--workers", type=int, default=default_workers())
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument("--checkpoint", default=None)
 
     def handle(self, *args, **options):
         dry_run = options["dry_run"]
         limit = options["limit"]
 
         qs = AdMedia.objects.filter(image__isnull=False).exclude(image="")
-        if limit:
-            qs = qs[:limit]
 
         total = qs.count()
+        if limit:
+            total = min(total, limit)
         self.stdout.write(f"Régénération des thumbnails pour {total} image(s)...")
 
-        processed = errors = 0
-
-        for media in qs:
-            try:
-                # Ouvrir l'image existante (watermarkée) depuis le storage
-                img = None
-                try:
-                    if hasattr(media.image, "path"):
-                        import os
-                        if os.path.exists(media.image.path):
-                            img = Image.open(media.image.path)
-                            img.load()
-                except (NotImplementedError, ValueError, OSError):
-                    pass
-
-                if img is None:
-                    with media.image.open("rb") as f:
-                        img = Image.open(f)
-                        img.load()
-
-                if dry_run:
-                    self.stdout.write(f"  [DRY-RUN] {media.image.name} (Ad #{media.ad_id})")
-                    processed += 1
-                    continue
-
-                # Générer thumbnail 320x320 quality=50
-                thumb = img.convert("RGB") if img.mode != "RGB" else img.copy()
-                thumb.thumbnail((320, 320), Image.Resampling.LANCZOS)
-
-                buf = BytesIO()
-                thumb.save(buf, format="WEBP", quality=50, method=6, optimize=True)
-                buf.seek(0)
-
-                import os
-                thumb_name = os.path.splitext(media.image.name)[0] + "_thumb.webp"
-                thumb_file = ContentFile(buf.read())
-                thumb_file.content_type = "image/webp"
-                media.thumbnail.save(thumb_name, thumb_file, save=False)
-                media.save(update_fields=["thumbnail"])
-                buf.close()
-
-                processed += 1
-                self.stdout.write(self.style.SUCCESS(f"  ✓ {media.image.name}"))
-
-            except Exception as e:
-                errors += 1
-                self.stdout.write(self.style.ERROR(f"  ✗ {media.image.name if media.image else '?'}: {e}"))
-
-        verb = "[DRY-RUN]" if dry_run else "✓"
-        self.stdout.write(self.style.SUCCESS(f"\n{verb} {processed}/{total} thumbnail(s) traité(s)"))
-        if errors:
-            self.stdout.write(self.style.WARNING(f"⚠ {errors} erreur(s)"))
+        if dry_run:
+            for media in qs.order_by("pk").only("pk", "ad_id", "image")[:total].iterator(chunk_size=500):
+                self.stdout.write(f"  [DRY-RUN] {media.image.name} (Ad #{media.ad_id})")
+            self.stdout.write(self.style.SUCCESS(f"\n[DRY-RUN] {total}/{total} thumbnail(s) traité(s)"))
+            return
+
+        def report(done, failed, last_pk):
+            self.stdout.write(self.style.SUCCESS(f"  ✓ {len(done)} thumbnail(s) — jusqu'à AdMedia #{last_pk}"))
+            for pk in failed:
+                self.stdout.write(self.style.ERROR(f"  ✗ AdMedia #{pk}"))
+
+        result = run_batch(
+            qs,
+            "thumbnail",
+            workers=options["workers"],
+            chunk_size=options["chunk_size"],
+            checkpoint=options["checkpoint"],
+            limit=limit,
+            on_chunk=report,
+        )
+
+        self.stdout.write(self.style.SUCCESS(f"\n✓ {result['processed']}/{total} thumbnail(s) traité(s)"))
+        if result["failed"]:
+            self.stdout.write(self.style.WARNING(f"⚠ {result['failed']} erreur(s)"))
@@ -0,0 +1,58 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Le fil est créé vide : il est rempli par ads.feed.rebuild_feed (commande
+# rebuild_ad_feed, lancée après migrate au déploiement puis toutes les heures),
+# seul calcul des lignes et des cartes, plutôt que par une copie figée ici.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0018_ad_bumped_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='ad',
+            options={'ordering': ['-bumped_at', '-created_at']},
+        ),
+        migrations.AlterField(
+            model_name='ad',
+            name='bumped_at',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='Dernière remontée en tête de liste. Égal à created_at pour les annonces normales, mis à jour automatiquement pour les annonces boostées.', null=True),
+        ),
+        migrations.AlterField(
+            model_name='ad',
+            name='category',
+            field=models.CharField(choices=[('escorte_girl', 'Escorte girl'), ('escorte_boy', 'Escorte boy'), ('transgenre', 'Transgenre')], max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='ad',
+            name='is_boosted',
+            field=models.BooleanField(default=False, help_text='Boost acheté (remontée périodique)'),
+        ),
+        migrations.CreateModel(
+            name='AdFeedEntry',
+            fields=[
+                ('ad', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='feed_entry', serialize=False, to='ads.ad')),
+                ('rank', models.CharField(max_length=64)),
+                ('category', models.CharField(choices=[('escorte_girl', 'Escorte girl'), ('escorte_boy', 'Escorte boy'), ('transgenre', 'Transgenre')], max_length=20)),
+                ('is_approved', models.BooleanField(default=True)),
+                ('is_urgent', models.BooleanField(default=False)),
+                ('is_premium', models.BooleanField(default=False)),
+                ('is_boosted', models.BooleanField(default=False)),
+                ('card', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ads.city')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-rank'], name='adfeed_rank_idx'), models.Index(fields=['city', '-rank'], name='adfeed_city_rank_idx'), models.Index(fields=['category', '-rank'], name='adfeed_cat_rank_idx'), models.Index(fields=['city', 'category', '-rank'], name='adfeed_city_cat_rank_idx')],
+            },
+        ),
+    ]
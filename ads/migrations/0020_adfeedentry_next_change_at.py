@@ -0,0 +1,29 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:28
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def mark_existing_rows(apps, schema_editor):
+    """
+    Échéance inconnue pour les lignes existantes : « maintenant », soit le TTL minimal
+    jusqu'au prochain rebuild_ad_feed qui calcule la vraie valeur.
+    """
+    AdFeedEntry = apps.get_model("ads", "AdFeedEntry")
+    AdFeedEntry.objects.update(next_change_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ads", "0019_adfeedentry"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="adfeedentry",
+            name="next_change_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_existing_rows, migrations.RunPython.noop),
+    ]
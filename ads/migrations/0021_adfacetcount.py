@@ -0,0 +1,87 @@
+# Generated by Django 5.1.2 on 2026-10-18 13:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_counts(apps, schema_editor):
+    Ad = apps.get_model("ads", "Ad")
+    AdFacetCount = apps.get_model("ads", "AdFacetCount")
+    rows = (
+        Ad.objects.values_list("city_id", "category", "status", "image_processing_done")
+        .annotate(n=Count("id"))
+        .order_by()
+    )
+    AdFacetCount.objects.bulk_create(
+        AdFacetCount(city_id=city_id, category=category, status=status, images_done=done, count=n)
+        for city_id, category, status, done, n in rows
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ads", "0020_adfeedentry_next_change_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AdFacetCount",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "category",
+                    models.CharField(
+                        choices=[
+                            ("escorte_girl", "Escorte girl"),
+                            ("escorte_boy", "Escorte boy"),
+                            ("transgenre", "Transgenre"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("draft", "Draft"),
+                            ("pending", "Pending"),
+                            ("approved", "Approved"),
+                            ("rejected", "Rejected"),
+                            ("archived", "Archived"),
+                            ("expired", "Expirée"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("images_done", models.BooleanField(default=True)),
+                ("count", models.IntegerField(default=0)),
+                (
+                    "city",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="ads.city",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("city", "category", "status", "images_done"),
+                        name="adfacetcount_unique",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(populate_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,132 @@
+from django.db import DatabaseError, migrations
+
+# SQL figé ici (et non importé de ads.search) : une modification ultérieure du
+# code applicatif ne doit pas changer ce que cette migration a installé.
+
+PG_SETUP = [
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    # unaccent() n'est pas IMMUTABLE : enveloppe utilisable dans un index / trigger.
+    # Schéma de l'extension lu dans pg_extension (public, ou extensions sur Supabase).
+    """
+    DO $do$
+    DECLARE ext_schema text;
+    BEGIN
+      SELECT n.nspname INTO ext_schema
+      FROM pg_extension e JOIN pg_namespace n ON n.oid = e.extnamespace
+      WHERE e.extname = 'unaccent';
+      EXECUTE format(
+        $f$CREATE OR REPLACE FUNCTION kiaba_unaccent(text) RETURNS text
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+        AS $body$ SELECT %1$I.unaccent(%2$L::regdictionary, $1) $body$$f$,
+        ext_schema, quote_ident(ext_schema) || '.unaccent'
+      );
+    END
+    $do$
+    """,
+    "ALTER TABLE ads_ad ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    """
+    CREATE OR REPLACE FUNCTION ads_ad_search_vector_update() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    BEGIN
+      NEW.search_vector :=
+        setweight(to_tsvector('french', kiaba_unaccent(coalesce(NEW.title, ''))), 'A') ||
+        setweight(to_tsvector('french', kiaba_unaccent(coalesce(NEW.subcategories::text, ''))), 'B') ||
+        setweight(to_tsvector('french', kiaba_unaccent(coalesce(NEW.description_sanitized, ''))), 'C');
+      RETURN NEW;
+    END
+    $$
+    """,
+    "DROP TRIGGER IF EXISTS ads_ad_search_vector_trg ON ads_ad",
+    """
+    CREATE TRIGGER ads_ad_search_vector_trg
+    BEFORE INSERT OR UPDATE OF title, description_sanitized, subcategories ON ads_ad
+    FOR EACH ROW EXECUTE FUNCTION ads_ad_search_vector_update()
+    """,
+    "CREATE INDEX IF NOT EXISTS ad_search_vector_gin ON ads_ad USING GIN (search_vector)",
+    "UPDATE ads_ad SET title = title WHERE search_vector IS NULL",
+]
+
+PG_TEARDOWN = [
+    "DROP TRIGGER IF EXISTS ads_ad_search_vector_trg ON ads_ad",
+    "DROP FUNCTION IF EXISTS ads_ad_search_vector_update()",
+    "DROP INDEX IF EXISTS ad_search_vector_gin",
+    "ALTER TABLE ads_ad DROP COLUMN IF EXISTS search_vector",
+    "DROP FUNCTION IF EXISTS kiaba_unaccent(text)",
+]
+
+SQLITE_SETUP = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS ads_ad_fts USING fts5("
+    "title, subcategories, description, tokenize='unicode61 remove_diacritics 2')",
+    """
+    CREATE TRIGGER IF NOT EXISTS ads_ad_fts_ai AFTER INSERT ON ads_ad BEGIN
+      INSERT INTO ads_ad_fts(rowid, title, subcategories, description)
+      VALUES (new.id, new.title, (SELECT group_concat(value, ' ') FROM json_each(new.subcategories)),
+              new.description_sanitized);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS ads_ad_fts_ad AFTER DELETE ON ads_ad BEGIN
+      DELETE FROM ads_ad_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS ads_ad_fts_au
+    AFTER UPDATE OF title, description_sanitized, subcategories ON ads_ad BEGIN
+      DELETE FROM ads_ad_fts WHERE rowid = old.id;
+      INSERT INTO ads_ad_fts(rowid, title, subcategories, description)
+      VALUES (new.id, new.title, (SELECT group_concat(value, ' ') FROM json_each(new.subcategories)),
+              new.description_sanitized);
+    END
+    """,
+    "DELETE FROM ads_ad_fts",
+    "INSERT INTO ads_ad_fts(rowid, title, subcategories, description) "
+    "SELECT id, title, (SELECT group_concat(value, ' ') FROM json_each(ads_ad.subcategories)), "
+    "description_sanitized FROM ads_ad",
+]
+
+SQLITE_TEARDOWN = [
+    "DROP TRIGGER IF EXISTS ads_ad_fts_ai",
+    "DROP TRIGGER IF EXISTS ads_ad_fts_ad",
+    "DROP TRIGGER IF EXISTS ads_ad_fts_au",
+    "DROP TABLE IF EXISTS ads_ad_fts",
+]
+
+
+def _execute(schema_editor, statements):
+    with schema_editor.connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+
+
+def install(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        _execute(schema_editor, PG_SETUP)
+    elif vendor == "sqlite":
+        try:
+            _execute(schema_editor, SQLITE_SETUP)
+        except DatabaseError:  # SQLite compilé sans FTS5 : repli icontains
+            pass
+
+
+def uninstall(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        _execute(schema_editor, PG_TEARDOWN)
+    elif vendor == "sqlite":
+        _execute(schema_editor, SQLITE_TEARDOWN)
+
+
+class Migration(migrations.Migration):
+    """
+    Index plein texte des annonces, hors modèle (SQL propre à chaque moteur) :
+    tsvector + trigger + GIN sur PostgreSQL, table virtuelle FTS5 + triggers sur SQLite.
+    """
+
+    dependencies = [
+        ("ads", "0021_adfacetcount"),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.1.2 on 2026-10-18 14:04
+
+from django.db import migrations, models
+
+
+def populate_primary_thumbnails(apps, schema_editor):
+    # URL seulement : les dimensions seront renseignées au prochain traitement d'image
+    Ad = apps.get_model("ads", "Ad")
+    AdMedia = apps.get_model("ads", "AdMedia")
+    seen = set()
+    for media in AdMedia.objects.order_by("ad_id", "-is_primary", "pk").iterator():
+        if media.ad_id in seen:
+            continue
+        seen.add(media.ad_id)
+        field = media.thumbnail or media.image
+        try:
+            url = field.url if field else ""
+        except Exception:
+            url = ""
+        if url:
+            Ad.objects.filter(pk=media.ad_id).update(primary_thumbnail_url=url)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ads", "0022_ad_fulltext_search"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ad",
+            name="primary_thumbnail_height",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="ad",
+            name="primary_thumbnail_url",
+            field=models.CharField(blank=True, default="", max_length=500),
+        ),
+        migrations.AddField(
+            model_name="ad",
+            name="primary_thumbnail_width",
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(populate_primary_thumbnails, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.1.2 on 2026-10-18 14:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ads", "0024_adcontactdaily"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AdEvent",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[("view", "Vue"), ("favorite", "Favori")], max_length=10
+                    ),
+                ),
+                ("created_at", models.DateTimeField(db_index=True)),
+                (
+                    "ad",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="ads.ad",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="AdDailyStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("day", models.DateField()),
+                ("views", models.PositiveIntegerField(default=0)),
+                ("contacts", models.PositiveIntegerField(default=0)),
+                ("favorites", models.PositiveIntegerField(default=0)),
+                (
+                    "ad",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="daily_stats",
+                        to="ads.ad",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("ad", "day"), name="addailystats_unique"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 14:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ads", "0025_ad_analytics"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ad",
+            name="primary_image_variants",
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name="admedia",
+            name="variants",
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.2 on 2026-10-18 14:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ads", "0026_responsive_image_variants"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="admedia",
+            index=models.Index(
+                condition=models.Q(("has_watermark", False)),
+                fields=["id"],
+                name="admedia_pending_wm_idx",
+            ),
+        ),
+    ]
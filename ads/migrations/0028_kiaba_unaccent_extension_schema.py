@@ -0,0 +1,37 @@
+from django.db import migrations
+
+# kiaba_unaccent appelait public.unaccent : la recréer avec le schéma réel de
+# l'extension (pg_extension), pour les bases où 0022 a déjà été appliquée.
+PG_UNACCENT = """
+DO $do$
+DECLARE ext_schema text;
+BEGIN
+  SELECT n.nspname INTO ext_schema
+  FROM pg_extension e JOIN pg_namespace n ON n.oid = e.extnamespace
+  WHERE e.extname = 'unaccent';
+  EXECUTE format(
+    $f$CREATE OR REPLACE FUNCTION kiaba_unaccent(text) RETURNS text
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    AS $body$ SELECT %1$I.unaccent(%2$L::regdictionary, $1) $body$$f$,
+    ext_schema, quote_ident(ext_schema) || '.unaccent'
+  );
+END
+$do$
+"""
+
+
+def resolve_unaccent_schema(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(PG_UNACCENT)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ads", "0027_admedia_pending_watermark_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(resolve_unaccent_schema, migrations.RunPython.noop),
+    ]
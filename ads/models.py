@@ -4,12 +4,21 @@ from django.utils import timezone
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
-from PIL import Image, ImageEnhance
 import logging
 import os
 from io import BytesIO
 from django.core.files.base import ContentFile
 
+from .imaging import (
+    apply_watermark,
+    build_variants,
+    decode_scaled,
+    delete_variants,
+    encode,
+    thumbnail_of,
+    watermark_logo_path,
+)
+
 logger = logging.getLogger(__name__)
 
 
@@ -42,6 +51,27 @@ class Feature(models.Model):
         return self.name
 
 
+# Colonnes d'Ad lues pour afficher une carte (listes, favoris, profil public, tableau de bord)
+CARD_FIELDS = (
+    "id", "slug", "title", "category", "subcategories", "status", "city", "city__name", "city__slug",
+    "user", "is_verified", "is_premium", "is_boosted", "is_urgent", "boost_interval_hours",
+    "boost_expires_at", "views_count", "expires_at", "created_at", "updated_at", "bumped_at",
+    "image_processing_done", "primary_thumbnail_url", "primary_thumbnail_width", "primary_thumbnail_height",
+    "primary_image_variants",
+)
+
+
+class AdQuerySet(models.QuerySet):
+    def cards(self, *extra_fields):
+        """
+        Projection « carte » : colonnes de CARD_FIELDS (+ extra_fields) avec la ville.
+        La photo vient des champs primary_thumbnail_* : aucune requête sur AdMedia.
+        Ni description, ni JSON additionnels, ni lignes user / profile.
+        """
+        related = {"city"} | {f.split("__")[0] for f in extra_fields if "__" in f}
+        return self.select_related(*related).only(*CARD_FIELDS, *extra_fields)
+
+
 class Ad(models.Model):
     class Category(models.TextChoices):
         ESCORTE_GIRL = "escorte_girl", "Escorte girl"
@@ -112,6 +142,16 @@ class Ad(models.Model):
 
     features = models.ManyToManyField(Feature, through="AdFeature", blank=True)
 
+    # Miniature de la photo de carte, recopiée par sync_primary_thumbnail() : les listes
+    # n'ont pas à lire AdMedia
+    primary_thumbnail_url = models.CharField(max_length=500, blank=True, default="")
+    primary_thumbnail_width = models.PositiveSmallIntegerField(null=True, blank=True)
+    primary_thumbnail_height = models.PositiveSmallIntegerField(null=True, blank=True)
+    # Variantes responsive de cette photo (AdMedia.variants) pour le srcset des cartes
+    primary_image_variants = models.JSONField(default=list, blank=True)
+
+    objects = AdQuerySet.as_manager()
+
     # Flags anti-doublon pour les emails de pré-expiration
     expiry_notified_24h = models.BooleanField(default=False, help_text=_("Email d'avertissement J-1 déjà envoyé"))
     expiry_notified_1h = models.BooleanField(default=False, help_text=_("Email d'avertissement H-1 déjà envoyé"))
@@ -189,6 +229,48 @@ class Ad(models.Model):
     get_subcategories_display.short_description = "Sous-catégories"
 
 
+def _file_url(field) -> str:
+    try:
+        return field.url if field else ""
+    except Exception:
+        return ""
+
+
+def sync_primary_thumbnail(ad_id: int, processed=None) -> None:
+    """
+    Recopie sur l'annonce la miniature de sa photo de carte (principale, à défaut la
+    première envoyée ; l'image elle-même tant que la miniature n'existe pas) et met
+    à jour updated_at (clé du fragment de carte), avec ses variantes responsive.
+    `processed` : AdMedia qui vient d'être traité, dont les dimensions de miniature
+    sont connues sans relire le fichier.
+    """
+    media = (
+        AdMedia.objects.filter(ad_id=ad_id)
+        .order_by("-is_primary", "pk")
+        .only("id", "image", "thumbnail", "variants")
+        .first()
+    )
+    url, width, height, variants = "", None, None, []
+    if media is not None:
+        url = _file_url(media.thumbnail) or _file_url(media.image)
+        variants = media.variants or []
+        size = getattr(processed, "_thumbnail_size", None) if processed is not None else None
+        if size and processed.pk == media.pk:
+            width, height = size
+        elif media.thumbnail:
+            try:
+                width, height = media.thumbnail.width, media.thumbnail.height
+            except Exception:  # fichier illisible / stockage distant indisponible
+                pass
+    Ad.objects.filter(pk=ad_id).update(
+        primary_thumbnail_url=url,
+        primary_thumbnail_width=width,
+        primary_thumbnail_height=height,
+        primary_image_variants=variants,
+        updated_at=timezone.now(),
+    )
+
+
 def _apply_watermark_sync(pk: int) -> None:
     """Applique le filigrane à un AdMedia existant (fallback synchrone sans Celery)."""
     try:
@@ -196,7 +278,7 @@ def _apply_watermark_sync(pk: int) -> None:
         media._watermark_applied = False
         result = media._add_watermark_and_thumbnail()
         if result:
-            media.save(update_fields=["image", "thumbnail", "has_watermark"])
+            media.save(update_fields=AdMedia.PROCESSED_FIELDS)
     except AdMedia.DoesNotExist:
         pass
     except Exception as e:
@@ -211,8 +293,20 @@ class AdMedia(models.Model):
     thumbnail = models.ImageField(upload_to="ads/thumbnails/", blank=True, null=True)
     is_primary = models.BooleanField(default=False)
     has_watermark = models.BooleanField(default=False, help_text="Filigrane appliqué sur cette image")
+    # Variantes responsive (ads.imaging) : [{"format", "width", "height", "name", "url"}, ...]
+    variants = models.JSONField(default=list, blank=True)
     _watermark_applied = False  # Flag pour éviter de réappliquer le filigrane
 
+    # Champs écrits par _add_watermark_and_thumbnail (save(update_fields=...))
+    PROCESSED_FIELDS = ["image", "thumbnail", "has_watermark", "variants"]
+
+    class Meta:
+        indexes = [
+            # Photos encore sans filigrane (cron_apply_watermarks) : index partiel, quasi vide
+            # une fois le retard résorbé
+            models.Index(fields=["id"], condition=models.Q(has_watermark=False), name="admedia_pending_wm_idx"),
+        ]
+
     def clean(self):
         # Enforce max 5 media per Ad
         existing = (
@@ -224,7 +318,9 @@ class AdMedia(models.Model):
     def _add_watermark_and_thumbnail(self):
         """
         Ajoute le filigrane du logo au centre de l'image
-        + génère une miniature optimisée (thumbnail) pour les listes.
+        + génère une miniature optimisée (thumbnail) et les variantes responsive.
+        L'image est décodée une seule fois, déjà réduite, et toutes les sorties
+        partent de la même image RGB (cf. ads/imaging.py).
         """
         if not self.image or self._watermark_applied:
             return False
@@ -236,151 +332,52 @@ class AdMedia(models.Model):
         try:
             # Déterminer le chemin de l'image (jamais utiliser .path avec S3/Supabase — lève "doesn't support absolute paths")
             image_path = None
-            original_format = None
-            img = None
-
             try:
                 if hasattr(self.image, "path"):
                     _path = self.image.path
                     if _path and os.path.exists(_path):
                         image_path = _path
-                        img = Image.open(image_path)
-                        original_format = img.format
             except (NotImplementedError, ValueError, OSError):
                 # Stockage distant (S3/Supabase) : pas de .path
                 pass
 
-            if img is None and image_path is None and hasattr(self.image, "file") and hasattr(self.image.file, "read"):
+            # Décodage unique : réduit à 1000 px max (JPEG décodé directement à l'échelle), en RGB
+            if image_path:
+                with open(image_path, "rb") as f:
+                    img, original_format = decode_scaled(f)
+            elif hasattr(self.image, "file") and hasattr(self.image.file, "read"):
                 # Fichier en mémoire (nouveau upload)
                 self.image.file.seek(0)
-                img = Image.open(self.image.file)
-                original_format = img.format
-            elif img is None and image_path is None and self.image.name:
+                img, original_format = decode_scaled(self.image.file)
+            elif self.image.name:
                 # Ouvrir depuis le storage (S3/Supabase)
                 with self.image.open("rb") as f:
-                    img = Image.open(f)
-                    img.load()
-                original_format = img.format
-
-            if img is None:
+                    img, original_format = decode_scaled(f)
+            else:
                 logger.warning("Impossible d'ouvrir l'image, abandon filigrane/thumbnail: %s", self.image.name)
                 return False
-            if not original_format:
-                ext = os.path.splitext(self.image.name or "")[1].lower()
-                format_map = {".jpg": "JPEG", ".jpeg": "JPEG", ".png": "PNG", ".webp": "WEBP"}
-                original_format = format_map.get(ext, "JPEG")
-
-            # OPTIMISATION : Redimensionner pour alléger (max 1000px, qualité réduite plus bas)
-            MAX_WIDTH = 1000
-            MAX_HEIGHT = 1000
-            img_width, img_height = img.size
-
-            if img_width > MAX_WIDTH or img_height > MAX_HEIGHT:
-                ratio = min(MAX_WIDTH / img_width, MAX_HEIGHT / img_height)
-                new_width = int(img_width * ratio)
-                new_height = int(img_height * ratio)
-                img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                logger.info(
-                    f"Image redimensionnée de {img_width}x{img_height} à {new_width}x{new_height}"
-                )
-
-            # Convertir en RGBA pour le traitement
-            if img.mode != "RGBA":
-                img = img.convert("RGBA")
-
-            # Chercher le logo dans STATICFILES_DIRS
-            logo_path = None
-            if hasattr(settings, "STATICFILES_DIRS") and settings.STATICFILES_DIRS:
-                for static_dir in settings.STATICFILES_DIRS:
-                    potential_path = os.path.join(str(static_dir), "img", "logo.png")
-                    if os.path.exists(potential_path):
-                        logo_path = potential_path
-                        break
 
-            # Si pas trouvé, essayer le chemin par défaut
-            if not logo_path:
-                logo_path = os.path.join(settings.BASE_DIR, "static", "img", "logo.png")
-
-            if not os.path.exists(logo_path):
+            logo_path = watermark_logo_path()
+            if logo_path:
+                apply_watermark(img, logo_path)
+            else:
                 # Si le logo n'existe pas, on ne fait rien, mais on peut tout de même générer un thumbnail
                 logger.warning(
                     "Logo pour filigrane introuvable, génération seulement du thumbnail."
                 )
 
-            # Si le logo existe, appliquer le filigrane
-            if os.path.exists(logo_path):
-                logo = Image.open(logo_path)
-                if logo.mode != "RGBA":
-                    logo = logo.convert("RGBA")
-
-                # Taille du logo (25 % de la plus petite dimension)
-                img_width, img_height = img.size
-                min_dimension = min(img_width, img_height)
-                logo_size = int(min_dimension * 0.25)
-
-                logo_ratio = logo.width / logo.height
-                if logo.width > logo.height:
-                    new_logo_width = logo_size
-                    new_logo_height = int(logo_size / logo_ratio)
-                else:
-                    new_logo_height = logo_size
-                    new_logo_width = int(logo_size * logo_ratio)
-
-                logo = logo.resize((new_logo_width, new_logo_height), Image.Resampling.LANCZOS)
-
-                # Opacité 50 % : réduire le canal alpha
-                r, g, b, a = logo.split()
-                a = a.point(lambda x: int(x * 0.5))
-                logo = Image.merge("RGBA", (r, g, b, a))
-
-                # Position au centre
-                x = (img_width - new_logo_width) // 2
-                y = (img_height - new_logo_height) // 2
-
-                img.paste(logo, (x, y), logo)
-
-            # Sauvegarder l'image principale optimisée (WebP si possible)
-            output = BytesIO()
-            format_map = {
-                "JPEG": "JPEG",
-                "PNG": "PNG",
-                "WEBP": "WEBP",
-            }
-            img_format = format_map.get(original_format or img.format, "JPEG")
-
+            # Un seul tampon mémoire pour tous les encodages (image, miniature, variantes)
+            buffer = BytesIO()
             try:
-                # Convertir en RGB pour WebP/JPEG
-                if img.mode == "RGBA":
-                    rgb_img = Image.new("RGB", img.size, (255, 255, 255))
-                    rgb_img.paste(img, mask=img.split()[3])
-                    img_rgb = rgb_img
-                else:
-                    img_rgb = img
-
-                img_rgb.save(
-                    output,
-                    format="WEBP",
-                    quality=60,
-                    method=6,
-                    optimize=True,
-                )
-                img_format = "WEBP"
+                image_content = encode(img, buffer, format="WEBP", quality=60, method=6)
                 logger.info("Image sauvegardée en WebP (compressée)")
             except Exception as e:
-                logger.warning(f"WebP non disponible, utilisation du format {img_format}: {str(e)}")
-                if img_format == "PNG":
-                    if img.mode != "RGBA":
-                        img = img.convert("RGBA")
-                    img.save(output, format="PNG", optimize=True, compress_level=9)
+                if original_format == "PNG":
+                    fallback = {"format": "PNG", "optimize": True, "compress_level": 9}
                 else:
-                    if img.mode == "RGBA":
-                        rgb_img = Image.new("RGB", img.size, (255, 255, 255))
-                        rgb_img.paste(img, mask=img.split()[3])
-                        img = rgb_img
-                    img.save(output, format="JPEG", quality=60, optimize=True, progressive=True)
-
-            output.seek(0)
-            image_content = output.read()
+                    fallback = {"format": "JPEG", "quality": 60, "optimize": True, "progressive": True}
+                logger.warning(f"WebP non disponible, utilisation du format {fallback['format']}: {str(e)}")
+                image_content = encode(img, buffer, **fallback)
 
             # Toujours enregistrer l'image optimisée dans le storage (dossier local ou S3/Supabase)
             # pour que le lien en base pointe vers le fichier allégé et qu'il ne se perde pas au déploiement.
@@ -400,29 +397,24 @@ class AdMedia(models.Model):
                 self.image.save(optimized_name, main_file, save=False)
                 logger.info("Image optimisée enregistrée dans le storage: %s", optimized_name)
 
-            output.close()
-
-            # Générer la miniature (toujours depuis l'image en mémoire — pas de .path avec S3/Supabase)
-            thumb_img = (img.convert("RGB") if img.mode != "RGB" else img.copy())
-
-            THUMBNAIL_SIZE = (320, 320)
-            thumb_img.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
-
-            thumb_output = BytesIO()
-            thumb_img.save(
-                thumb_output,
-                format="WEBP",
-                quality=50,
-                method=6,
-                optimize=True,
-            )
-            thumb_output.seek(0)
-
+            # Miniature : réduite directement depuis l'image en mémoire (pas de .path avec S3/Supabase)
+            thumb_img = thumbnail_of(img)
+            self._thumbnail_size = thumb_img.size
             thumb_name = os.path.splitext(self.image.name)[0] + "_thumb.webp"
-            thumb_file = ContentFile(thumb_output.read())
+            thumb_file = ContentFile(encode(thumb_img, buffer, format="WEBP", quality=50, method=6))
             thumb_file.content_type = "image/webp"
             self.thumbnail.save(thumb_name, thumb_file, save=False)
-            thumb_output.close()
+
+            # Variantes responsive (srcset) : les anciennes sont supprimées une fois les
+            # nouvelles enregistrées ; un échec n'empêche pas le filigrane
+            old_variants = self.variants
+            try:
+                self.variants = build_variants(img, base_name, self.image.storage, buffer)
+            except Exception as e:
+                logger.warning("Variantes responsive non générées pour %s : %s", self.image.name, e)
+                self.variants = []
+            if old_variants:
+                delete_variants(old_variants, self.image.storage)
 
             self._watermark_applied = True
             self.has_watermark = True
@@ -463,6 +455,11 @@ class AdMedia(models.Model):
                 # Nouvelle instance, l'image sera traitée
                 image_changed = bool(self.image)
 
+            # Une seule photo principale — avant l'enregistrement, pour que le signal
+            # post_save (sync_primary_thumbnail) voie l'état final
+            if self.is_primary:
+                AdMedia.objects.filter(ad_id=self.ad_id, is_primary=True).exclude(pk=self.pk).update(is_primary=False)
+
             # Sauvegarder d'abord pour obtenir le chemin du fichier (upload brut = réponse rapide)
             super().save(*args, **kwargs)
 
@@ -476,10 +473,6 @@ class AdMedia(models.Model):
                     # L'image est en mémoire si c'est un nouvel upload (file.seek(0) dans la méthode).
                     transaction.on_commit(lambda pk=self.pk: _apply_watermark_sync(pk))
 
-            # Ensure only one primary
-            if self.is_primary:
-                AdMedia.objects.filter(ad=self.ad).exclude(pk=self.pk).update(is_primary=False)
-
     def __str__(self) -> str:  # pragma: no cover
         return f"Media({self.ad_id})"
 
@@ -513,6 +506,134 @@ class Favorite(models.Model):
         return f"Favorite({self.user_id}, {self.ad_id})"
 
 
+class AdFeedEntry(models.Model):
+    """
+    Ligne précalculée du fil public : une par annonce visible (approuvée ou expirée,
+    images traitées). Maintenue par ads.feed.sync_feed ; la liste publique devient
+    une simple plage d'index sur `rank`, sans jointure City / user / profile ni media.
+    """
+
+    ad = models.OneToOneField(Ad, on_delete=models.CASCADE, primary_key=True, related_name="feed_entry")
+    # Clé de tri totale (statut, urgent, remontée, création, id) encodée en chaîne comparable :
+    # l'ordre décroissant de `rank` est exactement l'ordre historique de la liste.
+    rank = models.CharField(max_length=64)
+    city = models.ForeignKey(City, on_delete=models.CASCADE, related_name="+")
+    category = models.CharField(max_length=20, choices=Ad.Category.choices)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+"
+    )
+    is_approved = models.BooleanField(default=True)
+    is_urgent = models.BooleanField(default=False)
+    is_premium = models.BooleanField(default=False)
+    is_boosted = models.BooleanField(default=False)
+    # Données déjà prêtes pour le rendu d'une carte (titre, ville, miniature, badges...)
+    card = models.JSONField(default=dict)
+    # Prochain instant où la ligne changera sans intervention (fin premium / urgent,
+    # expiration, remontée due...) : borne la durée de vie des pages de liste en cache.
+    next_change_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-rank"], name="adfeed_rank_idx"),
+            models.Index(fields=["city", "-rank"], name="adfeed_city_rank_idx"),
+            models.Index(fields=["category", "-rank"], name="adfeed_cat_rank_idx"),
+            models.Index(fields=["city", "category", "-rank"], name="adfeed_city_cat_rank_idx"),
+        ]
+
+    def __str__(self) -> str:  # pragma: no cover
+        return f"AdFeedEntry({self.ad_id})"
+
+
+class AdFacetCount(models.Model):
+    """
+    Compteur d'annonces par (ville, catégorie, statut, images traitées), maintenu
+    par signaux à chaque changement d'une annonce (ads/signals.py) et réconcilié
+    périodiquement. Les facettes de la liste et du footer se lisent ici sans
+    COUNT / GROUP BY sur la table Ad.
+    """
+
+    city = models.ForeignKey(City, on_delete=models.CASCADE, related_name="+")
+    category = models.CharField(max_length=20, choices=Ad.Category.choices)
+    status = models.CharField(max_length=20, choices=Ad.Status.choices)
+    images_done = models.BooleanField(default=True)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["city", "category", "status", "images_done"], name="adfacetcount_unique"
+            ),
+        ]
+
+    def __str__(self) -> str:  # pragma: no cover
+        return f"{self.city_id}/{self.category}/{self.status}: {self.count}"
+
+
+class AdContactDaily(models.Model):
+    """
+    Clics sur les boutons de contact d'une annonce, par canal et par jour.
+    Alimenté en différé par ads.contacts (flush en masse) : un clic ne verrouille
+    pas la ligne Ad, contrairement au JSON Ad.contacts_clicks.
+    """
+
+    class Channel(models.TextChoices):
+        SMS = "sms", "SMS"
+        WHATSAPP = "whatsapp", "WhatsApp"
+        CALL = "call", "Appel"
+
+    ad = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name="contact_stats")
+    day = models.DateField()
+    channel = models.CharField(max_length=10, choices=Channel.choices)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["ad", "day", "channel"], name="adcontactdaily_unique"),
+        ]
+
+    def __str__(self) -> str:  # pragma: no cover
+        return f"{self.ad_id}/{self.day}/{self.channel}: {self.count}"
+
+
+class AdEvent(models.Model):
+    """
+    Événement brut (vue, mise en favori) d'une annonce : table en ajout seul,
+    écrite par lots (ads.analytics) et agrégée chaque heure dans AdDailyStats.
+    Purgée au-delà de quelques jours ; aucune page ne la lit.
+    """
+
+    class Kind(models.TextChoices):
+        VIEW = "view", "Vue"
+        FAVORITE = "favorite", "Favori"
+
+    id = models.BigAutoField(primary_key=True)
+    ad = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name="+")
+    kind = models.CharField(max_length=10, choices=Kind.choices)
+    created_at = models.DateTimeField(db_index=True)
+
+    def __str__(self) -> str:  # pragma: no cover
+        return f"{self.ad_id}/{self.kind} {self.created_at:%Y-%m-%d %H:%M}"
+
+
+class AdDailyStats(models.Model):
+    """Statistiques d'une annonce pour un jour (agrégats de AdEvent et AdContactDaily)."""
+
+    ad = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name="daily_stats")
+    day = models.DateField()
+    views = models.PositiveIntegerField(default=0)
+    contacts = models.PositiveIntegerField(default=0)
+    favorites = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["ad", "day"], name="addailystats_unique"),
+        ]
+
+    def __str__(self) -> str:  # pragma: no cover
+        return f"{self.ad_id}/{self.day}: {self.views} vues"
+
+
 class AdFeature(models.Model):
     ad = models.ForeignKey(Ad, on_delete=models.CASCADE)
     feature = models.ForeignKey(Feature, on_delete=models.CASCADE)
@@ -0,0 +1,243 @@
+"""
+Pagination par curseur (keyset) pour les listes d'annonces.
+
+Le Paginator Django exécute un COUNT(*) puis un OFFSET : le coût d'une page
+profonde croît avec son numéro. Ici chaque page est une simple plage d'index
+« après la dernière ligne vue » : la page 300 coûte autant que la page 1, et
+aucun COUNT n'est nécessaire.
+
+Les curseurs sont opaques (signés) et portent les valeurs des clés de tri de la
+ligne de bord ainsi que la direction (page suivante / précédente).
+"""
+from datetime import datetime
+
+from django.core import signing
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+CURSOR_SALT = "ads.pagination.cursor"
+
+# Ordre de la liste publique : approuvées puis expirées, urgentes, remontées récentes,
+# récentes, puis id pour départager les ex æquo (clé totale obligatoire en keyset).
+AD_LIST_KEYS = (
+    ("_status_order", False),
+    ("is_urgent", True),
+    ("bumped_at", True),
+    ("created_at", True),
+    ("id", True),
+)
+
+
+class InvalidCursor(Exception):
+    """Curseur illisible, falsifié ou incompatible avec les clés de tri."""
+
+
+def _dump_value(value):
+    if isinstance(value, datetime):
+        return ["dt", value.isoformat()]
+    return value
+
+
+def _load_value(value):
+    if isinstance(value, list) and len(value) == 2 and value[0] == "dt":
+        parsed = parse_datetime(value[1])
+        if parsed is None:
+            raise InvalidCursor("date invalide")
+        return parsed
+    return value
+
+
+def encode_cursor(values, direction: str) -> str:
+    return signing.dumps(
+        {"v": [_dump_value(v) for v in values], "d": direction},
+        salt=CURSOR_SALT,
+        compress=True,
+    )
+
+
+def decode_cursor(token: str, key_count: int):
+    """Retourne (valeurs, direction) ; lève InvalidCursor si le jeton est inutilisable."""
+    try:
+        data = signing.loads(token, salt=CURSOR_SALT)
+    except signing.BadSignature as exc:
+        raise InvalidCursor(str(exc)) from exc
+    values = data.get("v") if isinstance(data, dict) else None
+    direction = data.get("d") if isinstance(data, dict) else None
+    if not isinstance(values, list) or len(values) != key_count or direction not in ("n", "p"):
+        raise InvalidCursor("structure inattendue")
+    return [_load_value(v) for v in values], direction
+
+
+def is_valid_cursor(token: str, keys=AD_LIST_KEYS) -> bool:
+    """Curseur signé par ce site et compatible avec `keys` (vérifié sans requête)."""
+    try:
+        decode_cursor(token, len(keys))
+    except InvalidCursor:
+        return False
+    return True
+
+
+class KeysetPage:
+    """
+    Page de résultats exposant la même interface que django.core.paginator.Page
+    pour ce qu'utilisent les templates (itération, has_next, has_previous...).
+    """
+
+    cursor_mode = True
+
+    def __init__(
+        self, object_list, has_next, has_previous, next_cursor, previous_cursor, boundary=None
+    ):
+        self.object_list = object_list
+        # Ligne lue au-delà de la page (détection de has_next / has_previous), ou None
+        self.boundary = boundary
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+
+class KeysetPaginator:
+    """
+    keys : séquence de (nom de champ ou d'annotation, descendant: bool).
+    La dernière clé doit être unique (ex. "id") pour garantir un ordre total.
+    """
+
+    def __init__(self, queryset, per_page: int, keys=AD_LIST_KEYS):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.keys = tuple(keys)
+
+    def _ordering(self, reverse: bool):
+        ordering = []
+        for name, desc in self.keys:
+            desc = desc != reverse
+            ordering.append(f"-{name}" if desc else name)
+        return ordering
+
+    def _after(self, values, reverse: bool) -> Q:
+        """Lignes strictement au-delà de `values` dans le sens de parcours."""
+        condition = Q()
+        equal = Q()
+        for (name, desc), value in zip(self.keys, values):
+            desc = desc != reverse
+            lookup = "lt" if desc else "gt"
+            condition |= equal & Q(**{f"{name}__{lookup}": value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def _key_values(self, obj):
+        return [getattr(obj, name) for name, _ in self.keys]
+
+    def _fetch(self, values, reverse: bool):
+        """Jusqu'à per_page + 1 lignes au-delà de `values` (toutes si None), dans le sens de parcours."""
+        qs = self.queryset
+        if values is not None:
+            qs = qs.filter(self._after(values, reverse))
+        return list(qs.order_by(*self._ordering(reverse))[: self.per_page + 1])
+
+    def boundary_exists(self, cursor: str) -> bool:
+        """Le curseur est valide et sa ligne de bord existe encore dans `queryset`."""
+        try:
+            values, _ = decode_cursor(cursor, len(self.keys))
+        except InvalidCursor:
+            return False
+        lookup = {name: value for (name, _), value in zip(self.keys, values)}
+        return self.queryset.filter(**lookup).exists()
+
+    def get_page(self, cursor: str = "") -> KeysetPage:
+        """Retourne la page désignée par `cursor` (première page si vide ou invalide)."""
+        values, direction = None, "n"
+        if cursor:
+            try:
+                values, direction = decode_cursor(cursor, len(self.keys))
+            except InvalidCursor:
+                values, direction = None, "n"
+
+        reverse = direction == "p"
+        rows = self._fetch(values, reverse)
+
+        has_more = len(rows) > self.per_page
+        boundary = rows[self.per_page] if has_more else None
+        rows = rows[: self.per_page]
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = values is not None, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        next_cursor = encode_cursor(self._key_values(rows[-1]), "n") if rows and has_next else ""
+        previous_cursor = (
+            encode_cursor(self._key_values(rows[0]), "p") if rows and has_previous else ""
+        )
+        return KeysetPage(rows, has_next, has_previous, next_cursor, previous_cursor, boundary)
+
+
+class SequenceKeysetPaginator(KeysetPaginator):
+    """
+    Même pagination (mêmes curseurs) sur une séquence déjà triée selon `keys`,
+    par exemple une liste de résultats de recherche lue en cache.
+    """
+
+    def _is_after(self, row_values, values, reverse: bool) -> bool:
+        for (_, desc), value, bound in zip(self.keys, row_values, values):
+            if value == bound:
+                continue
+            desc = desc != reverse
+            return value < bound if desc else value > bound
+        return False
+
+    def _fetch(self, values, reverse: bool):
+        rows = reversed(self.queryset) if reverse else iter(self.queryset)
+        result = []
+        for row in rows:
+            if values is None or self._is_after(self._key_values(row), values, reverse):
+                result.append(row)
+                if len(result) > self.per_page:
+                    break
+        return result
+
+
+class WindowKeysetPaginator(SequenceKeysetPaginator):
+    """
+    Pagination sur les premières lignes de `queryset` déjà lues (`window`, triée
+    selon `keys`, par exemple en cache) ; si la fenêtre est tronquée (`complete`
+    faux), les pages qui la dépassent sont lues dans `queryset`, avec les mêmes
+    curseurs : aucun résultat n'est perdu au-delà de la fenêtre.
+    """
+
+    def __init__(self, window, queryset, per_page: int, keys=AD_LIST_KEYS, complete=True):
+        super().__init__(window, per_page, keys)
+        self.full_queryset = queryset
+        self.complete = complete
+
+    def _fetch(self, values, reverse: bool):
+        rows = super()._fetch(values, reverse)
+        if self.complete or not self.queryset:
+            return rows
+        if reverse:
+            # Lignes avant le curseur : toutes dans la fenêtre si le curseur y est
+            last = self._key_values(self.queryset[-1])
+            if values is not None and not self._is_after(values, last, False):
+                return rows
+        elif len(rows) > self.per_page:
+            return rows
+        return KeysetPaginator(self.full_queryset, self.per_page, self.keys)._fetch(values, reverse)
@@ -0,0 +1,240 @@
+"""
+Recherche plein texte des annonces (paramètre q= de la liste).
+
+  - PostgreSQL : colonne ads_ad.search_vector (tsvector, configuration « french »,
+    accents retirés par unaccent), tenue à jour par trigger et indexée en GIN.
+    Requête to_tsquery, chaque mot en préfixe (`mot:*`, comme sous SQLite),
+    pertinence ts_rank.
+  - SQLite (tests, dev local) : table virtuelle FTS5 ads_ad_fts (unicode61,
+    remove_diacritics) alimentée par triggers. Chaque mot est cherché en préfixe
+    (approximation du stemming), pertinence bm25.
+  - Autre moteur, ou index absent : repli sur icontains (sans pertinence).
+
+La colonne et la table virtuelle n'existent qu'en SQL (migrations 0022 et 0028) : le modèle
+Ad ne les connaît pas. La pertinence est exposée par l'annotation _search_rank
+(plus grand = plus pertinent), utilisée dans SEARCH_KEYS.
+"""
+import hashlib
+import logging
+import re
+import unicodedata
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+from .models import Ad
+
+logger = logging.getLogger(__name__)
+
+# Ordre des résultats : approuvées puis expirées, urgentes, pertinence, puis ordre de la liste
+SEARCH_KEYS = (
+    ("_status_order", False),
+    ("is_urgent", True),
+    ("_search_rank", True),
+    ("bumped_at", True),
+    ("created_at", True),
+    ("id", True),
+)
+
+MAX_TERMS = 8
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Cache des résultats : liste ordonnée des clés de tri par (requête normalisée, filtres)
+SEARCH_CACHE_TTL = 600  # invalidé avant par la version de la liste
+MAX_SEARCH_RESULTS = 1000  # résultats gardés en cache ; les suivants sont lus en base
+_HIT_FIELDS = tuple(name for name, _ in SEARCH_KEYS)
+
+# ─── Triggers SQLite (recréés au post_migrate) ───────────────────────────────
+
+_SQLITE_TABLE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS ads_ad_fts USING fts5("
+    "title, subcategories, description, tokenize='unicode61 remove_diacritics 2')"
+)
+
+# Les sous-catégories sont stockées en JSON (accents échappés en \uXXXX) : json_each
+# les redonne en texte. Les triggers sont liés à ads_ad : SQLite les supprime quand une migration reconstruit
+# la table (AlterField...). ensure_search_index() les recrée après chaque migrate.
+_SQLITE_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS ads_ad_fts_ai AFTER INSERT ON ads_ad BEGIN
+      INSERT INTO ads_ad_fts(rowid, title, subcategories, description)
+      VALUES (new.id, new.title, (SELECT group_concat(value, ' ') FROM json_each(new.subcategories)),
+              new.description_sanitized);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS ads_ad_fts_ad AFTER DELETE ON ads_ad BEGIN
+      DELETE FROM ads_ad_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS ads_ad_fts_au
+    AFTER UPDATE OF title, description_sanitized, subcategories ON ads_ad BEGIN
+      DELETE FROM ads_ad_fts WHERE rowid = old.id;
+      INSERT INTO ads_ad_fts(rowid, title, subcategories, description)
+      VALUES (new.id, new.title, (SELECT group_concat(value, ' ') FROM json_each(new.subcategories)),
+              new.description_sanitized);
+    END
+    """,
+]
+
+
+def ensure_search_index(sender, using="default", **kwargs) -> None:
+    """post_migrate : recrée les triggers SQLite supprimés par une reconstruction de ads_ad."""
+    from django.db import connections
+
+    conn = connections[using]
+    if conn.vendor == "sqlite" and "ads_ad_fts" in conn.introspection.table_names():
+        with conn.cursor() as cursor:
+            for sql in [_SQLITE_TABLE] + _SQLITE_TRIGGERS:
+                cursor.execute(sql)
+
+
+# ─── Requête ─────────────────────────────────────────────────────────────────
+
+def search_terms(q: str):
+    """Mots de la requête (minuscules), bornés à MAX_TERMS."""
+    return _WORD_RE.findall(q.lower())[:MAX_TERMS]
+
+
+def fold_text(text: str) -> str:
+    """Minuscules, sans accents ni ponctuation, mots séparés par une espace."""
+    folded = "".join(
+        c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c)
+    )
+    return " ".join(_WORD_RE.findall(folded.lower()))
+
+
+def normalize_query(q: str) -> str:
+    """
+    Forme canonique d'une requête (fold_text, bornée à MAX_TERMS mots).
+    « Massage  Érotique! » et « massage erotique » partagent résultats et cache.
+    """
+    return " ".join(fold_text(q).split()[:MAX_TERMS])
+
+
+_backends = {}
+
+
+def _backend() -> str:
+    """Moteur plein texte disponible sur la connexion courante (détecté une fois par base)."""
+    key = (connection.vendor, connection.settings_dict.get("NAME"))
+    if key not in _backends:
+        if connection.vendor == "postgresql":
+            _backends[key] = "postgresql"
+        elif connection.vendor == "sqlite" and "ads_ad_fts" in connection.introspection.table_names():
+            _backends[key] = "sqlite"
+        else:
+            _backends[key] = ""
+    return _backends[key]
+
+
+def _icontains(qs, q: str):
+    q_search = Q(title__icontains=q) | Q(description_sanitized__icontains=q)
+    for sub in Ad.SUBCATEGORY_CHOICES:
+        if q.lower() in sub.lower():
+            q_search |= Q(subcategories__icontains=sub)
+    return qs.filter(q_search).annotate(_search_rank=Value(0.0, output_field=FloatField()))
+
+
+def apply_search(qs, q: str):
+    """Filtre `qs` (Ad) sur la requête `q` et annote _search_rank (pertinence)."""
+    backend = _backend()
+    if backend == "postgresql":
+        # Mots en préfixe (massa → massage), sans « _ » que to_tsquery découperait ;
+        # seuls des caractères de mot : aucun opérateur tsquery injectable
+        words = [w for term in search_terms(q) for w in term.split("_") if w]
+        if not words:
+            return qs.none().annotate(_search_rank=Value(0.0, output_field=FloatField()))
+        prefix = " & ".join(f"{word}:*" for word in words)
+        tsquery = "to_tsquery('french', kiaba_unaccent(%s))"
+        return qs.filter(
+            RawSQL(f'"ads_ad"."search_vector" @@ {tsquery}', [prefix], output_field=BooleanField())
+        ).annotate(
+            # Arrondi en float8 : valeur identique une fois relue (clé du curseur keyset)
+            _search_rank=RawSQL(
+                f'round(ts_rank("ads_ad"."search_vector", {tsquery})::numeric, 6)::float8',
+                [prefix],
+                output_field=FloatField(),
+            )
+        )
+    if backend == "sqlite":
+        terms = search_terms(q)
+        if not terms:
+            return qs.none().annotate(_search_rank=Value(0.0, output_field=FloatField()))
+        # Chaque mot entre guillemets (aucun opérateur FTS5 injectable) et en préfixe
+        match = " ".join('"%s"*' % term.replace('"', "") for term in terms)
+        return qs.filter(
+            RawSQL(
+                '"ads_ad"."id" IN (SELECT rowid FROM ads_ad_fts WHERE ads_ad_fts MATCH %s)',
+                [match],
+                output_field=BooleanField(),
+            )
+        ).annotate(
+            # bm25 : plus petit = plus pertinent ; poids titre > sous-catégories > description
+            _search_rank=RawSQL(
+                "(SELECT -bm25(ads_ad_fts, 10.0, 5.0, 1.0) FROM ads_ad_fts "
+                'WHERE ads_ad_fts MATCH %s AND rowid = "ads_ad"."id")',
+                [match],
+                output_field=FloatField(),
+            )
+        )
+    return _icontains(qs, q)
+
+
+class SearchHit:
+    """Résultat en cache : id de l'annonce et valeurs de ses clés de tri (SEARCH_KEYS)."""
+
+    __slots__ = _HIT_FIELDS
+
+    def __init__(self, row):
+        for name, value in zip(_HIT_FIELDS, row):
+            setattr(self, name, value)
+
+
+def search_cache_key(version, q: str, city: str, category: str, provider: str, boost: str) -> str:
+    digest = hashlib.sha1(q.encode("utf-8")).hexdigest()[:20]
+    return f"ad_search:v{version}:{digest}:{city}:{category}:{provider}:{boost}"
+
+
+class SearchResults:
+    """
+    Tous les résultats ordonnés d'une recherche : les MAX_SEARCH_RESULTS premiers
+    (SearchHit) lus en cache, les suivants en base à la demande. Utilisable par
+    le Paginator (count / tranches) ; WindowKeysetPaginator(hits, queryset, ...,
+    complete=complete) pour la pagination par curseur.
+    """
+
+    def __init__(self, hits, queryset):
+        self.hits = hits
+        self.complete = len(hits) < MAX_SEARCH_RESULTS
+        # Au-delà de la fenêtre : seules les clés de tri sont lues
+        self.queryset = queryset.only(*(name for name in _HIT_FIELDS if not name.startswith("_")))
+
+    def count(self) -> int:
+        return len(self.hits) if self.complete else self.queryset.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        if self.complete or (index.stop is not None and index.stop <= len(self.hits)):
+            return self.hits[index]
+        return [SearchHit(row) for row in self.queryset.values_list(*_HIT_FIELDS)[index]]
+
+
+def cached_search_hits(queryset, cache_key: str) -> SearchResults:
+    """
+    Résultats ordonnés de `queryset` (annoté par apply_search) : les premiers, sous
+    forme de SearchHit, lus en cache si possible (seules les clés de tri sont
+    stockées, pas le rendu) ; les suivants restent accessibles en base.
+    """
+    rows = cache.get(cache_key)
+    if rows is None:
+        rows = list(queryset.values_list(*_HIT_FIELDS)[:MAX_SEARCH_RESULTS])
+        cache.set(cache_key, rows, SEARCH_CACHE_TTL)
+    return SearchResults([SearchHit(row) for row in rows], queryset)
@@ -0,0 +1,115 @@
+from django.conf import settings
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Ad, AdFeedEntry, AdMedia, City, sync_primary_thumbnail
+
+_UNCHANGED = object()
+
+
+@receiver(pre_save, sender=Ad)
+def remember_ad_facet(sender, instance: Ad, update_fields=None, raw=False, **kwargs):
+    """Mémorise la ligne de compteur (AdFacetCount) de l'annonce avant l'enregistrement."""
+    from .facets import FACET_FIELDS
+
+    if raw or (update_fields is not None and not (set(update_fields) & FACET_FIELDS)):
+        instance._old_facet = _UNCHANGED
+        return
+    if instance._state.adding:
+        instance._old_facet = None
+        return
+    instance._old_facet = (
+        Ad.objects.filter(pk=instance.pk)
+        .values_list("city_id", "category", "status", "image_processing_done")
+        .first()
+    )
+
+
+@receiver(post_save, sender=Ad)
+def on_ad_saved(sender, instance: Ad, update_fields=None, raw=False, **kwargs):
+    """Tient à jour le fil public (AdFeedEntry), les compteurs et l'index des suggestions."""
+    if raw:
+        return
+    from .facets import facet_key, move_facet
+    from .feed import FEED_FIELDS, sync_feed
+    from .suggestions import index_ad
+
+    old_facet = getattr(instance, "_old_facet", _UNCHANGED)
+    if old_facet is not _UNCHANGED:
+        if old_facet is not None:
+            old_facet = old_facet[:3] + (bool(old_facet[3]),)
+        move_facet(old_facet, facet_key(instance))
+
+    if update_fields is None or {"status", "title", "image_processing_done"} & set(update_fields):
+        index_ad(instance)
+
+    if update_fields is not None and not (set(update_fields) & FEED_FIELDS):
+        return
+    sync_feed([instance.pk])
+
+
+@receiver(post_save, sender=AdMedia)
+def on_ad_media_saved(sender, instance: AdMedia, raw=False, **kwargs):
+    """La miniature de la carte dépend des photos de l'annonce."""
+    if raw:
+        return
+    from .feed import sync_feed
+
+    sync_primary_thumbnail(instance.ad_id, processed=instance)
+    sync_feed([instance.ad_id])
+
+
+@receiver(post_delete, sender=AdMedia)
+def on_ad_media_deleted(sender, instance: AdMedia, origin=None, **kwargs):
+    # Suppression en cascade de l'annonce : la ligne du fil part avec elle.
+    if isinstance(origin, Ad) or (isinstance(origin, QuerySet) and origin.model is Ad):
+        return
+    from .feed import sync_feed
+
+    sync_primary_thumbnail(instance.ad_id)
+    sync_feed([instance.ad_id])
+
+
+@receiver(post_delete, sender=Ad)
+def on_ad_deleted(sender, instance: Ad, origin=None, **kwargs):
+    # Suppression d'une ville : ses compteurs partent en cascade avec elle.
+    if isinstance(origin, City) or (isinstance(origin, QuerySet) and origin.model is City):
+        return
+    from .facets import facet_key, move_facet
+    from .suggestions import unindex_ad
+
+    move_facet(facet_key(instance), None)
+    unindex_ad(instance.pk)
+
+
+@receiver(post_delete, sender=AdFeedEntry)
+def on_feed_entry_deleted(sender, instance: AdFeedEntry, origin=None, **kwargs):
+    """Ligne du fil supprimée en cascade (annonce, ville...) : invalider ses pages."""
+    # Lignes retirées par sync_feed / rebuild_feed : déjà invalidées par eux
+    if isinstance(origin, QuerySet) and origin.model is AdFeedEntry:
+        return
+    from .feed import _invalidate
+
+    _invalidate([instance])
+
+
+@receiver(post_save, sender=City)
+def on_city_saved(sender, instance: City, created=False, update_fields=None, raw=False, **kwargs):
+    """Nom et slug de la ville sont copiés dans les cartes du fil : les resynchroniser."""
+    if raw or created or (update_fields is not None and not {"name", "slug"} & set(update_fields)):
+        return
+    from .feed import sync_feed_batched
+
+    sync_feed_batched(Ad.objects.filter(city=instance).values_list("pk", flat=True))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def on_user_saved(sender, instance, created=False, update_fields=None, raw=False, **kwargs):
+    """Badge vérifié de l'auteur copié dans les cartes du fil : les resynchroniser."""
+    if raw or created or (update_fields is not None and "is_verified" not in update_fields):
+        return
+    from .feed import sync_feed_batched
+
+    # sync_feed ne réécrit que les cartes réellement changées
+    sync_feed_batched(Ad.objects.filter(user=instance).values_list("pk", flat=True))
@@ -0,0 +1,55 @@
+"""
+Annonces similaires de la page détail.
+
+Pour chaque couple (catégorie, ville), les SIMILAR_POOL annonces visibles les plus
+récentes — même ville d'abord, complétées par le reste de la catégorie — sont
+gardées en cache sous forme de liste d'ids. La clé porte la version des listes de
+la catégorie (get_list_version, incrémentée par sync_feed quand une ligne du fil de
+la catégorie change : approbation, expiration, remontée...) : les listes sont
+recalculées après tout changement du fil dans la catégorie.
+La page détail lit ces ids puis charge les cartes par clé primaire.
+"""
+from django.core.cache import cache
+
+from core.context_processors import get_list_version
+
+from .feed import VISIBLE_STATUSES
+from .models import Ad
+
+SIMILAR_COUNT = 5
+SIMILAR_POOL = SIMILAR_COUNT + 1  # l'annonce affichée peut faire partie de la liste
+SIMILAR_TTL = 3600
+
+
+def similar_cache_key(version, category: str, city_id: int) -> str:
+    return f"similar_ads:v{version}:{category}:{city_id}"
+
+
+def compute_similar_ids(category: str, city_id: int):
+    """Ids des annonces similaires (2 requêtes bornées sur l'index catégorie + date)."""
+    visible = Ad.objects.filter(
+        status__in=VISIBLE_STATUSES, image_processing_done=True, category=category
+    ).order_by("-created_at")
+    ids = list(visible.filter(city_id=city_id).values_list("id", flat=True)[:SIMILAR_POOL])
+    if len(ids) < SIMILAR_POOL:
+        others = visible.exclude(city_id=city_id).values_list("id", flat=True)
+        ids += list(others[:SIMILAR_POOL - len(ids)])
+    return ids
+
+
+def similar_ad_ids(ad: Ad):
+    key = similar_cache_key(get_list_version(category=ad.category), ad.category, ad.city_id)
+    ids = cache.get(key)
+    if ids is None:
+        ids = compute_similar_ids(ad.category, ad.city_id)
+        cache.set(key, ids, SIMILAR_TTL)
+    return [pk for pk in ids if pk != ad.pk][:SIMILAR_COUNT]
+
+
+def similar_ads(ad: Ad):
+    """Cartes (Ad.objects.cards()) des annonces similaires à `ad`, dans l'ordre de la liste."""
+    ids = similar_ad_ids(ad)
+    if not ids:
+        return []
+    ads = Ad.objects.filter(pk__in=ids).cards().order_by().in_bulk()
+    return [ads[pk] for pk in ids if pk in ads]
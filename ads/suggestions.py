@@ -0,0 +1,200 @@
+"""
+Index des suggestions de recherche (search_suggestions).
+
+Les titres des annonces visibles dans la liste publique (même prédicat que le
+fil : feed._is_visible) sont partagés entre workers via le cache, en deux parties :
+
+  - un instantané SUGGEST_TITLES_KEY : {"seq": n, "titles": {id: titre}}, écrit
+    seulement par une reconstruction depuis la base (tâche rebuild_ad_feed, ou
+    première lecture à froid, un seul worker à la fois) ;
+  - un journal de deltas : chaque approbation, expiration, changement de titre ou
+    suppression incrémente SUGGEST_SEQ_KEY et écrit (id, titre ou None) sous
+    suggest_index:delta:<seq>. Une sauvegarde coûte deux écritures, quel que soit
+    le nombre d'annonces.
+
+Chaque processus garde une copie locale {id: titre} et un tableau trié des suffixes
+de mots normalisés (fold_text) de chaque titre distinct : une suggestion est un
+bisect + un parcours de préfixe, sans requête SQL. À la lecture, les deltas
+manquants sont appliqués en place (insertion / retrait des suffixes du titre
+concerné) : le tableau n'est reconstruit entièrement qu'au chargement d'un
+instantané. Un delta introuvable deux fois de suite (évincé), un journal recréé
+ou un retard de plus de MAX_PENDING_DELTAS font repartir de l'instantané, voire
+de la base.
+"""
+import bisect
+import time
+
+from django.core.cache import cache
+
+from core.cache_utils import acquire_lock, release_lock
+
+from .feed import VISIBLE_STATUSES, _is_visible
+from .models import Ad
+from .search import fold_text
+
+SUGGEST_TITLES_KEY = "suggest_index:titles"
+SUGGEST_SEQ_KEY = "suggest_index:seq"
+MAX_PENDING_DELTAS = 500  # au-delà, repartir de l'instantané
+DELTA_TTL = 24 * 3600  # > intervalle de reconstruction de l'instantané (rebuild_ad_feed, horaire)
+MAX_TITLE_SUGGESTIONS = 8
+MAX_SUGGESTIONS = 15
+
+# Copie locale au processus : position dans le journal, titres par annonce, nombre
+# d'annonces par titre, (suffixe, titre) triés, delta manquant à la lecture précédente
+_local = {"seq": None, "titles": None, "counts": {}, "index": [], "gap": None}
+
+
+def _delta_key(seq: int) -> str:
+    return f"suggest_index:delta:{seq}"
+
+
+def _titles_from_db() -> dict:
+    return dict(
+        Ad.objects.filter(status__in=VISIBLE_STATUSES, image_processing_done=True)
+        .values_list("id", "title")
+    )
+
+
+def _suffixes(title: str):
+    words = fold_text(title).split()
+    return [(" ".join(words[i:]), title) for i in range(len(words))]
+
+
+def _build_local(seq: int, titles: dict) -> None:
+    """(Re)construit le tableau trié : une entrée par suffixe de mots de chaque titre distinct."""
+    counts = {}
+    for title in titles.values():
+        if title:
+            counts[title] = counts.get(title, 0) + 1
+    index = sorted(entry for title in counts for entry in _suffixes(title))
+    _local.update(seq=seq, titles=dict(titles), counts=counts, index=index, gap=None)
+
+
+def _set_title(ad_id: int, title) -> None:
+    """Applique un delta au tableau local : seuls les suffixes du titre concerné bougent."""
+    index, counts = _local["index"], _local["counts"]
+    old = _local["titles"].pop(ad_id, None)
+    if old:
+        counts[old] -= 1
+        if not counts[old]:
+            del counts[old]
+            for entry in _suffixes(old):
+                i = bisect.bisect_left(index, entry)
+                if i < len(index) and index[i] == entry:
+                    del index[i]
+    if title:
+        _local["titles"][ad_id] = title
+        counts[title] = counts.get(title, 0) + 1
+        if counts[title] == 1:
+            for entry in _suffixes(title):
+                bisect.insort(index, entry)
+
+
+def _current_seq() -> int:
+    """
+    Position du journal, créée au besoin. Valeur initiale horodatée en ns : un
+    journal recréé (cache vidé, clé évincée) saute loin devant toute position
+    connue, les processus repartent de l'instantané.
+    """
+    seq = cache.get(SUGGEST_SEQ_KEY)
+    if seq is None:
+        cache.add(SUGGEST_SEQ_KEY, time.time_ns(), None)
+        seq = cache.get(SUGGEST_SEQ_KEY)
+    return seq
+
+
+def _snapshot_from_db() -> dict:
+    # Position lue avant la requête : les deltas écrits pendant celle-ci seront réappliqués
+    snapshot = {"seq": _current_seq(), "titles": _titles_from_db()}
+    cache.set(SUGGEST_TITLES_KEY, snapshot, None)
+    return snapshot
+
+
+def rebuild_suggestion_index() -> int:
+    """Reconstruit l'instantané depuis la base. Retourne le nombre de titres indexés."""
+    snapshot = _snapshot_from_db()
+    _build_local(snapshot["seq"], snapshot["titles"])
+    return len(snapshot["titles"])
+
+
+def _load(seq: int, from_db: bool = False) -> bool:
+    """Repart de l'instantané (ou de la base) ; False si un autre worker le reconstruit."""
+    snapshot = None if from_db else cache.get(SUGGEST_TITLES_KEY)
+    if snapshot is None or not 0 <= seq - snapshot["seq"] <= MAX_PENDING_DELTAS:
+        # Un seul calcul à froid : les autres workers gardent leur copie (ou rien) pour l'instant
+        if not acquire_lock(SUGGEST_TITLES_KEY):
+            return False
+        try:
+            snapshot = _snapshot_from_db()
+        finally:
+            release_lock(SUGGEST_TITLES_KEY)
+    _build_local(snapshot["seq"], snapshot["titles"])
+    return True
+
+
+def _apply_deltas(seq: int) -> bool:
+    """Applique les deltas jusqu'à `seq`. False si l'un manque pour la deuxième lecture de suite."""
+    start = _local["seq"] + 1
+    found = cache.get_many([_delta_key(n) for n in range(start, seq + 1)])
+    for n in range(start, seq + 1):
+        delta = found.get(_delta_key(n))
+        if delta is None:
+            # Écriture en cours (position incrémentée, delta pas encore posé) ou delta évincé
+            lost = _local["gap"] == n
+            _local["gap"] = n
+            return not lost
+        _set_title(*delta)
+        _local["seq"] = n
+    _local["gap"] = None
+    return True
+
+
+def _ensure_local() -> None:
+    seq = _current_seq()
+    if seq == _local["seq"]:
+        return
+    if _local["titles"] is None or not 0 < seq - _local["seq"] <= MAX_PENDING_DELTAS:
+        if not _load(seq):
+            return
+    if not _apply_deltas(seq) and _load(seq, from_db=True):
+        _apply_deltas(seq)
+
+
+def suggest_titles(q: str, limit: int = MAX_TITLE_SUGGESTIONS):
+    """Titres distincts dont un mot commence par `q` (normalisé), dans l'ordre des suffixes."""
+    prefix = fold_text(q)
+    if not prefix:
+        return []
+    _ensure_local()
+    index = _local["index"]
+    result = []
+    i = bisect.bisect_left(index, (prefix,))
+    while i < len(index) and index[i][0].startswith(prefix) and len(result) < limit:
+        if index[i][1] not in result:
+            result.append(index[i][1])
+        i += 1
+    return result
+
+
+def _record(ad_id: int, title) -> None:
+    """
+    Ajoute (title) ou retire (None) une annonce : un delta dans le journal partagé.
+    Appelé depuis les signaux d'Ad, jamais d'attente ni de réécriture de l'index.
+    """
+    try:
+        seq = cache.incr(SUGGEST_SEQ_KEY)
+    except ValueError:
+        # Journal jamais créé ou évincé : il repart d'une position neuve, les
+        # processus rechargent l'instantané (qui lit la base)
+        _current_seq()
+        return
+    cache.set(_delta_key(seq), (ad_id, title), DELTA_TTL)
+
+
+def index_ad(ad: Ad) -> None:
+    """Met l'annonce dans l'index si elle est visible dans la liste publique, l'en retire sinon."""
+    _record(ad.pk, ad.title if _is_visible(ad) else None)
+
+
+def unindex_ad(ad_id: int) -> None:
+    _record(ad_id, None)
@@ -5,7 +5,14 @@ from django.utils import timezone
 from django.db import transaction
 from django.db.models import Q
 from django.core.mail import send_mail
+from .imaging import delete_variants
 from .models import Ad, AdMedia
+from .facets import reconcile_facet_counts
+from .feed import rebuild_feed, sync_feed
+from .suggestions import rebuild_suggestion_index
+from .view_counter import flush_view_counts
+from .contacts import flush_contact_clicks
+from .analytics import flush_events, rollup_daily_stats
 from accounts.tasks import send_ad_published_email
 
 logger = logging.getLogger(__name__)
@@ -22,7 +29,7 @@ def process_ad_media_image(self, media_id: int):
         if not media.image:
             return f"AdMedia {media_id}: pas d'image"
         if media._add_watermark_and_thumbnail():
-            media.save(update_fields=["image", "thumbnail"])
+            media.save(update_fields=AdMedia.PROCESSED_FIELDS)
         # L'annonce n'apparaît en liste que lorsque toutes les photos ont filigrane + miniature
         ad = media.ad
         pending = AdMedia.objects.filter(ad=ad).filter(Q(thumbnail="") | Q(thumbnail__isnull=True))
@@ -97,6 +104,7 @@ def purge_expired_ads():
                     media.image.delete(save=False)
                 if media.thumbnail:
                     media.thumbnail.delete(save=False)
+                delete_variants(media.variants, media.image.storage)
             except Exception as e:
                 logger.warning("Erreur suppression fichier media %s: %s", media.id, e)
         ad.delete()
@@ -199,14 +207,18 @@ def promote_boosted_ads():
     La remontée dure 2 heures (premium_until = now + 2h).
     """
     now = timezone.now()
-    updated = Ad.objects.filter(
+    qs = Ad.objects.filter(
         is_boosted=True,
         boost_expires_at__gt=now,
         status=Ad.Status.APPROVED,
-    ).update(
+    )
+    ids = list(qs.values_list("pk", flat=True))
+    updated = Ad.objects.filter(pk__in=ids).update(
         is_premium=True,
         premium_until=now + timezone.timedelta(hours=2),
+        updated_at=now,
     )
+    sync_feed(ids)
     logger.info("promote_boosted_ads: %d annonces remontées", updated)
     return f"{updated} annonces boostées remontées en tête de liste"
 
@@ -218,13 +230,59 @@ def expire_premium_ads():
     À planifier toutes les 15 minutes pour que la fenêtre 2h soit respectée.
     """
     now = timezone.now()
-    updated = Ad.objects.filter(
-        is_premium=True,
-        premium_until__lt=now,
-    ).update(is_premium=False)
+    ids = list(
+        Ad.objects.filter(is_premium=True, premium_until__lt=now).values_list("pk", flat=True)
+    )
+    updated = Ad.objects.filter(pk__in=ids).update(is_premium=False, updated_at=now)
+    sync_feed(ids)
     return f"{updated} annonces sorties du premium"
 
 
+@shared_task
+def rebuild_ad_feed():
+    """
+    Réconciliation du fil public précalculé (AdFeedEntry) et de l'index des
+    suggestions de recherche avec la table Ad.
+    Les signaux et les crons le tiennent à jour ; cette tâche rattrape les écarts
+    (ex. .update() en masse, vérification d'un profil). À planifier toutes les heures.
+    """
+    total = rebuild_feed()
+    rebuild_suggestion_index()
+    return f"{total} annonces dans le fil"
+
+
+@shared_task
+def flush_ad_counters():
+    """
+    Reporte en base les écritures différées : vues (Ad.views_count), clics de
+    contact (AdContactDaily) et événements bruts (AdEvent). Toutes les minutes.
+    """
+    views = flush_view_counts()
+    clicks = flush_contact_clicks()
+    events = flush_events()
+    return f"{views} vues, {clicks} clics de contact, {events} événements enregistrés"
+
+
+@shared_task
+def rollup_ad_stats():
+    """
+    Agrège les événements récents dans AdDailyStats (statistiques du tableau de bord)
+    et purge les événements bruts anciens. Toutes les heures.
+    """
+    rows = rollup_daily_stats()
+    return f"{rows} statistiques quotidiennes recalculées"
+
+
+@shared_task
+def reconcile_ad_facet_counts():
+    """
+    Recalcule les compteurs AdFacetCount (ville × catégorie × statut) depuis la table Ad.
+    Les signaux les tiennent à jour ; cette tâche corrige toute dérive. À planifier 1×/jour.
+    """
+    rows = reconcile_facet_counts()
+    return f"{rows} compteurs recalculés"
+
+
 @shared_task(bind=True, max_retries=3)
 def auto_approve_ad(self, ad_id: int):
     """Approuver automatiquement une annonce après 10 secondes"""
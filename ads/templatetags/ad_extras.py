@@ -1,5 +1,8 @@
 from django import template
 from django.templatetags.static import static
+from django.utils.html import format_html_join
+
+from ads.imaging import MIME_TYPES
 
 register = template.Library()
 
@@ -35,3 +38,33 @@ def ad_placeholder_image(ad):
     filename = PLACEHOLDER_IMAGES[index]
     return static(filename)
 
+
+def _variants_of(variants, fmt):
+    return sorted(
+        (v for v in variants or () if v.get("format") == fmt and v.get("url")),
+        key=lambda v: v.get("width") or 0,
+    )
+
+
+@register.filter
+def srcset(variants, fmt="webp"):
+    """Valeur d'attribut srcset (« url 160w, url 320w... ») des variantes `fmt` d'une image."""
+    return ", ".join(f"{v['url']} {v['width']}w" for v in _variants_of(variants, fmt))
+
+
+@register.simple_tag
+def image_sources(variants, sizes):
+    """
+    Éléments <source> d'un <picture> pour les variantes responsive d'une image
+    (ads.imaging) : un par format, dans l'ordre de préférence enregistré (WebP
+    avant JPEG). Rien si l'image n'a pas encore de variantes : le <img> seul sert.
+    """
+    formats = []
+    for variant in variants or ():
+        if variant.get("format") in MIME_TYPES and variant["format"] not in formats:
+            formats.append(variant["format"])
+    return format_html_join(
+        "",
+        '<source type="{}" srcset="{}" sizes="{}">',
+        ((MIME_TYPES[fmt], srcset(variants, fmt), sizes) for fmt in formats),
+    )
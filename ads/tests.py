@@ -3,18 +3,77 @@ Tests complets — app ads
 Couvre : modèles, vues, tâches Celery, formulaires
 """
 import json
+import shutil
+import tempfile
+import time
 from datetime import timedelta
 from io import BytesIO
+from unittest import skipUnless
 from unittest.mock import MagicMock, patch
 
+import pytest
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.template import Context, Template
 from django.test import Client, TestCase, override_settings
 from django.utils import timezone
-
-from .models import Ad, AdMedia, City, Favorite, Report
+from PIL import Image
+
+from core.cache_utils import acquire_lock, swr_set
+from core.cdn import LocalPurgeBackend
+
+from .analytics import CHART_DAYS, daily_series, flush_events, rollup_daily_stats
+from .batch import drain_pending_watermarks, read_checkpoint, run_batch
+from .contacts import contact_totals, flush_contact_clicks
+from .dedupe import BLOOM_BITS, VISITOR_COOKIE, first_seen
+from .detail_page import FAVORITE_HOLE, build_detail_page, detail_page_key
+from .facets import (
+    FACETS_CACHE_KEY,
+    compute_facets,
+    get_listing_facets,
+    invalidate_listing_facets,
+    reconcile_facet_counts,
+)
+from .favorites import annotate_favorites, favorite_ids, favorited_among
+from .feed import (
+    LIST_CACHE_MAX_TTL,
+    LIST_CACHE_MIN_TTL,
+    AdCard,
+    card_fragment_key,
+    list_cache_ttl,
+    next_state_change,
+    rebuild_feed,
+    render_cards,
+    sync_feed,
+)
+from .imaging import (
+    apply_watermark,
+    available_formats,
+    decode_scaled,
+    thumbnail_of,
+    variant_widths,
+    watermark_logo,
+    watermark_logo_path,
+)
+from .models import (
+    Ad,
+    AdContactDaily,
+    AdDailyStats,
+    AdEvent,
+    AdFacetCount,
+    AdFeedEntry,
+    AdMedia,
+    City,
+    Favorite,
+    Report,
+    sync_primary_thumbnail,
+)
+from .similar import similar_ads
+from .suggestions import rebuild_suggestion_index, suggest_titles
+from .view_counter import flush_view_counts
 from .tasks import (
     expire_ads,
     expire_premium_ads,
@@ -207,6 +266,321 @@ class AdMediaModelTest(TestCase):
         self.assertTrue(m.is_primary)
 
 
+class AdCardsQuerySetTest(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.city = make_city()
+
+    def test_projection_single_query(self):
+        ad = make_ad(self.user, self.city)
+        AdMedia.objects.create(ad=ad, image="a.jpg")
+        AdMedia.objects.create(ad=ad, image="b.jpg", is_primary=True)
+        other = make_ad(self.user, self.city, title="Sans photo")
+        with self.assertNumQueries(1):
+            ads = {a.pk: a for a in Ad.objects.filter(pk__in=[ad.pk, other.pk]).cards()}
+            self.assertTrue(ads[ad.pk].primary_thumbnail_url.endswith("b.jpg"))
+            self.assertEqual(ads[other.pk].primary_thumbnail_url, "")
+            self.assertEqual(ads[ad.pk].city.name, self.city.name)
+        deferred = ads[ad.pk].get_deferred_fields()
+        self.assertIn("description_sanitized", deferred)
+        self.assertIn("additional_data", deferred)
+
+    def test_primary_thumbnail_follows_media(self):
+        ad = make_ad(self.user, self.city)
+
+        def thumbnail_url():
+            ad.refresh_from_db()
+            return ad.primary_thumbnail_url
+
+        first = AdMedia.objects.create(ad=ad, image="a.jpg")
+        second = AdMedia.objects.create(ad=ad, image="b.jpg")
+        self.assertTrue(thumbnail_url().endswith("a.jpg"))
+        second.is_primary = True
+        second.save()
+        self.assertTrue(thumbnail_url().endswith("b.jpg"))
+        second.delete()
+        self.assertTrue(thumbnail_url().endswith("a.jpg"))
+        first.delete()
+        self.assertEqual(thumbnail_url(), "")
+
+    def test_processed_thumbnail_dimensions(self):
+        ad = make_ad(self.user, self.city)
+        media = AdMedia.objects.create(ad=ad, image="a.jpg", thumbnail="a_thumb.webp")
+        media._thumbnail_size = (320, 240)
+        sync_primary_thumbnail(ad.pk, processed=media)
+        ad.refresh_from_db()
+        self.assertTrue(ad.primary_thumbnail_url.endswith("a_thumb.webp"))
+        self.assertEqual((ad.primary_thumbnail_width, ad.primary_thumbnail_height), (320, 240))
+        sync_feed([ad.pk])
+        self.assertEqual(AdFeedEntry.objects.get(ad=ad).card["thumbnail_width"], 320)
+
+    def test_favorites_list_query_count_does_not_grow(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        self.client.force_login(self.user)
+
+        def favorite(n):
+            ad = make_ad(self.user, self.city, title=f"Fav {n}")
+            AdMedia.objects.create(ad=ad, image=f"{n}.jpg")
+            Favorite.objects.create(user=self.user, ad=ad)
+
+        favorite(0)
+        self.client.get("/ads/favorites/")  # caches du contexte (métriques, facettes) chauds
+        with CaptureQueriesContext(connection) as one:
+            self.client.get("/ads/favorites/")
+        favorite(1)
+        favorite(2)
+        with CaptureQueriesContext(connection) as three:
+            r = self.client.get("/ads/favorites/")
+        self.assertContains(r, "Fav 2")
+        self.assertEqual(len(one), len(three))
+
+
+class ImagePipelineTest(TestCase):
+    def _encoded(self, mode, size, fmt, color):
+        buffer = BytesIO()
+        Image.new(mode, size, color).save(buffer, format=fmt)
+        buffer.seek(0)
+        return buffer
+
+    def test_jpeg_decoded_at_scale_then_fitted(self):
+        img, fmt = decode_scaled(self._encoded("RGB", (4000, 3000), "JPEG", (10, 20, 30)))
+        self.assertEqual(fmt, "JPEG")
+        self.assertEqual((img.mode, img.size), ("RGB", (1000, 750)))
+
+    def test_transparency_flattened_on_white_once(self):
+        img, fmt = decode_scaled(self._encoded("RGBA", (200, 100), "PNG", (0, 0, 0, 0)))
+        self.assertEqual((fmt, img.mode, img.size), ("PNG", "RGB", (200, 100)))
+        self.assertEqual(img.getpixel((0, 0)), (255, 255, 255))
+
+    def test_logo_cached_per_size(self):
+        path = watermark_logo_path()
+        self.assertIsNotNone(path)
+        self.assertIs(watermark_logo(path, 187), watermark_logo(path, 187))
+        logo = watermark_logo(path, 187)
+        self.assertEqual(max(logo.size), 187)
+        self.assertLessEqual(logo.getchannel("A").getextrema()[1], 127)
+
+    def test_watermark_and_thumbnail_share_rgb_image(self):
+        img, _ = decode_scaled(self._encoded("RGB", (1000, 750), "PNG", (255, 255, 255)))
+        apply_watermark(img, watermark_logo_path())
+        self.assertNotEqual(img.getpixel((500, 375)), (255, 255, 255))
+        self.assertEqual(img.getpixel((0, 0)), (255, 255, 255))
+        self.assertEqual(thumbnail_of(img).size, (320, 240))
+
+
+class AdImageVariantsTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root, AD_IMAGE_VARIANT_FORMATS=["webp"])
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = make_user()
+        self.city = make_city()
+        self.ad = make_ad(self.user, self.city)
+
+    def _upload(self, size=(1200, 900)):
+        buffer = BytesIO()
+        Image.new("RGB", size, (200, 30, 90)).save(buffer, format="PNG")
+        return SimpleUploadedFile("photo.png", buffer.getvalue(), content_type="image/png")
+
+    def test_variant_widths_never_upscale(self):
+        self.assertEqual(variant_widths(1000), [160, 320, 640, 1000])
+        self.assertEqual(variant_widths(800), [160, 320, 640, 800])
+        self.assertEqual(variant_widths(120), [120])
+
+    def test_avif_only_when_encoder_available(self):
+        with override_settings(AD_IMAGE_VARIANT_FORMATS=["avif", "webp"]):
+            formats = available_formats()
+        self.assertEqual(formats[-1], "webp")
+        self.assertEqual("avif" in formats, "AVIF" in Image.SAVE)
+
+    def test_default_formats_are_webp_then_jpeg(self):
+        with override_settings(AD_IMAGE_VARIANT_FORMATS=["webp", "jpeg"]):
+            self.assertEqual(available_formats(), ["webp", "jpeg"])
+            media = AdMedia(ad=self.ad, image=self._upload((400, 300)))
+            with self.captureOnCommitCallbacks(execute=True):
+                media.save()
+        media.refresh_from_db()
+        self.assertEqual(
+            [(v["format"], v["width"]) for v in media.variants],
+            [("webp", 160), ("webp", 320), ("webp", 400), ("jpeg", 160), ("jpeg", 320), ("jpeg", 400)],
+        )
+
+    def test_processing_stores_variants_and_copies_them_to_card(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            media = AdMedia.objects.create(ad=self.ad, image=self._upload(), is_primary=True)
+        media.refresh_from_db()
+        self.assertEqual([v["width"] for v in media.variants], [160, 320, 640, 1000])
+        self.assertEqual(media.variants[0]["height"], 120)
+        for variant in media.variants:
+            self.assertTrue(media.image.storage.exists(variant["name"]))
+        self.ad.refresh_from_db()
+        self.assertEqual(self.ad.primary_image_variants, media.variants)
+        card = AdCard(AdFeedEntry.objects.get(ad=self.ad).card)
+        render_cards([card])
+        self.assertIn('<source type="image/webp" srcset="%s 160w' % media.variants[0]["url"], card.html)
+        self.assertIn('sizes="160px"', card.html)
+
+    def test_reprocessing_replaces_variant_files(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            media = AdMedia.objects.create(ad=self.ad, image=self._upload(), is_primary=True)
+        media.refresh_from_db()
+        old_names = [v["name"] for v in media.variants]
+        media._watermark_applied = False
+        self.assertTrue(media._add_watermark_and_thumbnail())
+        media.save(update_fields=AdMedia.PROCESSED_FIELDS)
+        for name in old_names:
+            self.assertFalse(media.image.storage.exists(name))
+        for variant in media.variants:
+            self.assertTrue(media.image.storage.exists(variant["name"]))
+
+    def test_image_sources_tag(self):
+        variants = [
+            {"format": "avif", "width": 320, "height": 240, "name": "a320", "url": "/m/a320.avif"},
+            {"format": "avif", "width": 160, "height": 120, "name": "a160", "url": "/m/a160.avif"},
+            {"format": "webp", "width": 160, "height": 120, "name": "w160", "url": "/m/w160.webp"},
+        ]
+        html = Template('{% load ad_extras %}{% image_sources variants "160px" %}').render(
+            Context({"variants": variants})
+        )
+        self.assertEqual(
+            html,
+            '<source type="image/avif" srcset="/m/a160.avif 160w, /m/a320.avif 320w" sizes="160px">'
+            '<source type="image/webp" srcset="/m/w160.webp 160w" sizes="160px">',
+        )
+        self.assertEqual(Template('{% load ad_extras %}{% image_sources "" "160px" %}').render(Context()), "")
+
+
+class MediaFilesMixin:
+    """MEDIA_ROOT temporaire et photos JPEG réelles pour le traitement d'images."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media_root, AD_IMAGE_VARIANT_FORMATS=["webp"])
+        override.enable()
+        self.addCleanup(override.disable)
+        self.checkpoint = f"{self.media_root}/checkpoint.json"
+        self.ad = make_ad(make_user(), make_city())
+
+    def _media(self, n):
+        buffer = BytesIO()
+        Image.new("RGB", (800, 600), (n * 40, 80, 120)).save(buffer, format="JPEG")
+        upload = SimpleUploadedFile(f"p{n}.jpg", buffer.getvalue(), content_type="image/jpeg")
+        return AdMedia.objects.create(ad=self.ad, image=upload, is_primary=(n == 0))
+
+
+class BatchProcessingTest(MediaFilesMixin, TestCase):
+    def test_watermark_bulk_updates_and_syncs_card(self):
+        medias = [self._media(n) for n in range(3)]
+        result = run_batch(AdMedia.objects.filter(has_watermark=False), "watermark", workers=1, chunk_size=2)
+        self.assertEqual((result["processed"], result["failed"]), (3, 0))
+        for media in medias:
+            media.refresh_from_db()
+            self.assertTrue(media.has_watermark)
+            self.assertTrue(media.thumbnail.name.endswith("_thumb.webp"))
+            self.assertEqual([v["width"] for v in media.variants], [160, 320, 640, 800])
+        self.ad.refresh_from_db()
+        self.assertEqual(self.ad.primary_image_variants, medias[0].variants)
+        self.assertEqual(AdFeedEntry.objects.get(ad=self.ad).card["image_variants"], medias[0].variants)
+
+    def test_resumes_from_checkpoint(self):
+        medias = [self._media(n) for n in range(3)]
+        qs = AdMedia.objects.all()
+        first = run_batch(qs, "thumbnail", workers=1, chunk_size=1, checkpoint=self.checkpoint, limit=2)
+        self.assertEqual(first["last_pk"], medias[1].pk)
+        self.assertEqual(read_checkpoint(self.checkpoint, "thumbnail"), medias[1].pk)
+        self.assertEqual(read_checkpoint(self.checkpoint, "watermark"), 0)
+        done = []
+        run_batch(qs, "thumbnail", workers=1, checkpoint=self.checkpoint,
+                  on_chunk=lambda ok, failed, last_pk: done.extend(pk for pk, _, _ in ok))
+        self.assertEqual(done, [medias[2].pk])
+
+    def test_failures_counted_and_skipped(self):
+        ok = self._media(0)
+        broken = AdMedia.objects.create(ad=self.ad, image="ads/absente.jpg")
+        result = run_batch(AdMedia.objects.all(), "thumbnail", workers=1, checkpoint=self.checkpoint)
+        self.assertEqual((result["processed"], result["failed"]), (1, 1))
+        self.assertEqual(result["last_pk"], max(ok.pk, broken.pk))
+        broken.refresh_from_db()
+        self.assertFalse(broken.thumbnail)
+
+
+class CronApplyWatermarksTest(MediaFilesMixin, TestCase):
+    URL = "/ads/cron/watermarks/"
+
+    def _pending(self, n):
+        media = self._media(n)
+        AdMedia.objects.filter(pk=media.pk).update(has_watermark=False)
+        return media
+
+    def test_forbidden_without_cron_header(self):
+        self.assertEqual(self.client.get(self.URL).status_code, 403)
+
+    def test_drains_backlog_and_reports_throughput(self):
+        medias = [self._pending(n) for n in range(5)]
+        r = self.client.get(self.URL, HTTP_X_VERCEL_CRON="1")
+        data = r.json()
+        self.assertEqual((data["processed"], data["errors"], data["more"]), (5, 0, False))
+        self.assertNotIn("remaining", data)
+        self.assertGreaterEqual(data["rounds"], 2)  # premier tour de mesure, puis tour dimensionné
+        self.assertGreater(data["images_per_s"], 0)
+        self.assertFalse(AdMedia.objects.filter(pk__in=[m.pk for m in medias], has_watermark=False).exists())
+
+    def test_failed_images_not_retried_within_run(self):
+        self._pending(0)
+        AdMedia.objects.create(ad=self.ad, image="ads/absente.jpg")
+        stats = drain_pending_watermarks(budget=30, workers=2)
+        self.assertEqual((stats["processed"], stats["errors"], stats["more"]), (1, 1, False))
+
+    def test_worker_threads_close_their_connections(self):
+        for n in range(3):
+            self._pending(n)
+        with patch("ads.batch.connections") as conns:
+            stats = drain_pending_watermarks(budget=30, workers=2)
+        self.assertEqual(stats["processed"], 3)
+        self.assertEqual(conns.close_all.call_count, 3)
+
+    def test_budget_exhausted_reports_more(self):
+        self._pending(0)
+        stats = drain_pending_watermarks(budget=0, workers=2)
+        self.assertEqual((stats["processed"], stats["rounds"], stats["more"]), (0, 0, True))
+
+    def test_leased_images_skipped(self):
+        from core.cache_utils import acquire_lock, release_lock
+
+        leased = self._pending(0)
+        self._pending(1)
+        self.assertTrue(acquire_lock(f"watermark:{leased.pk}", 60))  # autre exécution en cours
+        self.addCleanup(release_lock, f"watermark:{leased.pk}")
+        stats = drain_pending_watermarks(budget=30, workers=2)
+        self.assertEqual(stats["processed"], 1)
+        self.assertEqual(
+            set(AdMedia.objects.filter(has_watermark=False).values_list("pk", flat=True)), {leased.pk}
+        )
+
+    def test_batches_committed_before_interruption(self):
+        from .batch import _apply
+
+        for n in range(3):
+            self._pending(n)
+        calls = []
+
+        def apply_then_die(operation, done):
+            calls.append(done)
+            if len(calls) > 1:
+                raise RuntimeError("timeout")
+            _apply(operation, done)
+
+        with patch("ads.batch.APPLY_BATCH", 1), patch("ads.batch._apply", side_effect=apply_then_die):
+            with self.assertRaises(RuntimeError):
+                drain_pending_watermarks(budget=30, workers=1)
+        self.assertEqual(AdMedia.objects.filter(has_watermark=True).count(), 1)
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # VUE : ad_list
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -316,6 +690,565 @@ class AdListViewTest(TestCase):
         self.assertContains(r, "fefce8")
 
 
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}})
+class AdListCursorPaginationTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.client.cookies["age_gate_accepted"] = "1"
+        self.user = make_user()
+        self.city = make_city()
+        base = timezone.now()
+        self.ads = [
+            make_ad(self.user, self.city, title=f"Carte {i:02d}", bumped_at=base - timedelta(minutes=i))
+            for i in range(23)
+        ]
+
+    def _titles(self, response):
+        return [ad.title for ad in response.context["page_obj"]]
+
+    def test_first_page_uses_cursor_mode(self):
+        r = self.client.get("/ads/")
+        self.assertTrue(r.context["cursor_pagination"])
+        self.assertEqual(self._titles(r), [f"Carte {i:02d}" for i in range(10)])
+        self.assertFalse(r.context["page_obj"].has_previous())
+        self.assertTrue(r.context["page_obj"].next_cursor)
+
+    def test_walk_forward_then_back(self):
+        seen = []
+        r = self.client.get("/ads/")
+        seen += self._titles(r)
+        while r.context["page_obj"].has_next():
+            r = self.client.get("/ads/", {"cursor": r.context["page_obj"].next_cursor})
+            seen += self._titles(r)
+        self.assertEqual(seen, [f"Carte {i:02d}" for i in range(23)])
+        self.assertFalse(r.context["page_obj"].has_next())
+
+        r = self.client.get("/ads/", {"cursor": r.context["page_obj"].previous_cursor})
+        self.assertEqual(self._titles(r), [f"Carte {i:02d}" for i in range(10, 20)])
+        self.assertTrue(r.context["page_obj"].has_previous())
+
+    def test_no_count_query(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get("/ads/")
+        # Seul un COUNT de pagination combine status IN (approved, expired) et
+        # image_processing_done sans GROUP BY (les facettes sont groupées).
+        paginator_counts = [
+            q["sql"] for q in ctx.captured_queries
+            if "COUNT(" in q["sql"]
+            and '"ads_ad"."status" IN' in q["sql"]
+            and "image_processing_done" in q["sql"]
+            and "GROUP BY" not in q["sql"]
+        ]
+        self.assertEqual(paginator_counts, [])
+
+    def test_tampered_cursor_falls_back_to_first_page(self):
+        r = self.client.get("/ads/", {"cursor": "pas-un-curseur"})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(self._titles(r)[0], "Carte 00")
+
+    def test_cursor_links_keep_filters(self):
+        r = self.client.get("/ads/", {"city": self.city.slug})
+        self.assertContains(r, f"city={self.city.slug}")
+        self.assertContains(r, "?cursor=")
+
+    def test_legacy_page_number_still_served(self):
+        r = self.client.get("/ads/?page=2")
+        self.assertFalse(r.context["cursor_pagination"])
+        self.assertEqual(r.context["page_obj"].number, 2)
+        self.assertEqual(self._titles(r)[0], "Carte 10")
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}})
+class AdFullTextSearchTest(TestCase):
+    """Index FTS5 (SQLite) : mêmes garanties que le tsvector PostgreSQL."""
+
+    def setUp(self):
+        self.client = Client()
+        self.client.cookies["age_gate_accepted"] = "1"
+        self.user = make_user()
+        self.city = make_city()
+
+    def _titles(self, q, **params):
+        r = self.client.get("/ads/", {"q": q, **params})
+        return [ad.title for ad in r.context["page_obj"]]
+
+    def test_accents_are_folded(self):
+        make_ad(self.user, self.city, title="Soirée érotique")
+        self.assertEqual(self._titles("erotique"), ["Soirée érotique"])
+        self.assertEqual(self._titles("SOIREE"), ["Soirée érotique"])
+
+    def test_prefix_matches_inflections(self):
+        make_ad(self.user, self.city, title="Massages relaxants")
+        self.assertEqual(self._titles("massage"), ["Massages relaxants"])
+
+    def test_subcategories_are_indexed(self):
+        make_ad(self.user, self.city, title="Annonce", subcategories=["Sex anal (sodomie)"])
+        self.assertEqual(self._titles("sodomie"), ["Annonce"])
+
+    def test_title_match_ranks_above_description_match(self):
+        now = timezone.now()
+        make_ad(self.user, self.city, title="Rencontre", description_sanitized="massage possible",
+                bumped_at=now)
+        make_ad(self.user, self.city, title="Massage complet", bumped_at=now - timedelta(hours=3))
+        self.assertEqual(self._titles("massage"), ["Massage complet", "Rencontre"])
+
+    def test_index_follows_updates_and_deletes(self):
+        ad = make_ad(self.user, self.city, title="Ancien titre")
+        ad.title = "Nouveau titre"
+        ad.save()
+        self.assertEqual(self._titles("ancien"), [])
+        self.assertEqual(self._titles("nouveau"), ["Nouveau titre"])
+        ad.delete()
+        self.assertEqual(self._titles("nouveau"), [])
+
+    def test_operators_are_not_interpreted(self):
+        make_ad(self.user, self.city, title="Massage")
+        r = self.client.get("/ads/", {"q": 'massage" OR NEAR( *'})
+        self.assertEqual(r.status_code, 200)
+
+    def test_cursor_walks_ranked_results(self):
+        for i in range(13):
+            make_ad(self.user, self.city, title=f"Massage {i:02d}")
+        r = self.client.get("/ads/", {"q": "massage"})
+        seen = [ad.title for ad in r.context["page_obj"]]
+        r = self.client.get("/ads/", {"q": "massage", "cursor": r.context["page_obj"].next_cursor})
+        seen += [ad.title for ad in r.context["page_obj"]]
+        self.assertEqual(sorted(seen), [f"Massage {i:02d}" for i in range(13)])
+
+
+@pytest.mark.postgresql
+@skipUnless(connection.vendor == "postgresql", "tsvector / to_tsquery : PostgreSQL uniquement")
+class PostgresFullTextSearchTest(AdFullTextSearchTest):
+    """Mêmes cas que sous SQLite, sur le tsvector PostgreSQL (recherche en préfixe)."""
+
+    def test_partial_word_matches(self):
+        make_ad(self.user, self.city, title="Massage relaxant")
+        self.assertEqual(self._titles("massa"), ["Massage relaxant"])
+        self.assertEqual(self._titles("relax mass"), ["Massage relaxant"])
+
+    def test_tsquery_operators_are_not_interpreted(self):
+        make_ad(self.user, self.city, title="Massage")
+        r = self.client.get("/ads/", {"q": "massage & | ! ( :* <->"})
+        self.assertEqual(r.status_code, 200)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class SearchResultCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.cookies["age_gate_accepted"] = "1"
+        self.user = make_user()
+        self.city = make_city()
+        now = timezone.now()
+        for i in range(12):
+            make_ad(self.user, self.city, title=f"Massage {i:02d}", bumped_at=now - timedelta(minutes=i))
+
+    def _search_queries(self, q, **params):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as ctx:
+            r = self.client.get("/ads/", {"q": q, **params})
+        fts = [x["sql"] for x in ctx.captured_queries if "ads_ad_fts" in x["sql"]]
+        return r, fts
+
+    def test_normalized_query_reuses_cached_ids(self):
+        r, fts = self._search_queries("massage")
+        self.assertEqual(len(fts), 1)
+        r, fts = self._search_queries("  MASSAGE! ")
+        self.assertEqual(fts, [])
+        self.assertEqual(r.context["page_obj"][0].title, "Massage 00")
+
+    def test_cursor_pages_served_from_cached_ids(self):
+        r, _ = self._search_queries("massage")
+        next_cursor = r.context["page_obj"].next_cursor
+        r, fts = self._search_queries("massage", cursor=next_cursor)
+        self.assertEqual(fts, [])
+        self.assertEqual([ad.title for ad in r.context["page_obj"]], ["Massage 10", "Massage 11"])
+        r, _ = self._search_queries("massage", cursor=r.context["page_obj"].previous_cursor)
+        self.assertEqual(r.context["page_obj"][0].title, "Massage 00")
+
+    def test_results_beyond_cached_window_are_paginated(self):
+        with patch("ads.search.MAX_SEARCH_RESULTS", 5):
+            r, _ = self._search_queries("massage")
+            seen = [ad.title for ad in r.context["page_obj"]]
+            r, _ = self._search_queries("massage", cursor=r.context["page_obj"].next_cursor)
+            seen += [ad.title for ad in r.context["page_obj"]]
+            self.assertEqual(seen, [f"Massage {i:02d}" for i in range(12)])
+            self.assertFalse(r.context["page_obj"].has_next())
+            r, _ = self._search_queries("massage", cursor=r.context["page_obj"].previous_cursor)
+            self.assertEqual(r.context["page_obj"][0].title, "Massage 00")
+            r, _ = self._search_queries("massage", page=2)
+            self.assertEqual(r.context["page_obj"].paginator.count, 12)
+            self.assertEqual([ad.title for ad in r.context["page_obj"]], ["Massage 10", "Massage 11"])
+
+    def test_list_version_invalidates_results(self):
+        self._search_queries("massage")
+        make_ad(self.user, self.city, title="Massage nouveau")
+        r, fts = self._search_queries("massage")
+        self.assertEqual(len(fts), 1)
+        self.assertEqual(r.context["page_obj"][0].title, "Massage nouveau")
+
+
+class AdFeedTest(TestCase):
+    """Table AdFeedEntry tenue à jour par signaux / sync_feed."""
+
+    def setUp(self):
+        self.user = make_user()
+        self.city = make_city()
+
+    def test_visible_ad_gets_feed_entry(self):
+        ad = make_ad(self.user, self.city, title="Dans le fil")
+        entry = AdFeedEntry.objects.get(ad=ad)
+        self.assertEqual(entry.card["title"], "Dans le fil")
+        self.assertEqual(entry.card["city_name"], "Abidjan")
+        self.assertTrue(entry.is_approved)
+
+    def test_pending_ad_not_in_feed(self):
+        ad = make_ad(self.user, self.city, status=Ad.Status.PENDING)
+        self.assertFalse(AdFeedEntry.objects.filter(ad=ad).exists())
+
+    def test_status_change_removes_entry(self):
+        ad = make_ad(self.user, self.city)
+        ad.status = Ad.Status.ARCHIVED
+        ad.save(update_fields=["status"])
+        self.assertFalse(AdFeedEntry.objects.filter(ad=ad).exists())
+
+    def test_expired_ranks_after_approved(self):
+        old = make_ad(self.user, self.city, bumped_at=timezone.now() - timedelta(days=3))
+        expired = make_ad(self.user, self.city, status=Ad.Status.EXPIRED)
+        self.assertGreater(
+            AdFeedEntry.objects.get(ad=old).rank, AdFeedEntry.objects.get(ad=expired).rank
+        )
+
+    def test_sync_after_queryset_update(self):
+        ad = make_ad(self.user, self.city)
+        Ad.objects.filter(pk=ad.pk).update(title="Titre modifié")
+        self.assertEqual(AdFeedEntry.objects.get(ad=ad).card["title"], "Annonce test")
+        sync_feed([ad.pk])
+        self.assertEqual(AdFeedEntry.objects.get(ad=ad).card["title"], "Titre modifié")
+
+    def test_rebuild_feed_reconciles(self):
+        visible = make_ad(self.user, self.city)
+        hidden = make_ad(self.user, self.city)
+        Ad.objects.filter(pk=hidden.pk).update(status=Ad.Status.REJECTED)
+        AdFeedEntry.objects.filter(ad=visible).delete()
+        self.assertEqual(rebuild_feed(), 1)
+        self.assertEqual(list(AdFeedEntry.objects.values_list("ad_id", flat=True)), [visible.pk])
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ListingFacetsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user()
+        self.abidjan = make_city()
+        self.bouake = make_city("Bouaké")
+        make_ad(self.user, self.abidjan)
+        make_ad(self.user, self.abidjan, category=Ad.Category.ESCORTE_BOY)
+        make_ad(self.user, self.bouake, status=Ad.Status.EXPIRED)
+        make_ad(self.user, self.bouake, image_processing_done=False)
+        make_ad(self.user, self.bouake, status=Ad.Status.PENDING)
+
+    def test_all_facets_from_one_computation(self):
+        facets = compute_facets()
+        self.assertEqual(facets["total_approved_ads"], 4)
+        self.assertEqual(facets["online_ads"], 2)
+        self.assertEqual(facets["category_counts"], {"escorte_girl": 3, "escorte_boy": 1})
+        self.assertEqual(
+            [(c.name, c.ad_count) for c in facets["city_counts"]], [("Abidjan", 2), ("Bouaké", 2)]
+        )
+        self.assertEqual(
+            [(c.name, c.ad_count) for c in facets["popular_cities_footer"]], [("Abidjan", 2)]
+        )
+
+    def test_cached_until_invalidated(self):
+        get_listing_facets()
+        with self.assertNumQueries(0):
+            get_listing_facets()
+        invalidate_listing_facets()
+        with self.assertNumQueries(2):
+            get_listing_facets()
+
+    def test_status_change_refreshes_cached_facets(self):
+        self.assertEqual(get_listing_facets()["online_ads"], 2)
+        ad = make_ad(self.user, self.abidjan, status=Ad.Status.PENDING)
+        with self.captureOnCommitCallbacks(execute=True):
+            ad.status = Ad.Status.APPROVED
+            ad.save(update_fields=["status"])
+        self.assertEqual(get_listing_facets()["online_ads"], 3)
+
+    def test_counters_follow_status_city_and_deletion(self):
+        def count(city, status, done=True):
+            row = AdFacetCount.objects.filter(
+                city=city, category=Ad.Category.ESCORTE_GIRL, status=status, images_done=done
+            ).first()
+            return row.count if row else 0
+
+        ad = make_ad(self.user, self.abidjan)
+        self.assertEqual(count(self.abidjan, Ad.Status.APPROVED), 2)
+        ad.status = Ad.Status.EXPIRED
+        ad.save(update_fields=["status"])
+        self.assertEqual(count(self.abidjan, Ad.Status.APPROVED), 1)
+        self.assertEqual(count(self.abidjan, Ad.Status.EXPIRED), 1)
+        ad.city = self.bouake
+        ad.save()
+        self.assertEqual(count(self.abidjan, Ad.Status.EXPIRED), 0)
+        self.assertEqual(count(self.bouake, Ad.Status.EXPIRED), 2)
+        ad.delete()
+        self.assertEqual(count(self.bouake, Ad.Status.EXPIRED), 1)
+
+    def test_reconcile_fixes_drift(self):
+        Ad.objects.filter(city=self.bouake).update(status=Ad.Status.REJECTED)
+        reconcile_facet_counts()
+        facets = compute_facets()
+        self.assertEqual([c.name for c in facets["city_counts"]], ["Abidjan"])
+        self.assertEqual(facets["total_approved_ads"], 2)
+
+    def test_cold_miss_computed_locally_while_another_worker_computes(self):
+        acquire_lock(FACETS_CACHE_KEY)
+        with patch("ads.facets.compute_facets") as compute:
+            compute.return_value = {"cities": []}
+            self.assertEqual(get_listing_facets(), {"cities": []})
+        compute.assert_called_once()
+        self.assertIsNone(cache.get(FACETS_CACHE_KEY))  # laissée au détenteur du verrou
+
+    def test_invalidated_facets_served_stale_during_recompute(self):
+        facets = get_listing_facets()
+        invalidate_listing_facets()
+        acquire_lock(FACETS_CACHE_KEY)  # un autre worker recalcule
+        with self.assertNumQueries(0):
+            self.assertEqual(get_listing_facets(), facets)
+
+
+class ListCacheTtlTest(TestCase):
+    """Durée de vie des pages de liste calculée depuis les échéances des annonces."""
+
+    def setUp(self):
+        self.user = make_user()
+        self.city = make_city()
+
+    def test_next_change_is_earliest_deadline(self):
+        now = timezone.now()
+        ad = make_ad(self.user, self.city,
+                     expires_at=now + timedelta(days=10),
+                     is_premium=True, premium_until=now + timedelta(minutes=20),
+                     bumped_at=now)
+        self.assertEqual(next_state_change(ad, now), now + timedelta(minutes=20))
+
+    def test_due_bump_counts_as_change(self):
+        now = timezone.now()
+        ad = make_ad(self.user, self.city,
+                     expires_at=now + timedelta(days=10),
+                     is_boosted=True, boost_expires_at=now + timedelta(days=5),
+                     boost_interval_hours=3, bumped_at=now - timedelta(hours=1))
+        self.assertEqual(next_state_change(ad, now), now + timedelta(hours=2))
+
+    def test_ttl_bounds(self):
+        now = timezone.now()
+        soon = AdFeedEntry(next_change_at=now + timedelta(seconds=5))
+        later = AdFeedEntry(next_change_at=now + timedelta(hours=2))
+        never = AdFeedEntry(next_change_at=None)
+        self.assertEqual(list_cache_ttl([later, never, None], now), 7200)
+        self.assertEqual(list_cache_ttl([soon, later], now), LIST_CACHE_MIN_TTL)
+        self.assertEqual(list_cache_ttl([never], now), LIST_CACHE_MAX_TTL)
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_sync_feed_invalidates_only_affected_scopes(self):
+        from core.context_processors import get_list_version
+
+        cache.clear()
+        other = City.objects.create(name="Bouaké", region="Gbêkê")
+        ad = make_ad(self.user, self.city)
+        before = {
+            "all": get_list_version(),
+            "city": get_list_version(self.city.slug),
+            "other": get_list_version(other.slug),
+            "cat": get_list_version(category=ad.category),
+        }
+        ad.title = "Titre modifié"
+        ad.save()
+        self.assertNotEqual(get_list_version(), before["all"])
+        self.assertNotEqual(get_list_version(self.city.slug), before["city"])
+        self.assertNotEqual(get_list_version(category=ad.category), before["cat"])
+        self.assertEqual(get_list_version(other.slug), before["other"])
+
+        # Annonce déplacée : l'ancienne et la nouvelle ville sont invalidées
+        city_version, other_version = get_list_version(self.city.slug), get_list_version(other.slug)
+        ad.city = other
+        ad.save()
+        self.assertNotEqual(get_list_version(self.city.slug), city_version)
+        self.assertNotEqual(get_list_version(other.slug), other_version)
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_unchanged_rows_do_not_invalidate(self):
+        from core.context_processors import get_list_version
+
+        cache.clear()
+        ad = make_ad(self.user, self.city)
+        version = get_list_version(self.city.slug)
+        updated_at = AdFeedEntry.objects.get(ad=ad).updated_at
+        sync_feed([ad.pk])
+        self.assertEqual(rebuild_feed(), 1)
+        self.assertEqual(get_list_version(self.city.slug), version)
+        self.assertEqual(AdFeedEntry.objects.get(ad=ad).updated_at, updated_at)
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_rebuild_feed_invalidates_drifted_rows(self):
+        from core.context_processors import get_list_version
+
+        cache.clear()
+        ad = make_ad(self.user, self.city)
+        Ad.objects.filter(pk=ad.pk).update(status=Ad.Status.REJECTED)  # sans signal
+        version = get_list_version(self.city.slug)
+        self.assertEqual(rebuild_feed(), 0)
+        self.assertFalse(AdFeedEntry.objects.filter(ad=ad).exists())
+        self.assertNotEqual(get_list_version(self.city.slug), version)
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_page_cached_until_first_change_below_cut(self):
+        cache.clear()
+        now = timezone.now()
+        for i in range(10):
+            make_ad(self.user, self.city, expires_at=now + timedelta(days=10),
+                    bumped_at=now - timedelta(minutes=i))
+        # 11e annonce (juste sous la coupure) : son premium se termine dans 10 min
+        make_ad(self.user, self.city, expires_at=now + timedelta(days=10),
+                is_premium=True, premium_until=now + timedelta(minutes=10),
+                bumped_at=now - timedelta(minutes=30))
+        client = Client()
+        client.cookies["age_gate_accepted"] = "1"
+        with patch("ads.views.swr_set", wraps=swr_set) as cache_set:
+            client.get("/ads/")
+        ttls = [c.args[2] for c in cache_set.call_args_list if str(c.args[0]).startswith("ad_list:")]
+        self.assertEqual(len(ttls), 1)
+        self.assertTrue(500 < ttls[0] <= 600)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class AdListStaleWhileRevalidateTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.cookies["age_gate_accepted"] = "1"
+        self.user = make_user()
+        self.city = make_city()
+        self.ad = make_ad(self.user, self.city, title="Première version")
+        self.client.get("/ads/")  # met la page en cache
+
+    def test_stale_page_served_while_another_worker_regenerates(self):
+        make_ad(self.user, self.city, title="Nouvelle annonce")  # version incrémentée
+        acquire_lock("ad_list:::::c")  # un autre worker régénère déjà
+        r = self.client.get("/ads/")
+        self.assertNotContains(r, "Nouvelle annonce")
+
+    def test_lock_winner_regenerates(self):
+        make_ad(self.user, self.city, title="Nouvelle annonce")
+        r = self.client.get("/ads/")
+        self.assertContains(r, "Nouvelle annonce")
+
+    def test_cold_page_rendered_uncached_while_another_worker_computes(self):
+        cache.delete("ad_list:::::c")  # évincée
+        acquire_lock("ad_list:::::c")  # premier appelant en train de la calculer
+        r = self.client.get("/ads/")
+        self.assertContains(r, "Première version")
+        self.assertIsNone(cache.get("ad_list:::::c"))
+
+    def test_cursor_pages_cached_under_digest_only_when_valid(self):
+        import hashlib
+
+        from .pagination import encode_cursor
+
+        for i in range(11):
+            make_ad(self.user, self.city, title=f"Annonce {i}")
+        cursor = self.client.get("/ads/").context["page_obj"].next_cursor
+        self.assertEqual(self.client.get("/ads/", {"cursor": cursor}).status_code, 200)
+        digest = hashlib.sha1(cursor.encode("utf-8")).hexdigest()
+        self.assertIsNotNone(cache.get(f"ad_list:::::c{digest}"))
+        self.assertIsNone(cache.get(f"ad_list:::::c{cursor}"))
+
+        # Curseur falsifié : première page, rien en cache
+        forged = cursor[:-4] + "AAAA"
+        r = self.client.get("/ads/", {"cursor": forged})
+        self.assertFalse(r.context["page_obj"].has_previous())
+        forged_digest = hashlib.sha1(forged.encode("utf-8")).hexdigest()
+        self.assertIsNone(cache.get(f"ad_list:::::c{forged_digest}"))
+
+        # Curseur signé mais sans ligne de bord réelle : servi, pas mis en cache
+        ghost = encode_cursor(["1" + "0" * 47], "n")
+        self.assertEqual(self.client.get("/ads/", {"cursor": ghost}).status_code, 200)
+        ghost_digest = hashlib.sha1(ghost.encode("utf-8")).hexdigest()
+        self.assertIsNone(cache.get(f"ad_list:::::c{ghost_digest}"))
+
+    def test_deleted_ad_leaves_cached_list(self):
+        self.assertContains(self.client.get("/ads/"), "Première version")
+        self.ad.delete()
+        self.assertNotContains(self.client.get("/ads/"), "Première version")
+
+    def test_detail_dropped_when_ad_leaves_public_list(self):
+        self.client.get(f"/ads/{self.ad.slug}/")
+        self.assertIsNotNone(cache.get(f"ad_detail:{self.ad.slug}"))
+        self.ad.status = Ad.Status.REJECTED
+        self.ad.save()
+        self.assertEqual(self.client.get(f"/ads/{self.ad.slug}/").status_code, 404)
+        self.assertIsNone(cache.get(f"ad_detail:{self.ad.slug}"))
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class AdCardFragmentCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user()
+        self.city = make_city()
+        self.ad = make_ad(self.user, self.city, title="Carte en cache")
+
+    def _card(self):
+        return AdCard(AdFeedEntry.objects.get(ad=self.ad).card)
+
+    def test_fragment_reused_between_renders(self):
+        card = self._card()
+        render_cards([card])
+        self.assertIn("Carte en cache", card.html)
+        key = card_fragment_key(card, 1)
+        cache.set(key, "<a>depuis le cache</a>")
+        again = self._card()
+        render_cards([again])
+        self.assertEqual(again.html, "<a>depuis le cache</a>")
+
+    def test_save_changes_fragment_key(self):
+        before = card_fragment_key(self._card(), 1)
+        self.ad.title = "Nouveau titre"
+        self.ad.save()
+        self.assertNotEqual(card_fragment_key(self._card(), 1), before)
+
+    def test_author_verification_changes_fragment_key(self):
+        before = card_fragment_key(self._card(), 1)
+        self.user.is_verified = True
+        self.user.save(update_fields=["is_verified"])
+        card = self._card()
+        self.assertTrue(card.user_is_verified)
+        self.assertNotEqual(card_fragment_key(card, 1), before)
+
+    def test_city_rename_changes_fragment_key(self):
+        before = card_fragment_key(self._card(), 1)
+        self.city.name = "Abidjan-Plateau"
+        self.city.save()
+        card = self._card()
+        self.assertEqual(card.city_name, "Abidjan-Plateau")
+        self.assertNotEqual(card_fragment_key(card, 1), before)
+
+    def test_authenticated_list_uses_fragments(self):
+        self.client.force_login(self.user)
+        self.client.cookies["age_gate_accepted"] = "1"
+        cache.set(card_fragment_key(self._card(), 1), "<a>fragment-connecte</a>")
+        r = self.client.get("/ads/")
+        self.assertContains(r, "fragment-connecte")
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # VUE : ad_detail
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -375,6 +1308,21 @@ class AdDetailViewTest(TestCase):
         r = self.client.get(f"/ads/{ad.slug}/")
         self.assertNotContains(r, "Autre catégorie")
 
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_similar_ads_same_city_first_and_cached(self):
+        cache.clear()
+        other_city = make_city("Bouaké")
+        ad = make_ad(self.user, self.city, title="Principale")
+        far = make_ad(self.user, other_city, title="Autre ville")
+        near = make_ad(self.user, self.city, title="Même ville")
+        self.assertEqual([a.pk for a in similar_ads(ad)], [near.pk, far.pk])
+        with self.assertNumQueries(1):  # cartes par clé primaire uniquement
+            self.assertEqual([a.pk for a in similar_ads(ad)], [near.pk, far.pk])
+
+        # Une écriture du fil (approbation...) invalide les listes
+        newer = make_ad(self.user, other_city, title="Nouvelle")
+        self.assertEqual([a.pk for a in similar_ads(ad)], [near.pk, newer.pk, far.pk])
+
     def test_is_favorited_false_for_anonymous(self):
         ad = make_ad(self.user, self.city)
         r = self.client.get(f"/ads/{ad.slug}/")
@@ -389,6 +1337,230 @@ class AdDetailViewTest(TestCase):
         self.assertTrue(r.context["is_favorited"])
 
 
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class AdDetailPageFragmentsTest(TestCase):
+    """Fragments communs de la page détail, partagés entre anonymes et connectés."""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = make_user()
+        self.city = make_city()
+        self.ad = make_ad(self.owner, self.city, title="Annonce fragmentée")
+        self.visitor = make_user("visiteur", "visiteur@t.com")
+        self.client = Client()
+        self.client.cookies["age_gate_accepted"] = "1"
+
+    def test_blocks_rendered_without_user_parts(self):
+        page = build_detail_page(self.ad, [])
+        self.assertIn("Annonce fragmentée", page["title"])
+        self.assertIn(self.ad.slug, page["canonical_url"])
+        self.assertIn("Annonce fragmentée", page["content_head"])
+        self.assertNotIn(FAVORITE_HOLE, page["content_head"] + page["content_tail"])
+        self.assertNotIn("fav-btn", page["content_head"] + page["content_tail"] + page["extra_js"])
+        self.assertEqual(page["ad_id"], self.ad.pk)
+
+    def test_authenticated_view_reuses_fragments(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        self.client.get(f"/ads/{self.ad.slug}/")  # anonyme : construit les fragments
+        self.assertIsNotNone(cache.get(detail_page_key(self.ad.slug)))
+
+        self.client.force_login(self.visitor)
+        with CaptureQueriesContext(connection) as ctx:
+            r = self.client.get(f"/ads/{self.ad.slug}/")
+        self.assertContains(r, "Annonce fragmentée")
+        self.assertContains(r, 'id="fav-btn"')
+        self.assertFalse([q["sql"] for q in ctx.captured_queries if 'FROM "ads_ad"' in q["sql"]])
+
+    def test_favorite_hole_filled_per_user(self):
+        Favorite.objects.create(user=self.visitor, ad=self.ad)
+        self.client.force_login(self.owner)
+        r = self.client.get(f"/ads/{self.ad.slug}/")
+        self.assertFalse(r.context["is_favorited"])
+
+        self.client.force_login(self.visitor)
+        r = self.client.get(f"/ads/{self.ad.slug}/")
+        self.assertTrue(r.context["is_favorited"])
+        self.assertContains(r, 'fill="#ec4899"')
+
+    def test_anonymous_page_has_no_favorite_button(self):
+        self.client.force_login(self.visitor)
+        self.client.get(f"/ads/{self.ad.slug}/")
+        self.client.logout()
+        r = self.client.get(f"/ads/{self.ad.slug}/")
+        self.assertContains(r, "Annonce fragmentée")
+        self.assertNotContains(r, 'id="fav-btn"')
+
+    def test_fragments_dropped_when_ad_leaves_public_list(self):
+        self.client.force_login(self.visitor)
+        self.client.get(f"/ads/{self.ad.slug}/")
+        self.ad.status = Ad.Status.REJECTED
+        self.ad.save()
+        self.assertEqual(self.client.get(f"/ads/{self.ad.slug}/").status_code, 404)
+        self.assertIsNone(cache.get(detail_page_key(self.ad.slug)))
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ConditionalGetTest(TestCase):
+    """ETag / Last-Modified sur la page détail et la liste."""
+
+    def setUp(self):
+        cache.clear()
+        self.owner = make_user()
+        self.city = make_city()
+        self.ad = make_ad(self.owner, self.city, title="Annonce validée")
+        self.visitor = make_user("visiteur", "visiteur@t.com")
+        self.client = Client()
+        self.client.cookies["age_gate_accepted"] = "1"
+
+    def _revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+
+    def test_anonymous_detail_not_modified(self):
+        url = f"/ads/{self.ad.slug}/"
+        r = self.client.get(url)
+        self.assertIn("ETag", r)
+        self.assertIn("Last-Modified", r)
+        self.assertIn("must-revalidate", r["Cache-Control"])
+        self.assertEqual(self._revalidate(url, r).status_code, 304)
+        again = self.client.get(url, HTTP_IF_MODIFIED_SINCE=r["Last-Modified"])
+        self.assertEqual(again.status_code, 304)
+
+    def test_detail_changes_with_ad(self):
+        url = f"/ads/{self.ad.slug}/"
+        r = self.client.get(url)
+        self.ad.title = "Annonce modifiée"
+        self.ad.save()
+        again = self._revalidate(url, r)
+        self.assertEqual(again.status_code, 200)
+        self.assertContains(again, "Annonce modifiée")
+
+    def test_authenticated_detail_not_modified_without_rendering(self):
+        url = f"/ads/{self.ad.slug}/"
+        self.client.force_login(self.visitor)
+        r = self.client.get(url)
+        self.assertIn("private", r["Cache-Control"])
+        self.assertNotIn("Last-Modified", r)
+        with patch("ads.views.render") as render_mock:
+            self.assertEqual(self._revalidate(url, r).status_code, 304)
+        render_mock.assert_not_called()
+
+    def test_favorite_toggle_changes_detail_etag(self):
+        url = f"/ads/{self.ad.slug}/"
+        self.client.force_login(self.visitor)
+        r = self.client.get(url)
+        self.client.post(f"/ads/favorites/toggle/{self.ad.pk}/")
+        again = self._revalidate(url, r)
+        self.assertEqual(again.status_code, 200)
+        self.assertTrue(again.context["is_favorited"])
+
+    def test_anonymous_list_not_modified_until_feed_changes(self):
+        r = self.client.get("/ads/")
+        self.assertEqual(self._revalidate("/ads/", r).status_code, 304)
+        make_ad(self.owner, self.city, title="Nouvelle annonce")
+        again = self._revalidate("/ads/", r)
+        self.assertEqual(again.status_code, 200)
+        self.assertContains(again, "Nouvelle annonce")
+
+    def test_authenticated_list_not_modified_without_rendering(self):
+        self.client.force_login(self.visitor)
+        r = self.client.get("/ads/?city=abidjan")
+        with patch("ads.views.render") as render_mock:
+            self.assertEqual(self._revalidate("/ads/?city=abidjan", r).status_code, 304)
+        render_mock.assert_not_called()
+        self.assertEqual(self._revalidate("/ads/", r).status_code, 200)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    CDN_PURGE_BACKEND="core.cdn.LocalPurgeBackend",
+    CDN_S_MAXAGE=600,
+)
+class CdnCacheTagTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        LocalPurgeBackend.purged.clear()
+        self.user = make_user()
+        self.city = make_city()
+        self.ad = make_ad(self.user, self.city)
+        self.client = Client()
+        self.client.cookies["age_gate_accepted"] = "1"
+
+    def test_anonymous_detail_tagged(self):
+        r = self.client.get(f"/ads/{self.ad.slug}/")
+        tags = r["Cache-Tag"].split(",")
+        self.assertIn(f"ad-{self.ad.pk}", tags)
+        self.assertIn(f"city-{self.city.pk}", tags)
+        self.assertIn(f"cat-{self.ad.category}", tags)
+        self.assertEqual(r["Surrogate-Key"], " ".join(tags))
+        self.assertIn("s-maxage=600", r["Cache-Control"])
+        # Réponse servie depuis le cache serveur : mêmes en-têtes
+        self.assertEqual(self.client.get(f"/ads/{self.ad.slug}/")["Cache-Tag"], r["Cache-Tag"])
+
+    def test_anonymous_detail_sets_no_cookie(self):
+        r = self.client.get(f"/ads/{self.ad.slug}/")
+        self.assertNotIn("csrftoken", r.cookies)
+        self.assertNotContains(r, "csrfmiddlewaretoken\" value")
+        self.assertIn("s-maxage=600", r["Cache-Control"])
+
+    def test_response_setting_cookie_not_shared(self):
+        from django.http import HttpResponse
+
+        from core.cdn import SharedCacheCookieGuardMiddleware, tag_response
+
+        def view(request):
+            response = tag_response(HttpResponse("page"), ["list"])
+            response.set_cookie("csrftoken", "jeton")  # posé après la vue (middleware)
+            return response
+
+        r = SharedCacheCookieGuardMiddleware(view)(None)
+        self.assertNotIn("s-maxage", r["Cache-Control"])
+        self.assertIn("private", r["Cache-Control"])
+        self.assertNotIn("Cache-Tag", r)
+
+    def test_anonymous_list_tagged_by_filters(self):
+        r = self.client.get("/ads/")
+        self.assertEqual(r["Cache-Tag"], "list,list-all")
+        r = self.client.get(f"/ads/?city={self.city.slug}")
+        self.assertEqual(r["Cache-Tag"], f"city-{self.city.pk},list")
+
+    def test_authenticated_pages_not_tagged(self):
+        self.client.force_login(self.user)
+        for url in ("/ads/", f"/ads/{self.ad.slug}/"):
+            r = self.client.get(url)
+            self.assertNotIn("Cache-Tag", r)
+            self.assertNotIn("s-maxage", r["Cache-Control"])
+
+    def test_ad_save_purges_its_pages(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ad.title = "Nouveau titre"
+            self.ad.save()
+        for tag in (f"ad-{self.ad.pk}", f"city-{self.city.pk}", f"cat-{self.ad.category}", "list-all"):
+            self.assertIn(tag, LocalPurgeBackend.purged)
+
+    def test_ad_delete_purges_its_pages(self):
+        ad_id = self.ad.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ad.delete()
+        for tag in (f"ad-{ad_id}", f"city-{self.city.pk}", "list-all"):
+            self.assertIn(tag, LocalPurgeBackend.purged)
+
+    def test_unchanged_rows_not_purged(self):
+        other = make_ad(self.user, self.city, title="Autre annonce")
+        LocalPurgeBackend.purged.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            sync_feed([self.ad.pk, other.pk])
+            rebuild_feed()
+        self.assertEqual(list(LocalPurgeBackend.purged), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Ad.objects.filter(pk=other.pk).update(is_urgent=True)  # sans signal
+            sync_feed([self.ad.pk, other.pk])
+        self.assertIn(f"ad-{other.pk}", LocalPurgeBackend.purged)
+        self.assertNotIn(f"ad-{self.ad.pk}", LocalPurgeBackend.purged)
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # VUE : record_ad_view
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -399,18 +1571,22 @@ class RecordAdViewTest(TestCase):
         self.user = make_user()
         self.city = make_city()
         self.ad = make_ad(self.user, self.city)
+        cache.clear()  # clés anti-doublon (visiteur, annonce)
+        flush_view_counts()  # vues en attente laissées par d'autres tests
 
     def test_first_view_recorded(self):
         r = self.client.post(f"/ads/{self.ad.slug}/record-view/")
         self.assertEqual(r.status_code, 200)
         data = json.loads(r.content)
         self.assertTrue(data["recorded"])
+        flush_view_counts()
         self.ad.refresh_from_db()
         self.assertEqual(self.ad.views_count, 1)
 
     def test_duplicate_in_same_session_not_counted(self):
         self.client.post(f"/ads/{self.ad.slug}/record-view/")
         self.client.post(f"/ads/{self.ad.slug}/record-view/")
+        flush_view_counts()
         self.ad.refresh_from_db()
         self.assertEqual(self.ad.views_count, 1)
 
@@ -420,6 +1596,7 @@ class RecordAdViewTest(TestCase):
         data = json.loads(r.content)
         self.assertFalse(data["recorded"])
         self.assertEqual(data.get("reason"), "owner")
+        flush_view_counts()
         self.ad.refresh_from_db()
         self.assertEqual(self.ad.views_count, 0)
 
@@ -427,6 +1604,7 @@ class RecordAdViewTest(TestCase):
         u2 = make_user("u2", "u2@t.com")
         self.client.force_login(u2)
         self.client.post(f"/ads/{self.ad.slug}/record-view/")
+        flush_view_counts()
         self.ad.refresh_from_db()
         self.assertEqual(self.ad.views_count, 1)
 
@@ -443,6 +1621,182 @@ class RecordAdViewTest(TestCase):
         data = json.loads(r.content)
         self.assertTrue(data["ok"])
 
+    def test_view_is_written_behind_in_bulk(self):
+        other = make_ad(self.user, self.city, title="Autre")
+        with self.assertNumQueries(1):  # lecture id / auteur uniquement
+            self.client.post(f"/ads/{self.ad.slug}/record-view/")
+        self.client.post(f"/ads/{other.slug}/record-view/")
+        Client(HTTP_USER_AGENT="autre").post(f"/ads/{self.ad.slug}/record-view/")
+        self.ad.refresh_from_db()
+        self.assertEqual(self.ad.views_count, 0)
+        with self.assertNumQueries(1):
+            self.assertEqual(flush_view_counts(), 3)
+        self.ad.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.ad.views_count, other.views_count), (2, 1))
+        self.assertEqual(flush_view_counts(), 0)
+
+    def test_session_not_written(self):
+        self.client.post(f"/ads/{self.ad.slug}/record-view/")
+        self.assertNotIn("ad_views_recorded", self.client.session)
+
+    def test_visitor_cookie_set_once(self):
+        r = self.client.post(f"/ads/{self.ad.slug}/record-view/")
+        self.assertIn(VISITOR_COOKIE, r.cookies)
+        self.assertTrue(r.cookies[VISITOR_COOKIE]["httponly"])
+        r = self.client.post(f"/ads/{self.ad.slug}/record-view/")
+        self.assertNotIn(VISITOR_COOKIE, r.cookies)
+
+    def test_forwarded_for_rotation_not_counted(self):
+        for i in range(3):
+            Client(HTTP_X_FORWARDED_FOR=f"10.0.0.{i}").post(f"/ads/{self.ad.slug}/record-view/")
+        flush_view_counts()
+        self.ad.refresh_from_db()
+        self.assertEqual(self.ad.views_count, 1)
+
+    def test_same_ip_distinct_cookies_counted(self):
+        first, second = Client(), Client()
+        first.post(f"/ads/{self.ad.slug}/record-view/")  # pose le cookie
+        second.post(f"/ads/{self.ad.slug}/record-view/")  # même IP + UA, sans cookie : doublon
+        other = make_ad(self.user, self.city, title="Autre")
+        second.post(f"/ads/{other.slug}/record-view/")  # cookie maintenant posé
+        first.post(f"/ads/{other.slug}/record-view/")
+        flush_view_counts()
+        other.refresh_from_db()
+        self.assertEqual(other.views_count, 2)
+
+
+@override_settings(CACHES={"default": {
+    "BACKEND": "django.core.cache.backends.redis.RedisCache",
+    "LOCATION": "redis://127.0.0.1:6379/15",
+}})
+class RedisWriteBehindTest(TestCase):
+    """Avec RedisCache, les écritures différées passent par le client redis brut."""
+
+    def test_redis_branch_taken(self):
+        from .counters import redis_client
+        from .view_counter import record_view
+
+        client = MagicMock()
+        with patch("django.core.cache.backends.redis.RedisCacheClient.get_client", return_value=client):
+            self.assertIs(redis_client(), client)
+            record_view(42)
+        key, field, amount = client.hincrby.call_args.args
+        self.assertTrue(key.endswith("ad_views:pending"))
+        self.assertEqual((field, amount), ("42", 1))
+
+
+class BloomDedupeTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_first_seen_once_per_member(self):
+        self.assertTrue(first_seen("views", "v1", "42", 60))
+        self.assertFalse(first_seen("views", "v1", "42", 60))
+        self.assertTrue(first_seen("views", "v1", "43", 60))
+        self.assertTrue(first_seen("views", "v2", "42", 60))
+        self.assertTrue(first_seen("contacts", "v1", "42", 60))
+
+    def test_constant_size_per_visitor(self):
+        for ad_id in range(300):
+            first_seen("views", "v1", str(ad_id), 60)
+        expires_at, bits = cache.get("seen_bloom:views:v1")
+        self.assertEqual(len(bits), BLOOM_BITS // 8)
+        # Faux positifs rares à ce remplissage
+        fresh = sum(first_seen("views", "v1", f"autre-{i}", 60) for i in range(200))
+        self.assertGreaterEqual(fresh, 195)
+
+    def test_window_expires(self):
+        first_seen("views", "v1", "42", 60)
+        with patch("ads.dedupe.time.time", return_value=time.time() + 61):
+            self.assertTrue(first_seen("views", "v1", "42", 60))
+
+
+class RecordContactTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = make_user()
+        self.city = make_city()
+        self.ad = make_ad(self.user, self.city)
+        cache.clear()
+        flush_contact_clicks()
+
+    def _click(self, channel, client=None):
+        r = (client or self.client).post(f"/ads/{self.ad.slug}/contact/{channel}/")
+        return r.status_code, json.loads(r.content)
+
+    def test_clicks_flushed_per_channel_and_day(self):
+        self.assertTrue(self._click("whatsapp")[1]["recorded"])
+        self.assertFalse(self._click("whatsapp")[1]["recorded"])  # doublon
+        self._click("call")
+        self._click("whatsapp", Client(HTTP_USER_AGENT="autre"))
+        self.assertFalse(AdContactDaily.objects.exists())
+        self.assertEqual(flush_contact_clicks(), 3)
+        rows = dict(AdContactDaily.objects.filter(ad=self.ad).values_list("channel", "count"))
+        self.assertEqual(rows, {"whatsapp": 2, "call": 1})
+        self.assertEqual(contact_totals([self.ad.pk]), {self.ad.pk: {"whatsapp": 2, "call": 1}})
+
+        # Flush suivant : incrément de la ligne du jour existante
+        self._click("whatsapp", Client(HTTP_USER_AGENT="troisième"))
+        flush_contact_clicks()
+        self.assertEqual(AdContactDaily.objects.get(ad=self.ad, channel="whatsapp").count, 3)
+
+    def test_invalid_channel_owner_and_unknown_ad(self):
+        self.assertEqual(self._click("email")[0], 400)
+        self.client.force_login(self.user)
+        self.assertEqual(self._click("sms")[1].get("reason"), "owner")
+        r = self.client.post("/ads/nope/contact/sms/")
+        self.assertEqual(r.status_code, 404)
+        self.assertEqual(flush_contact_clicks(), 0)
+
+    def test_dashboard_shows_contact_totals(self):
+        self._click("sms")
+        flush_contact_clicks()
+        self.client.force_login(self.user)
+        r = self.client.get("/dashboard/")
+        self.assertContains(r, "1 contact (30 j)")
+
+
+class AdAnalyticsTest(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.city = make_city()
+        self.ad = make_ad(self.user, self.city)
+        cache.clear()
+        flush_events()  # événements laissés par d'autres tests (annonces supprimées : ignorés)
+
+    def test_events_rolled_up_per_day(self):
+        Client().post(f"/ads/{self.ad.slug}/record-view/")
+        Client(HTTP_USER_AGENT="autre").post(f"/ads/{self.ad.slug}/record-view/")
+        fan = make_user("fan", "fan@t.com")
+        self.client.force_login(fan)
+        self.client.post(f"/ads/favorites/toggle/{self.ad.pk}/")
+        AdContactDaily.objects.create(ad=self.ad, day=timezone.localdate(), channel="sms", count=3)
+        self.assertFalse(AdEvent.objects.exists())
+
+        self.assertEqual(flush_events(), 3)
+        self.assertEqual(rollup_daily_stats(), 1)
+        self.assertEqual(rollup_daily_stats(), 1)  # rejouable : valeurs remplacées
+        stats = AdDailyStats.objects.get(ad=self.ad, day=timezone.localdate())
+        self.assertEqual((stats.views, stats.contacts, stats.favorites), (2, 3, 1))
+
+        series = daily_series([self.ad.pk])[self.ad.pk]
+        self.assertEqual(len(series), CHART_DAYS)
+        self.assertEqual(series[-1]["views"], 2)
+        self.assertEqual(series[0]["views"], 0)
+
+    def test_old_raw_events_purged(self):
+        AdEvent.objects.create(ad=self.ad, kind=AdEvent.Kind.VIEW, created_at=timezone.now() - timedelta(days=8))
+        AdEvent.objects.create(ad=self.ad, kind=AdEvent.Kind.VIEW, created_at=timezone.now())
+        rollup_daily_stats()
+        self.assertEqual(AdEvent.objects.count(), 1)
+
+    def test_dashboard_renders_chart(self):
+        AdDailyStats.objects.create(ad=self.ad, day=timezone.localdate(), views=5, contacts=1)
+        self.client.force_login(self.user)
+        r = self.client.get("/dashboard/")
+        self.assertContains(r, "5 vues, 1 contact, 0 favori")
+
 
 # ═══════════════════════════════════════════════════════════════════════════════
 # VUE : toggle_favorite
@@ -496,6 +1850,52 @@ class ToggleFavoriteTest(TestCase):
         self.assertEqual(r.status_code, 200)
 
 
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class FavoriteIdSetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user()
+        self.city = make_city()
+        self.ad = make_ad(self.user, self.city, title="Favorite")
+        self.other = make_ad(self.user, self.city, title="Autre")
+        self.fan = make_user("fan", "fan@t.com")
+
+    def test_loaded_once_then_read_from_cache(self):
+        Favorite.objects.create(user=self.fan, ad=self.ad)
+        self.assertEqual(favorite_ids(self.fan.pk), {self.ad.pk})
+        with self.assertNumQueries(0):
+            self.assertEqual(favorited_among(self.fan.pk, [self.ad.pk, self.other.pk]), {self.ad.pk})
+
+    def test_toggle_updates_cached_set(self):
+        favorite_ids(self.fan.pk)  # ensemble chargé (vide)
+        self.client.force_login(self.fan)
+        self.client.post(f"/ads/favorites/toggle/{self.other.pk}/")
+        with self.assertNumQueries(0):
+            self.assertEqual(favorite_ids(self.fan.pk), {self.other.pk})
+        self.client.post(f"/ads/favorites/toggle/{self.other.pk}/")
+        self.assertEqual(favorite_ids(self.fan.pk), set())
+
+    def test_annotate_favorites(self):
+        Favorite.objects.create(user=self.fan, ad=self.other)
+        cards = [AdCard.from_ad(self.ad), AdCard.from_ad(self.other)]
+        annotate_favorites(self.fan, cards)
+        self.assertEqual([c.is_favorited for c in cards], [False, True])
+
+        anonymous = MagicMock(is_authenticated=False)
+        with self.assertNumQueries(0):
+            annotate_favorites(anonymous, cards)
+        self.assertEqual([c.is_favorited for c in cards], [False, False])
+
+    def test_list_shows_favorite_state(self):
+        Favorite.objects.create(user=self.fan, ad=self.other)
+        self.client.force_login(self.fan)
+        self.client.cookies["age_gate_accepted"] = "1"
+        r = self.client.get("/ads/")
+        favorited = {card.id: card.is_favorited for card in r.context["ads"]}
+        self.assertEqual(favorited, {self.ad.pk: False, self.other.pk: True})
+        self.assertContains(r, "Dans vos favoris", count=1)
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # VUE : search_suggestions
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -544,6 +1944,83 @@ class SearchSuggestionsTest(TestCase):
         self.assertLessEqual(len(data["suggestions"]), 15)
 
 
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class SuggestionIndexTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user()
+        self.city = make_city()
+        self.ad = make_ad(self.user, self.city, title="Massage Érotique Cocody")
+        rebuild_suggestion_index()
+
+    def test_word_prefix_and_accent_folding(self):
+        self.assertEqual(suggest_titles("eroti"), ["Massage Érotique Cocody"])
+        self.assertEqual(suggest_titles("COCO"), ["Massage Érotique Cocody"])
+        self.assertEqual(suggest_titles("zzz"), [])
+
+    def test_served_without_database(self):
+        suggest_titles("mass")
+        with self.assertNumQueries(0):
+            self.assertEqual(suggest_titles("mass"), ["Massage Érotique Cocody"])
+
+    def test_incremental_updates_on_approval_and_rejection(self):
+        other = make_ad(self.user, self.city, title="Massage tantrique", status=Ad.Status.PENDING)
+        self.assertEqual(suggest_titles("tantr"), [])
+        other.status = Ad.Status.APPROVED
+        other.save(update_fields=["status"])
+        with self.assertNumQueries(0):
+            self.assertEqual(suggest_titles("tantr"), ["Massage tantrique"])
+        other.status = Ad.Status.REJECTED
+        other.save(update_fields=["status"])
+        self.assertEqual(suggest_titles("tantr"), [])
+
+    def test_same_visibility_as_public_list(self):
+        other = make_ad(self.user, self.city, title="Massage tantrique", image_processing_done=False)
+        self.assertEqual(suggest_titles("tantr"), [])
+        other.image_processing_done = True
+        other.save(update_fields=["image_processing_done"])
+        self.assertEqual(suggest_titles("tantr"), ["Massage tantrique"])
+        other.status = Ad.Status.EXPIRED  # toujours listée
+        other.save(update_fields=["status"])
+        self.assertEqual(suggest_titles("tantr"), ["Massage tantrique"])
+
+    def test_save_writes_a_delta_not_the_index(self):
+        snapshot = cache.get("suggest_index:titles")
+        make_ad(self.user, self.city, title="Massage tantrique")
+        self.assertEqual(cache.get("suggest_index:titles"), snapshot)
+        self.assertEqual(suggest_titles("tantr"), ["Massage tantrique"])
+
+    def test_shared_title_kept_until_last_ad_leaves(self):
+        twin = make_ad(self.user, self.city, title="Massage Érotique Cocody")
+        self.ad.delete()
+        self.assertEqual(suggest_titles("cocody"), ["Massage Érotique Cocody"])
+        twin.delete()
+        self.assertEqual(suggest_titles("cocody"), [])
+
+    def test_other_process_rebuilds_from_shared_cache(self):
+        from . import suggestions
+
+        suggestions._local.update(seq=None, titles=None, counts={}, index=[])
+        with self.assertNumQueries(0):
+            self.assertEqual(suggest_titles("massage"), ["Massage Érotique Cocody"])
+
+    def test_cold_rebuild_single_flight(self):
+        from . import suggestions
+
+        cache.delete("suggest_index:titles")
+        suggestions._local.update(seq=None, titles=None, counts={}, index=[])  # nouveau processus
+        acquire_lock("suggest_index:titles")  # un autre worker lit la base
+        with self.assertNumQueries(0):
+            self.assertEqual(suggest_titles("massage"), [])
+
+    def test_evicted_delta_reloads_from_database(self):
+        suggest_titles("mass")
+        make_ad(self.user, self.city, title="Massage tantrique")
+        cache.delete(f"suggest_index:delta:{cache.get('suggest_index:seq')}")  # évincé
+        self.assertEqual(suggest_titles("tantr"), [])  # écriture peut-être en cours : on attend
+        self.assertEqual(suggest_titles("tantr"), ["Massage tantrique"])  # perdu : relu en base
+
+
 # ═══════════════════════════════════════════════════════════════════════════════
 # TÂCHES CELERY
 # ═══════════════════════════════════════════════════════════════════════════════
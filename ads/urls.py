@@ -50,6 +50,7 @@ urlpatterns = [
     *_seo_patterns,
     path("<slug:slug>/", views.ad_detail, name="ad_detail"),
     path("<slug:slug>/record-view/", views.record_ad_view, name="record_ad_view"),
+    path("<slug:slug>/contact/<str:channel>/", views.record_contact, name="record_contact"),
     # Crons Vercel
     path("cron/watermarks/", views.cron_apply_watermarks, name="cron_apply_watermarks"),
     path("cron/bump/", views.cron_bump_ads, name="cron_bump_ads"),
@@ -0,0 +1,49 @@
+"""
+Compteur de vues différé (write-behind) pour record_ad_view.
+
+Une vue n'écrit plus dans ads_ad : elle incrémente un compteur en attente
+(ads.counters.PendingCounter), reporté en masse dans Ad.views_count par
+flush_view_counts(). Plus de verrou de ligne par vue sur les annonces très
+consultées.
+
+Anti-doublon : filtre de Bloom par visiteur (ads.dedupe), au lieu d'une liste
+d'ids dans la session qui grossissait sans limite.
+"""
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .counters import PendingCounter
+from .dedupe import first_seen_by
+from .models import Ad
+
+FLUSH_BATCH = 500
+VIEW_DEDUPE_TTL = 24 * 3600  # une vue par visiteur et par annonce et par jour
+
+
+def is_first_view(visitors, ad_id: int) -> bool:
+    """True une seule fois par (visiteur, annonce) pendant VIEW_DEDUPE_TTL (filtre de Bloom)."""
+    return first_seen_by("views", visitors, str(ad_id), VIEW_DEDUPE_TTL)
+
+
+def _apply(counts: dict) -> None:
+    """Ajoute les vues à Ad.views_count : un UPDATE ... CASE par lot de FLUSH_BATCH annonces."""
+    items = sorted((int(ad_id), n) for ad_id, n in counts.items())
+    for start in range(0, len(items), FLUSH_BATCH):
+        batch = items[start:start + FLUSH_BATCH]
+        increment = Case(
+            *[When(pk=ad_id, then=Value(n)) for ad_id, n in batch],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+        Ad.objects.filter(pk__in=[ad_id for ad_id, _ in batch]).update(views_count=F("views_count") + increment)
+
+
+_views = PendingCounter("ad_views", _apply)
+
+
+def record_view(ad_id: int) -> None:
+    _views.incr(str(ad_id))
+
+
+def flush_view_counts() -> int:
+    """Reporte les vues en attente dans la base. Retourne le nombre de vues écrites."""
+    return _views.flush()
@@ -1,18 +1,118 @@
-import time as _time
+import hashlib
 
 from django.shortcuts import render, get_object_or_404
 from django.http import HttpRequest, HttpResponse, JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.conf import settings
-from django.db.models import Q, F, Case, When, Value, IntegerField
+from django.db.models import Case, When, Value, IntegerField, Prefetch
 from django.core.cache import cache
-from django.db import connection
 from django.core.paginator import Paginator
 from django.views.decorators.http import require_POST, require_GET
 from django.views.decorators.cache import cache_page
 from django.views.decorators.csrf import csrf_exempt
-from .models import Ad, AdMedia, City, Favorite
-from core.context_processors import get_ad_list_version
+from .models import Ad, AdEvent, AdFeedEntry, City, Favorite
+from .analytics import record_event
+from .batch import drain_pending_watermarks
+from .contacts import CHANNELS as CONTACT_CHANNELS, is_first_click, record_contact_click
+from .dedupe import visitor_cookie, visitor_keys
+from .detail_page import DETAIL_PAGE_TTL, build_detail_page, detail_page_key, detail_scope_key
+from .facets import get_listing_facets
+from .favorites import annotate_favorites, favorite_ids, favorited_among, update_favorite
+from .feed import FEED_KEYS, AdCard, list_cache_ttl, render_cards, sync_feed
+from .pagination import KeysetPaginator, WindowKeysetPaginator, is_valid_cursor
+from .similar import similar_ads
+from .suggestions import MAX_SUGGESTIONS, suggest_titles
+from .view_counter import is_first_view, record_view
+from .search import (
+    SEARCH_KEYS,
+    SearchResults,
+    apply_search,
+    cached_search_hits,
+    normalize_query,
+    search_cache_key,
+)
+from core.cache_utils import SWR_GRACE, release_lock, swr_delete, swr_get, swr_set
+from core.cdn import list_tags, tag_response
+from core.http_cache import cached_conditional, not_modified, page_etag, set_validators
+from core.context_processors import get_list_version
+
+
+def _cursor_query(**params) -> str:
+    """Paramètres de filtre à reporter sur les liens de pagination par curseur."""
+    from urllib.parse import urlencode
+
+    kept = {k: v for k, v in params.items() if v}
+    return "&" + urlencode(kept) if kept else ""
+
+
+def _feed_queryset(city, selected_city, category, provider, boost):
+    """Lignes du fil public (AdFeedEntry) correspondant aux filtres, dans l'ordre de la liste."""
+    qs = AdFeedEntry.objects.only("rank", "card", "next_change_at")
+    if city:
+        if selected_city is None:
+            return qs.none()
+        qs = qs.filter(city_id=selected_city.pk)
+    if category:
+        qs = qs.filter(category=category)
+    if provider:
+        # Uniquement par username — l'ID est refusé en amont (prévient l'énumération)
+        qs = qs.filter(user__username=provider)
+    if boost:
+        # Filtre boost : uniquement les annonces approuvées correspondantes
+        qs = qs.filter(is_approved=True)
+        if boost == "urgent":
+            qs = qs.filter(is_urgent=True)
+        elif boost == "premium":
+            qs = qs.filter(is_premium=True)
+        elif boost == "boosted":
+            qs = qs.filter(is_boosted=True)
+    return qs.order_by("-rank")
+
+
+def _ads_for_hits(hits):
+    """Annonces d'une page de résultats de recherche, dans l'ordre des résultats."""
+    ads = (
+        Ad.objects.filter(pk__in=[hit.id for hit in hits])
+        .cards("description_sanitized", "user__is_verified")
+        .in_bulk()
+    )
+    return [ads[hit.id] for hit in hits if hit.id in ads]
+
+
+def _search_queryset(q, city, category, provider, boost):
+    """Recherche plein texte sur Ad, triée par statut, urgence puis pertinence."""
+    qs = Ad.objects.all()
+    if boost:
+        # Filtre boost : uniquement les annonces approuvées correspondantes
+        qs = qs.filter(status=Ad.Status.APPROVED, image_processing_done=True)
+        if boost == "urgent":
+            qs = qs.filter(is_urgent=True)
+        elif boost == "premium":
+            qs = qs.filter(is_premium=True)
+        elif boost == "boosted":
+            qs = qs.filter(is_boosted=True)
+    else:
+        qs = qs.filter(status__in=[Ad.Status.APPROVED, Ad.Status.EXPIRED], image_processing_done=True)
+    if city:
+        qs = qs.filter(city__slug=city)
+    if category:
+        qs = qs.filter(category=category)
+    if provider:
+        qs = qs.filter(user__username=provider)
+
+    # Plein texte (tsvector / FTS5, cf. ads/search.py) avec annotation de pertinence
+    qs = apply_search(qs, q)
+
+    # Annonces triées : approuvées d'abord, urgentes, puis pertinence et ordre de la liste.
+    # Les annotations _status_order et _search_rank sont des clés du curseur (SEARCH_KEYS).
+    status_order = Case(
+        When(status=Ad.Status.APPROVED, then=Value(0)),
+        default=Value(1),
+        output_field=IntegerField(),
+    )
+    return qs.annotate(_status_order=status_order).order_by(
+        "_status_order", "-is_urgent", "-_search_rank", "-bumped_at", "-created_at", "-id"
+    )
 
 
 @require_GET
@@ -30,80 +130,55 @@ def ad_list(request: HttpRequest) -> HttpResponse:
         page = max(1, min(int(request.GET.get("page", "1")), 500))
     except (ValueError, TypeError):
         page = 1
+    # Pagination par curseur (keyset) par défaut : pas de COUNT(*), pas d'OFFSET.
+    # ?page=N (N > 1) reste servi par le Paginator classique pour les URLs déjà indexées.
+    cursor = request.GET.get("cursor", "").strip()[:512]
+    use_cursor = page == 1
     q = request.GET.get("q", "").strip()
     boost = request.GET.get("boost", "").strip()  # urgent | premium | boosted
 
-    # Bucket de 5 minutes : la rotation des annonces boostées change toutes les 5 min.
-    time_bucket = int(_time.time() / 300)
-
     # Cache uniquement pour les utilisateurs anonymes (évite de servir la nav
-    # "Se connecter" aux utilisateurs connectés). La clé inclut time_bucket pour
-    # que la rotation 2 min invalide automatiquement le cache.
+    # "Se connecter" aux utilisateurs connectés). Tout changement d'une ligne du fil
+    # incrémente la version de sa ville / catégorie (list_scope) ; le TTL de la page
+    # est calculé à partir de son contenu (plus bas).
+    # Stale-while-revalidate : une page périmée (TTL ou version) reste servie pendant
+    # qu'un seul worker la régénère.
+    # Page par curseur : clé = empreinte du curseur, et seulement pour un curseur signé
+    # par le site (un curseur falsifié ou illisible sert la première page, sans cache).
     cache_key = None
+    version = get_list_version(city, category)
     if not q and not request.user.is_authenticated:
-        version = get_ad_list_version()
-        cache_key = f"ad_list:v{version}:{city}:{category}:{provider}:{boost}:{page}:{time_bucket}"
-        cached = cache.get(cache_key)
-        if cached is not None:
-            return cached
-
-    common_qs = (
-        Ad.objects
-        .select_related("city", "user", "user__profile")
-        .prefetch_related("media")
-    )
-
-    def apply_filters(qs):
-        if city:
-            qs = qs.filter(city__slug=city)
-        if category:
-            qs = qs.filter(category=category)
-        if provider:
-            # Uniquement par username — l'ID est refusé en amont (prévient l'énumération)
-            qs = qs.filter(user__username=provider)
-        if q:
-            q_search = Q(title__icontains=q) | Q(description_sanitized__icontains=q)
-            # JSON array contains — supported on PostgreSQL, not SQLite
-            _supports_json_contains = connection.vendor == "postgresql"
-            for sub in Ad.SUBCATEGORY_CHOICES:
-                if q.lower() in sub.lower():
-                    if _supports_json_contains:
-                        q_search |= Q(subcategories__contains=[sub])
-                    else:
-                        q_search |= Q(subcategories__icontains=sub)
-            qs = qs.filter(q_search)
-        return qs
-
-    # Annonces triées : approuvées d'abord (urgent > bumped_at), expirées en bas.
-    # On utilise une annotation CASE pour déléguer l'ordre à la DB (évite list() en RAM).
-    if boost:
-        # Filtre boost : uniquement les annonces approuvées correspondantes
-        base_approved = common_qs.filter(status=Ad.Status.APPROVED, image_processing_done=True)
-        if boost == "urgent":
-            base_approved = base_approved.filter(is_urgent=True)
-        elif boost == "premium":
-            base_approved = base_approved.filter(is_premium=True)
-        elif boost == "boosted":
-            base_approved = base_approved.filter(is_boosted=True)
-        final_qs = apply_filters(
-            base_approved.order_by("-is_urgent", "-bumped_at", "-created_at")
-        )
+        if not use_cursor:
+            page_key = page
+        elif not cursor:
+            page_key = "c"
+        elif is_valid_cursor(cursor, FEED_KEYS):
+            page_key = "c" + hashlib.sha1(cursor.encode("utf-8")).hexdigest()
+        else:
+            page_key = None
+        if page_key is not None:
+            cache_key = f"ad_list:{city}:{category}:{provider}:{boost}:{page_key}"
+            cached, regenerate = swr_get(cache_key, version)
+            if cached is not None and not regenerate:
+                return cached_conditional(request, cached)
+            if not regenerate:
+                # Page absente, déjà calculée par un autre worker : rendue sans cache
+                cache_key = None
+
+    # Villes et compteurs de la sidebar : un seul calcul coalescé (cf. ads/facets.py)
+    facets = get_listing_facets()
+
+    # Validateurs : URL complète, version de la liste, état des facettes et, pour un
+    # connecté, ses favoris (cœurs sur les cartes). Sans cache de page : 304 avant tout rendu.
+    if request.user.is_authenticated:
+        viewer = "u" + ",".join(str(pk) for pk in sorted(favorite_ids(request.user.pk)))
     else:
-        # Liste complète : approuvées puis expirées, ordre géré par la DB
-        from django.db.models import Case, When, Value, IntegerField as _IntField
-        all_visible = common_qs.filter(
-            status__in=[Ad.Status.APPROVED, Ad.Status.EXPIRED],
-            image_processing_done=True,
-        ).annotate(
-            _status_order=Case(
-                When(status=Ad.Status.APPROVED, then=Value(0)),
-                default=Value(1),
-                output_field=_IntField(),
-            )
-        )
-        final_qs = apply_filters(all_visible).order_by(
-            "_status_order", "-is_urgent", "-bumped_at", "-created_at"
-        )
+        viewer = "anon"
+    etag = page_etag("list", request.get_full_path(), version, facets.get("state", ""), viewer)
+    if cache_key is None:
+        response = not_modified(request, etag, private=request.user.is_authenticated)
+        if response is not None:
+            return response
 
     selected_city = None
     selected_category = None
@@ -115,68 +190,77 @@ def ad_list(request: HttpRequest) -> HttpResponse:
     if category:
         selected_category = category
 
-    paginator = Paginator(final_qs, 10)
-    page_obj = paginator.get_page(page)
-
-    cities = cache.get("all_cities")
-    if cities is None:
-        cities = list(City.objects.all())
-        cache.set("all_cities", cities, 86400)  # 24h
-
-    _visible_statuses = [Ad.Status.APPROVED, Ad.Status.EXPIRED]
-
-    total_approved_ads = cache.get("total_approved_ads_count")
-    if total_approved_ads is None:
-        total_approved_ads = Ad.objects.filter(status__in=_visible_statuses).count()
-        cache.set("total_approved_ads_count", total_approved_ads, 300)
-
-    city_counts = cache.get("city_ad_counts")
-    if city_counts is None:
-        from django.db.models import Count as _Count
-        city_counts = list(
-            City.objects
-            .annotate(ad_count=_Count(
-                "ad",
-                filter=Q(ad__status__in=_visible_statuses)
-            ))
-            .filter(ad_count__gt=0)
-            .order_by("-ad_count")[:12]
+    if q:
+        # Recherche : requête sur Ad (le fil précalculé ne contient pas le texte intégral).
+        # La liste ordonnée des résultats est mise en cache par requête normalisée + filtres
+        # (invalidée par la version de la liste) ; seule la page affichée est chargée.
+        search_q = normalize_query(q)
+        hits_key = search_cache_key(version, search_q, city, category, provider, boost)
+        results = (
+            cached_search_hits(_search_queryset(search_q, city, category, provider, boost), hits_key)
+            if search_q
+            else SearchResults([], Ad.objects.none())
         )
-        cache.set("city_ad_counts", city_counts, 300)
-
-    category_counts = cache.get("category_ad_counts")
-    if category_counts is None:
-        from django.db.models import Count as _Count
-        category_counts = dict(
-            Ad.objects.filter(status__in=_visible_statuses)
-            .values("category")
-            .annotate(n=_Count("id"))
-            .values_list("category", "n")
-        )
-        cache.set("category_ad_counts", category_counts, 300)
+        if use_cursor:
+            # Au-delà des résultats en cache, les pages suivantes sont lues en base
+            page_obj = WindowKeysetPaginator(
+                results.hits, results.queryset, 10, keys=SEARCH_KEYS, complete=results.complete
+            ).get_page(cursor)
+        else:
+            page_obj = Paginator(results, 10).get_page(page)
+        page_obj.object_list = _ads_for_hits(page_obj.object_list)
+    else:
+        # Liste : lecture directe du fil précalculé (une plage d'index sur rank)
+        final_qs = _feed_queryset(city, selected_city, category, provider, boost)
+        if use_cursor:
+            paginator = KeysetPaginator(final_qs, 10, keys=FEED_KEYS)
+            page_obj = paginator.get_page(cursor)
+            if cache_key is not None and cursor and not paginator.boundary_exists(cursor):
+                # Ligne de bord disparue (ou jamais listée) : page servie sans être mise en cache
+                release_lock(cache_key)
+                cache_key = None
+        else:
+            page_obj = Paginator(final_qs, 10).get_page(page)
+
+    # Lignes affichées + ligne juste sous la coupure (elle remonte si l'une d'elles sort)
+    ttl_entries = list(page_obj.object_list) + [getattr(page_obj, "boundary", None)]
+    to_card = AdCard.from_ad if q else (lambda entry: AdCard(entry.card))
+    page_obj.object_list = [to_card(obj) for obj in page_obj.object_list]
+    # HTML des cartes depuis le cache de fragments : seule la nav dépend de l'utilisateur,
+    # les pages des utilisateurs connectés sont assemblées sans re-rendre chaque carte.
+    render_cards(page_obj.object_list)
+    # État favori de toute la page en un aller-retour (hors du HTML partagé des cartes)
+    annotate_favorites(request.user, page_obj.object_list)
 
     response = render(
         request,
         "ads/list.html",
         {
             "ads": page_obj,
-            "cities": cities,
+            "cities": facets["cities"],
             "page_obj": page_obj,
             "is_paginated": page_obj.has_other_pages(),
+            "cursor_pagination": use_cursor,
+            "cursor_query": _cursor_query(q=q, city=city, category=category, provider=provider, boost=boost),
             "selected_city": selected_city,
             "selected_category": selected_category,
             "category_choices": Ad.Category.choices,
             "seo_city_text": getattr(request, "_seo_city_text", ""),
-            "total_approved_ads": total_approved_ads,
-            "city_counts": city_counts,
-            "category_counts": category_counts,
+            "total_approved_ads": facets["total_approved_ads"],
+            "city_counts": facets["city_counts"],
+            "category_counts": facets["category_counts"],
         },
     )
 
+    set_validators(response, etag, private=request.user.is_authenticated)
+    if not request.user.is_authenticated:
+        tag_response(response, list_tags(selected_city.pk if selected_city else None, category))
+
     if cache_key is not None:
-        # TTL aligné sur le bucket de 2 min (120s) pour que le cache ne survive pas
-        # à la prochaine rotation de positions.
-        cache.set(cache_key, response, 120)
+        # La page vit exactement jusqu'au prochain changement d'état prévu de ses
+        # annonces (fin premium / urgent, expiration, remontée due...).
+        swr_set(cache_key, response, list_cache_ttl(ttl_entries), version)
+        return cached_conditional(request, response)
 
     return response
 
@@ -237,11 +321,6 @@ def search_suggestions(request: HttpRequest) -> JsonResponse:
     if len(q) < 2:
         return JsonResponse({"suggestions": []})
 
-    cache_key = f"search_suggestions_{q.lower()}"
-    cached = cache.get(cache_key)
-    if cached is not None:
-        return JsonResponse({"suggestions": cached})
-
     q_lower = q.lower()
     suggestions = []
 
@@ -255,99 +334,162 @@ def search_suggestions(request: HttpRequest) -> JsonResponse:
         if q_lower in sub.lower() and sub not in [s.get("label") for s in suggestions]:
             suggestions.append({"type": "subcategory", "label": sub, "value": sub})
 
-    # Titres d'annonces qui contiennent la requête (max 8)
-    title_matches = (
-        Ad.objects.filter(status=Ad.Status.APPROVED, title__icontains=q)
-        .values_list("title", flat=True)
-        .distinct()[:8]
-    )
-    for title in title_matches:
+    # Titres d'annonces approuvées dont un mot commence par la requête (max 8) :
+    # index en mémoire partagé via le cache (ads/suggestions.py), sans requête SQL.
+    for title in suggest_titles(q):
         if title and title not in [s.get("label") for s in suggestions]:
             suggestions.append({"type": "title", "label": title[:60] + ("…" if len(title) > 60 else ""), "value": title})
 
-    result = suggestions[:15]
-    cache.set(cache_key, result, 300)  # 5 min
-    return JsonResponse({"suggestions": result})
+    return JsonResponse({"suggestions": suggestions[:MAX_SUGGESTIONS]})
 
 
 def ad_detail(request: HttpRequest, slug: str) -> HttpResponse:
-    # Cache uniquement pour les utilisateurs anonymes.
-    # Le HTML rendu contient la nav (user.is_authenticated) : mettre en cache pour tous
-    # ferait apparaître "Se connecter" aux utilisateurs connectés.
+    # Réponse complète en cache uniquement pour les utilisateurs anonymes : le HTML
+    # contient la nav (user.is_authenticated) et le bouton favori.
+    # Pour tous, le contenu de la page (ads.detail_page) est un jeu de fragments en
+    # cache commun : un connecté ne rend que la coquille et ses « trous ».
+    # Stale-while-revalidate, versionné comme les listes de la catégorie de l'annonce
+    # (l'annonce et ses similaires), mémorisée à la construction de la page. Catégorie
+    # inconnue : version None, l'entrée en cache est périmée et un seul worker la régénère.
+    category = cache.get(detail_scope_key(slug))
+    version = get_list_version(category=category) if category else None
+    cache_key = None
     if not request.user.is_authenticated:
         cache_key = f"ad_detail:{slug}"
-        cached = cache.get(cache_key)
-        if cached is not None:
-            return cached
-
-    # Une seule requête : fetch l'annonce et décide ensuite selon son statut
-    ad = (
-        Ad.objects.filter(slug=slug)
-        .select_related("city", "user", "user__profile")
-        .prefetch_related("media")
-        .first()
-    )
-    if not ad:
-        from django.http import Http404
-        raise Http404
-
-    if ad.status == Ad.Status.ARCHIVED:
-        from django.template.loader import render_to_string
-        return HttpResponse(
-            render_to_string("core/404.html", {"reason": "expired"}, request=request),
-            status=410,
-            content_type="text/html",
+        cached, regenerate = swr_get(cache_key, version)
+        if cached is not None and not regenerate:
+            return cached_conditional(request, cached)
+        if not regenerate:
+            # Page absente, déjà calculée par un autre worker : rendue sans cache
+            cache_key = None
+
+    page_key = detail_page_key(slug)
+    page, regenerate = swr_get(page_key, version)
+    if page is None or regenerate:
+        # Une seule requête : fetch l'annonce et décide ensuite selon son statut
+        ad = (
+            Ad.objects.filter(slug=slug)
+            .select_related("city", "user", "user__profile")
+            .prefetch_related("media")
+            .first()
+        )
+        is_public = (
+            ad is not None
+            and ad.status in [Ad.Status.APPROVED, Ad.Status.EXPIRED]
+            and ad.image_processing_done
         )
+        if not is_public:
+            # L'annonce n'est plus publique : ne plus servir l'ancienne page en cache
+            swr_delete(page_key)
+            if cache_key is not None:
+                swr_delete(cache_key)
+
+        if not ad:
+            from django.http import Http404
+            raise Http404
+
+        if ad.status == Ad.Status.ARCHIVED:
+            from django.template.loader import render_to_string
+            return HttpResponse(
+                render_to_string("core/404.html", {"reason": "expired"}, request=request),
+                status=410,
+                content_type="text/html",
+            )
 
-    if ad.status not in [Ad.Status.APPROVED, Ad.Status.EXPIRED] or not ad.image_processing_done:
-        from django.http import Http404
-        raise Http404
+        if not is_public:
+            from django.http import Http404
+            raise Http404
 
-    # Annonces similaires : une seule requête (même catégorie, priorité même ville)
-    similar_ads = (
-        Ad.objects.filter(status__in=[Ad.Status.APPROVED, Ad.Status.EXPIRED], image_processing_done=True, category=ad.category)
-        .exclude(id=ad.id)
-        .select_related("city", "user", "user__profile")
-        .prefetch_related("media")
-        .annotate(same_city=Case(When(city_id=ad.city_id, then=Value(1)), default=Value(0), output_field=IntegerField()))
-        .order_by("-same_city", "-created_at")[:5]
-    )
+        # Annonces similaires : ids précalculés par (catégorie, ville), cartes lues par clé primaire
+        version = get_list_version(category=ad.category)
+        page = build_detail_page(ad, similar_ads(ad))
+        page["version"] = version
+        if regenerate:
+            swr_set(page_key, page, DETAIL_PAGE_TTL, version)
+            cache.set(detail_scope_key(slug), ad.category, DETAIL_PAGE_TTL + SWR_GRACE)
 
+    # État favori lu dans l'ensemble des favoris en cache (ads.favorites)
     is_favorited = (
         request.user.is_authenticated
-        and Favorite.objects.filter(user=request.user, ad=ad).exists()
+        and bool(favorited_among(request.user.pk, [page["ad_id"]]))
     )
 
-    response = render(request, "ads/detail.html", {"ad": ad, "similar_ads": similar_ads, "is_favorited": is_favorited})
+    # Validateurs : annonce et similaires (page["state"]), footer (facettes), état favori.
+    # Connecté : 304 avant tout rendu (ETag seul, la page dépend aussi de ses favoris) ;
+    # anonyme : la réponse rendue est mise en cache avec ses validateurs.
+    etag = page_etag(
+        "detail", page.get("state", ""), get_listing_facets().get("state", ""),
+        "anon" if cache_key is not None else ("fav" if is_favorited else "user"),
+    )
+    if cache_key is None:
+        response = not_modified(request, etag, private=True)
+        if response is not None:
+            return response
+
+    response = render(request, "ads/detail.html", {"page": page, "is_favorited": is_favorited})
+    if cache_key is None:
+        set_validators(response, etag, private=True)
+    else:
+        set_validators(response, etag, page.get("modified_at"))
+        tag_response(response, page.get("cdn_tags", []))
 
-    if not request.user.is_authenticated:
-        cache.set(f"ad_detail:{slug}", response, 120)  # 2 min, anonymes seulement
+    if cache_key is not None:
+        # Version des fragments utilisés : une page bâtie sur des fragments périmés
+        # (régénérés par un autre worker) reste elle-même périmée
+        swr_set(cache_key, response, DETAIL_PAGE_TTL, page["version"])
+        return cached_conditional(request, response)
 
     return response
 
 
 @csrf_exempt
 @require_POST
+@visitor_cookie
 def record_ad_view(request: HttpRequest, slug: str) -> JsonResponse:
     """
     Enregistre une vue pour l'annonce (appelé côté client après 5 secondes sur la page détail).
-    Une seule vue par annonce et par session pour éviter les doublons (rafraîchissement, etc.).
+    Une seule vue par annonce et par visiteur pour éviter les doublons (rafraîchissement, etc.).
+    La vue est comptée en différé (ads.view_counter) : ni UPDATE de la ligne, ni écriture de session.
     """
-    ad = get_object_or_404(
-        Ad.objects.filter(status=Ad.Status.APPROVED),
-        slug=slug,
-    )
+    row = Ad.objects.filter(status=Ad.Status.APPROVED, slug=slug).values_list("id", "user_id").first()
+    if row is None:
+        from django.http import Http404
+        raise Http404
+    ad_id, owner_id = row
     # Ne pas compter si le visiteur est l'auteur de l'annonce (évite d'inflater ses propres stats)
-    if request.user.is_authenticated and ad.user_id == request.user.id:
+    if request.user.is_authenticated and owner_id == request.user.id:
         return JsonResponse({"ok": True, "recorded": False, "reason": "owner"})
 
-    session_views = request.session.get("ad_views_recorded") or []
-    if ad.id in session_views:
+    if not is_first_view(visitor_keys(request), ad_id):
         return JsonResponse({"ok": True, "recorded": False})
 
-    Ad.objects.filter(pk=ad.id).update(views_count=F("views_count") + 1)
-    session_views = list(session_views) + [ad.id]
-    request.session["ad_views_recorded"] = session_views
+    record_view(ad_id)
+    record_event(ad_id, AdEvent.Kind.VIEW)
+    return JsonResponse({"ok": True, "recorded": True})
+
+
+@csrf_exempt
+@require_POST
+@visitor_cookie
+def record_contact(request: HttpRequest, slug: str, channel: str) -> JsonResponse:
+    """
+    Enregistre un clic sur un bouton de contact (sms, whatsapp, call) de la page détail,
+    compté en différé dans AdContactDaily (ads.contacts). Mêmes exclusions que les vues.
+    """
+    if channel not in CONTACT_CHANNELS:
+        return JsonResponse({"ok": False, "error": "invalid channel"}, status=400)
+    row = Ad.objects.filter(status=Ad.Status.APPROVED, slug=slug).values_list("id", "user_id").first()
+    if row is None:
+        from django.http import Http404
+        raise Http404
+    ad_id, owner_id = row
+    if request.user.is_authenticated and owner_id == request.user.id:
+        return JsonResponse({"ok": True, "recorded": False, "reason": "owner"})
+
+    if not is_first_click(visitor_keys(request), ad_id, channel):
+        return JsonResponse({"ok": True, "recorded": False})
+
+    record_contact_click(ad_id, channel)
     return JsonResponse({"ok": True, "recorded": True})
 
 
@@ -357,8 +499,11 @@ def toggle_favorite(request: HttpRequest, ad_id: int) -> JsonResponse:
     """Ajoute ou retire une annonce des favoris de l'utilisateur (toggle)."""
     ad = get_object_or_404(Ad, pk=ad_id, status__in=[Ad.Status.APPROVED, Ad.Status.EXPIRED])
     fav, created = Favorite.objects.get_or_create(user=request.user, ad=ad)
-    if not created:
+    if created:
+        record_event(ad.pk, AdEvent.Kind.FAVORITE)
+    else:
         fav.delete()
+    update_favorite(request.user.pk, ad.pk, created)
     return JsonResponse({"favorited": created, "ad_id": ad_id})
 
 
@@ -367,8 +512,8 @@ def favorites_list(request: HttpRequest) -> HttpResponse:
     """Page listant les annonces mises en favoris par l'utilisateur connecté."""
     favs = (
         Favorite.objects.filter(user=request.user)
-        .select_related("ad", "ad__city", "ad__user", "ad__user__profile")
-        .prefetch_related("ad__media")
+        .only("id", "ad_id", "created_at")
+        .prefetch_related(Prefetch("ad", queryset=Ad.objects.cards()))
     )
     return render(request, "ads/favorites.html", {"favorites": favs})
 
@@ -395,7 +540,7 @@ def cron_bump_ads(request: HttpRequest) -> JsonResponse:
     from datetime import timedelta as _td
 
     now = _tz.now()
-    bumped = 0
+    bumped_ids = []
 
     # Annonces boostées actives (boost non expiré)
     boosted = Ad.objects.filter(
@@ -409,7 +554,7 @@ def cron_bump_ads(request: HttpRequest) -> JsonResponse:
         last = ad.bumped_at or now - interval  # si jamais initialisé
         if (now - last) >= interval:
             Ad.objects.filter(pk=ad.pk).update(bumped_at=now)
-            bumped += 1
+            bumped_ids.append(ad.pk)
 
     # Idem pour les annonces premium
     premiums = Ad.objects.filter(
@@ -422,15 +567,23 @@ def cron_bump_ads(request: HttpRequest) -> JsonResponse:
         last = ad.bumped_at or now - _td(hours=1)
         if (now - last) >= _td(hours=1):
             Ad.objects.filter(pk=ad.pk).update(bumped_at=now)
-            bumped += 1
+            bumped_ids.append(ad.pk)
 
-    return JsonResponse({"ok": True, "bumped": bumped, "checked_at": now.isoformat()})
+    # .update() ne déclenche pas de signal : resynchroniser le fil et les pages en cache
+    if bumped_ids:
+        sync_feed(bumped_ids)
+        from core.context_processors import invalidate_site_metrics_cache
+        invalidate_site_metrics_cache()
+
+    return JsonResponse({"ok": True, "bumped": len(bumped_ids), "checked_at": now.isoformat()})
 
 
 def cron_apply_watermarks(request: HttpRequest) -> JsonResponse:
     """
     Endpoint appelé par Vercel Cron toutes les heures pour appliquer le filigrane
-    aux images qui n'en ont pas encore (traitement par lots de 10).
+    aux images qui n'en ont pas encore : tours successifs réservés en SKIP LOCKED
+    et traités en parallèle (threads) dans le budget WATERMARK_CRON_BUDGET
+    (cf. ads.batch.drain_pending_watermarks). Répond avec les métriques de débit.
 
     Sécurité : accepte uniquement les requêtes Vercel Cron (X-Vercel-Cron: 1)
     ou les requêtes avec le bon CRON_SECRET en header.
@@ -442,37 +595,8 @@ def cron_apply_watermarks(request: HttpRequest) -> JsonResponse:
     if not is_vercel_cron and not has_secret:
         return JsonResponse({"error": "forbidden"}, status=403)
 
-    # Nombre total restant avant traitement
-    remaining_before = AdMedia.objects.filter(has_watermark=False).count()
-    if remaining_before == 0:
-        return JsonResponse({"ok": True, "processed": 0, "remaining": 0})
-
-    batch = list(AdMedia.objects.filter(has_watermark=False)[:10])
-    processed = 0
-    errors = 0
-    t0 = _time.monotonic()
-
-    for media in batch:
-        # Stopper si on approche 50 secondes (Vercel function timeout ~60s)
-        if _time.monotonic() - t0 > 50:
-            break
-        try:
-            media._watermark_applied = False
-            result = media._add_watermark_and_thumbnail()
-            if result:
-                media.save(update_fields=["image", "thumbnail", "has_watermark"])
-                processed += 1
-            else:
-                errors += 1
-        except Exception as exc:
-            import logging as _logging
-            _logging.getLogger(__name__).warning("cron_apply_watermarks media=%s : %s", media.pk, exc)
-            errors += 1
-
-    remaining_after = AdMedia.objects.filter(has_watermark=False).count()
-    return JsonResponse({
-        "ok": True,
-        "processed": processed,
-        "errors": errors,
-        "remaining": remaining_after,
-    })
+    stats = drain_pending_watermarks()
+    if stats["processed"] or stats["errors"]:
+        import logging as _logging
+        _logging.getLogger(__name__).info("cron_apply_watermarks : %s", stats)
+    return JsonResponse({"ok": True, **stats})
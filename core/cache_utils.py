@@ -0,0 +1,86 @@
+"""
+Utilitaires de cache partagés : verrous de régénération et stale-while-revalidate.
+
+Sans eux, l'expiration d'une page très consultée (accueil, liste d'une ville) ou
+l'incrément de version par invalidate_site_metrics_cache() envoie toutes les
+requêtes concurrentes sur la base en même temps. Avec swr_get / swr_set, l'entrée
+périmée reste servie pendant SWR_GRACE secondes et un seul worker (celui qui
+obtient le verrou) la régénère. Pour une entrée absente (froide ou évincée), seul
+ce worker la calcule pour le cache ; les autres rendent sans rien stocker.
+"""
+import time
+
+from django.core.cache import cache
+
+SWR_GRACE = 600  # durée pendant laquelle une entrée périmée peut encore être servie
+LOCK_TTL = 30  # un worker qui plante ne bloque pas la régénération plus longtemps
+
+
+def _lock_key(key: str) -> str:
+    return f"lock:{key}"
+
+
+def acquire_lock(key: str, ttl: int = LOCK_TTL) -> bool:
+    """True pour un seul appelant tant que le verrou n'est pas relâché ou expiré (cache.add atomique)."""
+    return cache.add(_lock_key(key), 1, ttl)
+
+
+def release_lock(key: str) -> None:
+    cache.delete(_lock_key(key))
+
+
+def _stamp() -> int:
+    # Valeur initiale horodatée : un compteur évincé du cache ne retombe pas sur une
+    # valeur déjà utilisée (et donc sur des entrées périmées encore en cache).
+    return int(time.time() * 1000)
+
+
+def get_version(key: str) -> int:
+    """Compteur de version stocké sous `key` (sans expiration), créé au besoin."""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _stamp(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(key: str) -> None:
+    """Incrémente le compteur `key` : les entrées stockées avec l'ancienne version sont périmées."""
+    try:
+        cache.incr(key)
+    except ValueError:  # compteur jamais lu ou évincé
+        cache.set(key, _stamp(), None)
+
+
+def swr_get(key: str, version=None):
+    """
+    Lit une entrée stale-while-revalidate. Retourne (valeur, à_régénérer) :
+      - entrée fraîche : (valeur, False) ;
+      - entrée périmée (TTL dépassé ou version différente) : (valeur périmée, False)
+        pour tous, sauf l'unique appelant qui obtient le verrou : (valeur, True) ;
+      - entrée absente : (None, True) pour l'unique appelant qui obtient le verrou,
+        (None, False) pour les autres, qui rendent sans cache (ni swr_set).
+    L'appelant qui reçoit True régénère puis appelle swr_set (ou swr_delete).
+    """
+    entry = cache.get(key)
+    if not isinstance(entry, dict) or "fresh_until" not in entry:
+        return None, acquire_lock(key)
+    if entry["fresh_until"] > time.time() and entry["version"] == version:
+        return entry["value"], False
+    return entry["value"], acquire_lock(key)
+
+
+def swr_set(key: str, value, ttl: int, version=None, grace: int = SWR_GRACE) -> None:
+    """Stocke `value`, fraîche pendant `ttl` s puis servable périmée pendant `grace` s."""
+    cache.set(
+        key,
+        {"value": value, "version": version, "fresh_until": time.time() + ttl},
+        ttl + grace,
+    )
+    release_lock(key)
+
+
+def swr_delete(key: str) -> None:
+    """Retire l'entrée (ex. l'annonce n'est plus publique : ne plus servir l'ancienne page)."""
+    cache.delete(key)
+    release_lock(key)
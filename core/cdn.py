@@ -0,0 +1,163 @@
+"""
+Cache CDN (Cloudflare) des pages HTML anonymes : étiquettes et purge.
+
+Les pages anonymes (liste, détail) portent un Cache-Control « s-maxage » et leurs
+étiquettes : en-tête Cache-Tag (Cloudflare, séparées par des virgules) et
+Surrogate-Key (Fastly & co., séparées par des espaces). Étiquettes :
+
+  - ad-<id>      page détail de l'annonce ;
+  - city-<id>    listes filtrées sur la ville, pages détail de ses annonces ;
+  - cat-<cat>    listes filtrées sur la catégorie, pages détail de la catégorie
+                 (annonces similaires) ;
+  - list-all     listes sans filtre ville / catégorie (accueil, recherche...) ;
+  - list         toutes les pages de liste.
+
+Les points d'invalidation (sync_feed et rebuild_feed pour chaque ligne du fil
+insérée, modifiée ou retirée, invalidate_site_metrics_cache) appellent
+purge_tags() : la purge part après le commit de la transaction, vers le backend
+CDN_PURGE_BACKEND (Cloudflare en production, LocalPurgeBackend sinon). Un échec de purge est journalisé, jamais
+propagé : le s-maxage borne la durée de vie d'une page non purgée.
+
+La règle de cache Cloudflare doit contourner le cache quand le cookie de session
+est présent : les pages des utilisateurs connectés ne sont jamais étiquetées.
+Une réponse qui pose un cookie (jeton CSRF, session...) n'est jamais partagée :
+Cloudflare ne la mettrait pas en cache et, forcé à le faire, servirait ce cookie
+à tout le monde. tag_response et SharedCacheCookieGuardMiddleware (cookies posés
+par les middlewares après la vue) retirent alors le s-maxage.
+"""
+import logging
+from collections import deque
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.cache import patch_cache_control
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+LIST_TAG = "list"
+LIST_ALL_TAG = "list-all"
+CLOUDFLARE_PURGE_URL = "https://api.cloudflare.com/client/v4/zones/{zone}/purge_cache"
+CLOUDFLARE_MAX_TAGS = 30  # étiquettes par appel à l'API de purge
+
+
+def ad_tag(ad_id) -> str:
+    return f"ad-{ad_id}"
+
+
+def city_tag(city_id) -> str:
+    return f"city-{city_id}"
+
+
+def category_tag(category: str) -> str:
+    return f"cat-{category}"
+
+
+def ad_tags(ad_id, city_id=None, category=None) -> list:
+    """Étiquettes des pages qui affichent l'annonce (sa page, listes de sa ville / catégorie)."""
+    tags = [ad_tag(ad_id)]
+    if city_id:
+        tags.append(city_tag(city_id))
+    if category:
+        tags.append(category_tag(category))
+    return tags
+
+
+def list_tags(city_id=None, category=None) -> list:
+    """Étiquettes d'une page de liste selon ses filtres."""
+    tags = [LIST_TAG]
+    if city_id:
+        tags.append(city_tag(city_id))
+    if category:
+        tags.append(category_tag(category))
+    if not city_id and not category:
+        tags.append(LIST_ALL_TAG)
+    return tags
+
+
+def tag_response(response, tags):
+    """Rend `response` (anonyme) cacheable par le CDN sous les étiquettes `tags`."""
+    if response.cookies:
+        return response
+    tags = sorted(set(tags))
+    response["Cache-Tag"] = ",".join(tags)
+    response["Surrogate-Key"] = " ".join(tags)
+    patch_cache_control(response, s_maxage=getattr(settings, "CDN_S_MAXAGE", 600))
+    return response
+
+
+def untag_response(response):
+    """Retire `response` du cache CDN (s-maxage, étiquettes) : elle devient privée."""
+    directives = [
+        d.strip() for d in response.get("Cache-Control", "").split(",")
+        if d.strip() and not d.strip().startswith("s-maxage")
+    ]
+    response["Cache-Control"] = ", ".join(directives)
+    for header in ("Cache-Tag", "Surrogate-Key"):
+        if header in response:
+            del response[header]
+    patch_cache_control(response, private=True)
+    return response
+
+
+class SharedCacheCookieGuardMiddleware:
+    """
+    Placé avant SessionMiddleware et CsrfViewMiddleware : voit les cookies qu'ils
+    posent (jeton CSRF d'un {% csrf_token %}, session) et rend la réponse privée.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if response.cookies and "s-maxage" in response.get("Cache-Control", ""):
+            untag_response(response)
+        return response
+
+
+# ─── Purge ────────────────────────────────────────────────────────────────────
+
+class LocalPurgeBackend:
+    """Sans CDN (dev, tests) : garde les étiquettes purgées en mémoire, rien n'est envoyé."""
+
+    # Partagé entre instances (une instance est créée par purge) ; borné : en
+    # production sans Cloudflare configuré, la liste ne grossit pas indéfiniment
+    purged = deque(maxlen=1000)
+
+    def purge(self, tags) -> None:
+        self.purged.extend(tags)
+        logger.debug("Purge CDN (locale) : %s", ", ".join(tags))
+
+
+class CloudflarePurgeBackend:
+    """Purge par étiquette via l'API Cloudflare (zone CLOUDFLARE_ZONE_ID)."""
+
+    def purge(self, tags) -> None:
+        import requests
+
+        url = CLOUDFLARE_PURGE_URL.format(zone=settings.CLOUDFLARE_ZONE_ID)
+        headers = {"Authorization": f"Bearer {settings.CLOUDFLARE_API_TOKEN}"}
+        for start in range(0, len(tags), CLOUDFLARE_MAX_TAGS):
+            resp = requests.post(
+                url, json={"tags": tags[start:start + CLOUDFLARE_MAX_TAGS]}, headers=headers, timeout=5
+            )
+            resp.raise_for_status()
+
+
+def get_purge_backend():
+    return import_string(getattr(settings, "CDN_PURGE_BACKEND", "core.cdn.LocalPurgeBackend"))()
+
+
+def _send(tags) -> None:
+    try:
+        get_purge_backend().purge(tags)
+    except Exception:
+        logger.exception("Purge CDN impossible (%d étiquettes)", len(tags))
+
+
+def purge_tags(tags) -> None:
+    """Purge les pages portant l'une des étiquettes, après le commit de la transaction en cours."""
+    tags = sorted({tag for tag in tags if tag})
+    if tags:
+        transaction.on_commit(lambda: _send(tags))
@@ -1,13 +1,11 @@
-from ads.models import Ad, City
+from ads.facets import get_listing_facets, invalidate_listing_facets
+from core.cache_utils import bump_version, get_version
+from core.cdn import LIST_TAG, purge_tags
 from django.conf import settings
 from django.core.cache import cache
-from django.db import models
 
-# Clés de cache partagées avec ads/views (invalider quand le nombre d'annonces change)
-CACHE_KEY_TOTAL_ADS = "total_approved_ads"
-CACHE_KEY_POPULAR_CITIES = "popular_cities_footer"
+# Clé de cache partagée avec ads/views (invalider quand le contenu de la liste change)
 CACHE_KEY_AD_LIST_VERSION = "ad_list_version"
-CACHE_TTL = 300  # 5 min
 
 
 def get_ad_list_version() -> int:
@@ -19,37 +17,66 @@ def get_ad_list_version() -> int:
     return v
 
 
-def invalidate_site_metrics_cache():
-    """À appeler après approbation/rejet/archivage d'annonces pour rafraîchir le footer et les compteurs."""
-    cache.delete(CACHE_KEY_TOTAL_ADS)
-    cache.delete(CACHE_KEY_POPULAR_CITIES)
-    # Incrémenter la version force la régénération de toutes les pages de liste
+def bump_ad_list_version():
+    """Incrémenter la version force la régénération de toutes les pages de liste."""
     v = cache.get(CACHE_KEY_AD_LIST_VERSION) or 1
     cache.set(CACHE_KEY_AD_LIST_VERSION, v + 1, None)
 
 
+def list_scope(city: str = "", category: str = "") -> str:
+    """
+    Portée d'invalidation d'une page de liste : sa ville (slug) si elle est filtrée
+    par ville, sinon sa catégorie, sinon « all ». Toute annonce affichée par la page
+    appartient à cette portée.
+    """
+    if city:
+        return f"city:{city}"
+    if category:
+        return f"cat:{category}"
+    return "all"
+
+
+def _scope_key(scope: str) -> str:
+    return f"{CACHE_KEY_AD_LIST_VERSION}:{scope}"
+
+
+def get_list_version(city: str = "", category: str = "") -> str:
+    """
+    Version des pages de liste (et de recherche, annonces similaires, détail) de la
+    portée donnée : version globale + version de la portée, lues en un get_many.
+    """
+    key = _scope_key(list_scope(city, category))
+    values = cache.get_many([CACHE_KEY_AD_LIST_VERSION, key])
+    scoped = values.get(key)
+    if scoped is None:
+        scoped = get_version(key)
+    glob = values.get(CACHE_KEY_AD_LIST_VERSION) or get_ad_list_version()
+    return f"{glob}.{scoped}"
+
+
+def bump_list_versions(scopes) -> None:
+    """Invalide les pages des portées données (cf. list_scope), et seulement elles."""
+    for scope in set(scopes):
+        bump_version(_scope_key(scope))
+
+
+def invalidate_site_metrics_cache():
+    """À appeler après approbation/rejet/archivage d'annonces pour rafraîchir le footer et les compteurs."""
+    invalidate_listing_facets()
+    bump_ad_list_version()
+    purge_tags([LIST_TAG])
+
+
 def site_metrics(request):
     """Expose site-wide lightweight metrics to templates (mis en cache pour limiter les requêtes)."""
-    total_approved_ads = cache.get(CACHE_KEY_TOTAL_ADS)
-    if total_approved_ads is None:
-        try:
-            total_approved_ads = Ad.objects.filter(status=Ad.Status.APPROVED, image_processing_done=True).count()
-            cache.set(CACHE_KEY_TOTAL_ADS, total_approved_ads, CACHE_TTL)
-        except Exception:
-            total_approved_ads = 0
-
-    popular_cities = cache.get(CACHE_KEY_POPULAR_CITIES)
-    if popular_cities is None:
-        try:
-            popular_cities = list(
-                City.objects.filter(ad__status=Ad.Status.APPROVED, ad__image_processing_done=True)
-                .annotate(ad_count=models.Count("ad", distinct=True))
-                .filter(ad_count__gt=0)
-                .order_by("-ad_count")[:6]
-            )
-            cache.set(CACHE_KEY_POPULAR_CITIES, popular_cities, CACHE_TTL)
-        except Exception:
-            popular_cities = []
+    # Mêmes facettes (un seul calcul coalescé) que la sidebar de la liste d'annonces
+    try:
+        facets = get_listing_facets()
+        total_approved_ads = facets["online_ads"]
+        popular_cities = facets["popular_cities_footer"]
+    except Exception:
+        total_approved_ads = 0
+        popular_cities = []
 
     return {
         "total_approved_ads": total_approved_ads,
@@ -108,3 +108,67 @@ def cron_purge_expired_ads(request: HttpRequest) -> JsonResponse:
     except Exception as e:
         logger.exception("cron_purge_expired_ads failed: %s", e)
         return JsonResponse({"ok": False, "error": str(e)}, status=500)
+
+
+@csrf_exempt
+@require_GET
+def cron_rebuild_ad_feed(request: HttpRequest) -> JsonResponse:
+    """Réconcilie le fil public précalculé avec la table Ad. Fréquence : 1×/heure."""
+    if not _check_auth(request):
+        return JsonResponse({"error": "Unauthorized"}, status=401)
+    try:
+        from ads.tasks import rebuild_ad_feed
+        result = rebuild_ad_feed()
+        logger.info("cron_rebuild_ad_feed: %s", result)
+        return JsonResponse({"ok": True, "result": str(result)})
+    except Exception as e:
+        logger.exception("cron_rebuild_ad_feed failed: %s", e)
+        return JsonResponse({"ok": False, "error": str(e)}, status=500)
+
+
+@csrf_exempt
+@require_GET
+def cron_flush_ad_counters(request: HttpRequest) -> JsonResponse:
+    """Reporte les vues et clics de contact en attente. Fréquence : 1×/minute (ou 5 min)."""
+    if not _check_auth(request):
+        return JsonResponse({"error": "Unauthorized"}, status=401)
+    try:
+        from ads.tasks import flush_ad_counters
+        result = flush_ad_counters()
+        logger.info("cron_flush_ad_counters: %s", result)
+        return JsonResponse({"ok": True, "result": str(result)})
+    except Exception as e:
+        logger.exception("cron_flush_ad_counters failed: %s", e)
+        return JsonResponse({"ok": False, "error": str(e)}, status=500)
+
+
+@csrf_exempt
+@require_GET
+def cron_rollup_ad_stats(request: HttpRequest) -> JsonResponse:
+    """Agrège les événements dans les statistiques quotidiennes des annonces. Fréquence : 1×/heure."""
+    if not _check_auth(request):
+        return JsonResponse({"error": "Unauthorized"}, status=401)
+    try:
+        from ads.tasks import rollup_ad_stats
+        result = rollup_ad_stats()
+        logger.info("cron_rollup_ad_stats: %s", result)
+        return JsonResponse({"ok": True, "result": str(result)})
+    except Exception as e:
+        logger.exception("cron_rollup_ad_stats failed: %s", e)
+        return JsonResponse({"ok": False, "error": str(e)}, status=500)
+
+
+@csrf_exempt
+@require_GET
+def cron_reconcile_facet_counts(request: HttpRequest) -> JsonResponse:
+    """Recalcule les compteurs de facettes (ville × catégorie × statut). Fréquence : 1×/jour."""
+    if not _check_auth(request):
+        return JsonResponse({"error": "Unauthorized"}, status=401)
+    try:
+        from ads.tasks import reconcile_ad_facet_counts
+        result = reconcile_ad_facet_counts()
+        logger.info("cron_reconcile_facet_counts: %s", result)
+        return JsonResponse({"ok": True, "result": str(result)})
+    except Exception as e:
+        logger.exception("cron_reconcile_facet_counts failed: %s", e)
+        return JsonResponse({"ok": False, "error": str(e)}, status=500)
@@ -0,0 +1,58 @@
+"""
+Requêtes conditionnelles (ETag / Last-Modified) pour les pages HTML.
+
+La vue calcule l'ETag à partir de ce qui détermine le contenu de la page (version
+de la liste, état des facettes, date de modification de l'annonce, état favori...)
+avant tout rendu : si le navigateur (ou le CDN) présente le même ETag, elle répond
+304 sans rendre le template. Une réponse déjà rendue et mise en cache garde ses
+propres validateurs (cached_conditional).
+
+Cache-Control « max-age=0, must-revalidate » : la copie du navigateur est
+revalidée à chaque visite, jamais servie périmée. Les pages des utilisateurs
+connectés (nav, favoris) sont en plus « private ».
+"""
+import hashlib
+from calendar import timegm
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+
+
+def page_etag(*parts) -> str:
+    """ETag fort (entre guillemets) calculé sur les éléments qui déterminent la page."""
+    raw = "|".join(str(part) for part in (getattr(settings, "RELEASE_ID", ""),) + parts)
+    return '"%s"' % hashlib.sha1(raw.encode("utf-8")).hexdigest()[:24]
+
+
+def _timestamp(dt):
+    return timegm(dt.utctimetuple()) if dt else None
+
+
+def not_modified(request, etag: str, last_modified=None, private: bool = False):
+    """Réponse 304 (validateurs inclus) si ceux de la requête correspondent, sinon None."""
+    response = get_conditional_response(request, etag=etag, last_modified=_timestamp(last_modified))
+    if response is not None:
+        set_validators(response, etag, last_modified, private)
+    return response
+
+
+def set_validators(response, etag: str, last_modified=None, private: bool = False):
+    response["ETag"] = etag
+    if last_modified:
+        response["Last-Modified"] = http_date(_timestamp(last_modified))
+    if private:
+        patch_cache_control(response, private=True, max_age=0, must_revalidate=True)
+    else:
+        patch_cache_control(response, max_age=0, must_revalidate=True)
+    return response
+
+
+def cached_conditional(request, response):
+    """Réponse en cache : 304 si la requête présente ses validateurs, sinon la réponse."""
+    etag = response.get("ETag")
+    if not etag:
+        return response
+    last_modified = parse_http_date_safe(response.get("Last-Modified", ""))
+    # Le 304 reprend ETag, Last-Modified, Cache-Control et Vary de la réponse
+    return get_conditional_response(request, etag=etag, last_modified=last_modified, response=response)
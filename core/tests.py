@@ -8,6 +8,7 @@ from io import BytesIO
 from unittest.mock import patch
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
 from django.utils import timezone
@@ -15,6 +16,9 @@ from django.utils import timezone
 from ads.models import Ad, AdMedia, City
 from moderation.models import Report
 from accounts.models import Profile
+from core.cache_utils import swr_get, swr_set
+from core.cdn import CLOUDFLARE_MAX_TAGS, LIST_ALL_TAG, LIST_TAG, LocalPurgeBackend, list_tags, purge_tags
+from core.context_processors import invalidate_site_metrics_cache
 
 User = get_user_model()
 
@@ -448,3 +452,84 @@ class ErrorHandlersTest(TestCase):
     def test_404_on_unknown_url(self):
         r = self.client.get("/cette-url-nexiste-absolument-pas/")
         self.assertEqual(r.status_code, 404)
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# Cache stale-while-revalidate
+# ═══════════════════════════════════════════════════════════════════════════════
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class StaleWhileRevalidateTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_fresh_entry_served(self):
+        swr_set("k", "page", 60, version=1)
+        self.assertEqual(swr_get("k", 1), ("page", False))
+
+    def test_missing_entry_computed_by_one_caller(self):
+        # Clé froide : un seul appelant calcule pour le cache, l'autre rend sans stocker
+        self.assertEqual(swr_get("absent"), (None, True))
+        self.assertEqual(swr_get("absent"), (None, False))
+        swr_set("absent", "page", 60)
+        self.assertEqual(swr_get("absent"), ("page", False))
+
+    def test_only_one_caller_regenerates_stale_entry(self):
+        swr_set("k", "ancienne", 60, version=1)
+        self.assertEqual(swr_get("k", 2), ("ancienne", True))
+        self.assertEqual(swr_get("k", 2), ("ancienne", False))
+        swr_set("k", "nouvelle", 60, version=2)
+        self.assertEqual(swr_get("k", 2), ("nouvelle", False))
+
+    def test_expired_ttl_is_stale(self):
+        with patch("core.cache_utils.time.time", return_value=1000.0):
+            swr_set("k", "page", 60)
+        with patch("core.cache_utils.time.time", return_value=1061.0):
+            self.assertEqual(swr_get("k"), ("page", True))
+
+
+# ═══════════════════════════════════════════════════════════════════════════════
+# CDN : étiquettes et purge
+# ═══════════════════════════════════════════════════════════════════════════════
+
+@override_settings(CDN_PURGE_BACKEND="core.cdn.LocalPurgeBackend")
+class CdnPurgeTest(TestCase):
+    def setUp(self):
+        LocalPurgeBackend.purged.clear()
+
+    def test_purge_sent_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            purge_tags(["ad-1", "", "ad-1", "list"])
+            self.assertEqual(list(LocalPurgeBackend.purged), [])
+        self.assertEqual(list(LocalPurgeBackend.purged), ["ad-1", "list"])
+
+    def test_local_purges_bounded(self):
+        LocalPurgeBackend().purge([f"ad-{i}" for i in range(5000)])
+        self.assertEqual(len(LocalPurgeBackend.purged), LocalPurgeBackend.purged.maxlen)
+        self.assertEqual(LocalPurgeBackend.purged[-1], "ad-4999")
+
+    def test_site_metrics_invalidation_purges_lists(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            invalidate_site_metrics_cache()
+        self.assertIn(LIST_TAG, LocalPurgeBackend.purged)
+
+    @override_settings(
+        CDN_PURGE_BACKEND="core.cdn.CloudflarePurgeBackend",
+        CLOUDFLARE_ZONE_ID="zone",
+        CLOUDFLARE_API_TOKEN="token",
+    )
+    def test_cloudflare_purge_batches_and_never_raises(self):
+        tags = [f"ad-{i}" for i in range(CLOUDFLARE_MAX_TAGS + 1)]
+        with patch("requests.post") as post:
+            with self.captureOnCommitCallbacks(execute=True):
+                purge_tags(tags)
+        self.assertEqual(post.call_count, 2)
+        self.assertIn("/zones/zone/purge_cache", post.call_args.args[0])
+
+        with patch("requests.post", side_effect=OSError("réseau")):
+            with self.captureOnCommitCallbacks(execute=True):
+                purge_tags(tags)  # journalisé, pas d'exception
+
+    def test_list_tags(self):
+        self.assertEqual(list_tags(), [LIST_TAG, LIST_ALL_TAG])
+        self.assertEqual(list_tags(3, "escorte_boy"), [LIST_TAG, "city-3", "cat-escorte_boy"])
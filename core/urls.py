@@ -30,4 +30,8 @@ urlpatterns = [
     path("cron/notify-1h/",     cron_views.cron_notify_1h,     name="cron_notify_1h"),
     path("cron/promote-boosts/", cron_views.cron_promote_boosts, name="cron_promote_boosts"),
     path("cron/purge-expired-ads/", cron_views.cron_purge_expired_ads, name="cron_purge_expired_ads"),
+    path("cron/rebuild-ad-feed/", cron_views.cron_rebuild_ad_feed, name="cron_rebuild_ad_feed"),
+    path("cron/flush-ad-counters/", cron_views.cron_flush_ad_counters, name="cron_flush_ad_counters"),
+    path("cron/rollup-ad-stats/", cron_views.cron_rollup_ad_stats, name="cron_rollup_ad_stats"),
+    path("cron/reconcile-facet-counts/", cron_views.cron_reconcile_facet_counts, name="cron_reconcile_facet_counts"),
 ]
@@ -11,6 +11,7 @@ from django.core.exceptions import ValidationError
 from django.conf import settings
 from django.views.static import serve
 from django.contrib.auth import get_user_model
+from ads.imaging import delete_variants
 from ads.models import Ad, AdMedia
 from ads.forms import AdForm
 from accounts.models import Profile
@@ -312,6 +313,7 @@ def edit_ad(request: HttpRequest, ad_id: int) -> HttpResponse:
                 # Supprimer toutes les images existantes
                 existing_media = AdMedia.objects.filter(ad=ad)
                 for media in existing_media:
+                    delete_variants(media.variants, media.image.storage)
                     if media.image:
                         media.image.delete(save=False)
                     media.delete()
@@ -390,14 +392,26 @@ def dashboard(request: HttpRequest) -> HttpResponse:
     from django.core.paginator import Paginator
     qs = (
         Ad.objects.filter(user=request.user)
-        .select_related("city")
+        .cards()
         .order_by("-created_at")
-        .prefetch_related("media")
     )
     paginator = Paginator(qs, 20)
     page = request.GET.get("page", "1")
     my_ads = paginator.get_page(page)
 
+    # Clics de contact des 30 derniers jours (AdContactDaily) et courbe des 14 derniers
+    # jours (AdDailyStats) : deux requêtes pour la page, sur les tables agrégées
+    from ads.analytics import daily_series
+    from ads.contacts import STATS_DAYS, contact_totals
+    ad_ids = [ad.pk for ad in my_ads]
+    totals = contact_totals(ad_ids)
+    series = daily_series(ad_ids)
+    for ad in my_ads:
+        ad.contact_counts = totals.get(ad.pk, {})
+        ad.contacts_total = sum(ad.contact_counts.values())
+        ad.activity = series[ad.pk]
+        ad.activity_max = max([1] + [p["views"] + p["contacts"] for p in ad.activity])
+
     now = timezone.now()
     two_days_from_now = now + timezone.timedelta(days=2)
     return render(request, "core/dashboard.html", {
@@ -407,6 +421,7 @@ def dashboard(request: HttpRequest) -> HttpResponse:
         "profile": profile,
         "now": now,
         "two_days_from_now": two_days_from_now,
+        "contact_stats_days": STATS_DAYS,
     })
 
 
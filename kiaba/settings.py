@@ -14,6 +14,7 @@ This settings module is configured for:
 """
 
 from pathlib import Path
+import json
 import os
 import sys
 import logging
@@ -220,6 +221,7 @@ MIDDLEWARE = [
     # En dev on désactive les redirections HTTP->HTTPS pour pouvoir utiliser http://127.0.0.1
     "core.middleware.RedirectMiddleware",  # Redirections HTTP->HTTPS et www->non-www (désactivé si DEBUG=True, voir plus bas)
     "core.middleware.CloudflareMiddleware",  # Récupère l'IP réelle depuis Cloudflare (CF-Connecting-IP)
+    "core.cdn.SharedCacheCookieGuardMiddleware",  # Pas de s-maxage sur une réponse qui pose un cookie
     "corsheaders.middleware.CorsMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -561,6 +563,20 @@ else:
         }
     }
 
+# Identifiant du déploiement, mêlé aux ETag des pages HTML (core/http_cache.py) :
+# un déploiement (templates modifiés) invalide les copies gardées par les navigateurs
+RELEASE_ID = os.environ.get("RENDER_GIT_COMMIT") or os.environ.get("VERCEL_GIT_COMMIT_SHA", "")
+
+# CDN : pages anonymes cacheables au bord (s-maxage) et purgées par étiquette (core/cdn.py)
+CLOUDFLARE_ZONE_ID = os.environ.get("CLOUDFLARE_ZONE_ID", "").strip()
+CLOUDFLARE_API_TOKEN = os.environ.get("CLOUDFLARE_API_TOKEN", "").strip()
+CDN_PURGE_BACKEND = os.environ.get("CDN_PURGE_BACKEND", "").strip() or (
+    "core.cdn.CloudflarePurgeBackend"
+    if CLOUDFLARE_ZONE_ID and CLOUDFLARE_API_TOKEN
+    else "core.cdn.LocalPurgeBackend"
+)
+CDN_S_MAXAGE = int(os.environ.get("CDN_S_MAXAGE", "600"))
+
 # DRF (throttling for rate limiting contact clicks)
 REST_FRAMEWORK = {
     "DEFAULT_THROTTLE_CLASSES": [
@@ -775,6 +791,26 @@ CELERY_BEAT_SCHEDULE = {
         "task": "ads.tasks.purge_expired_ads",
         "schedule": 60 * 60 * 24,  # toutes les 24h
     },
+    # Réconcilie le fil public précalculé (AdFeedEntry) avec la table Ad — toutes les heures
+    "rebuild-ad-feed-hourly": {
+        "task": "ads.tasks.rebuild_ad_feed",
+        "schedule": 60 * 60,  # toutes les heures
+    },
+    # Reporte les compteurs différés (vues, clics de contact) en base — toutes les minutes
+    "flush-ad-counters": {
+        "task": "ads.tasks.flush_ad_counters",
+        "schedule": 60,  # toutes les minutes
+    },
+    # Statistiques quotidiennes des annonces (AdDailyStats) depuis les événements — toutes les heures
+    "rollup-ad-stats-hourly": {
+        "task": "ads.tasks.rollup_ad_stats",
+        "schedule": 60 * 60,  # toutes les heures
+    },
+    # Réconcilie les compteurs de facettes (AdFacetCount) avec la table Ad — 1×/jour
+    "reconcile-ad-facet-counts-daily": {
+        "task": "ads.tasks.reconcile_ad_facet_counts",
+        "schedule": 60 * 60 * 24,  # toutes les 24h
+    },
 }
 
 # Traitement des images (filigrane + miniature) en arrière-plan pour réponses rapides (post / edit annonce).
@@ -784,6 +820,16 @@ USE_ASYNC_IMAGE_PROCESSING = (
     and os.environ.get("USE_ASYNC_IMAGE_PROCESSING", "true").lower() in ("true", "1", "yes")
 )
 
+# Variantes responsive des photos d'annonces (ads/imaging.py, srcset) : largeurs en px et
+# formats par ordre de préférence. « avif » est optionnel (à mettre en tête) : ignoré si
+# Pillow ne sait pas l'encoder.
+AD_IMAGE_VARIANT_WIDTHS = [
+    int(w) for w in os.environ.get("AD_IMAGE_VARIANT_WIDTHS", "160,320,640,1000").split(",") if w.strip()
+]
+AD_IMAGE_VARIANT_FORMATS = [
+    f.strip().lower() for f in os.environ.get("AD_IMAGE_VARIANT_FORMATS", "webp,jpeg").split(",") if f.strip()
+]
+
 # Sitemaps
 SITEMAP_PROTOCOL = "https"
 
@@ -874,6 +920,27 @@ HCAPTCHA_SECRET  = os.environ.get("HCAPTCHA_SECRET",  "0x00000000000000000000000
 # ── Cron jobs (endpoints protégés appelés par Vercel Cron + cron-job.org) ─────
 CRON_SECRET = os.environ.get("CRON_SECRET", "").strip()
 
+
+
+def _vercel_max_duration(default=60):
+    """maxDuration (s) de la fonction déclarée dans vercel.json (builds[].config)."""
+    try:
+        with open(BASE_DIR / "vercel.json") as f:
+            builds = json.load(f).get("builds", [])
+        return int(next(b["config"]["maxDuration"] for b in builds if "maxDuration" in b.get("config", {})))
+    except (OSError, ValueError, KeyError, StopIteration):
+        return default
+
+
+# Durée maximale d'une invocation (timeout de la plateforme) : aussi la durée des
+# baux posés par le cron sur les photos en cours de traitement
+FUNCTION_MAX_DURATION = int(os.environ.get("FUNCTION_MAX_DURATION", _vercel_max_duration()))
+
+# cron_apply_watermarks : temps de traitement par appel (s, 10 s sous FUNCTION_MAX_DURATION
+# pour finir le lot en cours et répondre) et threads de traitement d'image
+WATERMARK_CRON_BUDGET = float(os.environ.get("WATERMARK_CRON_BUDGET", max(FUNCTION_MAX_DURATION - 10, 1)))
+WATERMARK_CRON_WORKERS = int(os.environ.get("WATERMARK_CRON_WORKERS", "4"))
+
 # ── GeniusPay (agrégateur de paiement mobile money + carte) ──────────────────
 # Dashboard : https://pay.genius.ci  (sandbox) / https://pay.genius.ci (live)
 # Clés publique/secrète disponibles dans vos paramètres GeniusPay.
@@ -28,6 +28,12 @@ while [ $RETRY_COUNT -lt $MAX_RETRIES ]; do
     fi
 done
 
+# Remplir / réconcilier le fil public précalculé (idempotent : seules les lignes
+# qui ont dérivé sont réécrites). Nécessaire après la migration 0019 qui le crée vide.
+echo ""
+echo "Step 1b: Rebuilding the public ad feed..."
+python manage.py rebuild_ad_feed || echo "⚠ rebuild_ad_feed failed, the hourly cron will retry"
+
 # Créer le Site Django si nécessaire
 echo ""
 echo "Step 2: Setting up Django Site..."